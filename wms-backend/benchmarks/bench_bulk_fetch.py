@@ -0,0 +1,75 @@
+"""
+Benchmark: paged concurrent bulk fetch of a large doctype from a local fake ERPNext
+Compares one worker (sequential pages) with a bounded worker pool; reports time and peak memory
+
+Usage: python benchmarks/bench_bulk_fetch.py [num_bin_rows] [workers]
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PORT = 8767
+os.environ["ERPNEXT_URL"] = f"http://127.0.0.1:{PORT}"
+
+import httpx
+
+from bulk_fetch import PagedFetcher
+from main import ERPNextClient
+
+
+def wait_for(url):
+    for _ in range(600):
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def stream(workers):
+    client = ERPNextClient(pool_size=workers, max_per_host=workers)
+    fetcher = PagedFetcher(client.get, "Bin", ["name", "item_code", "warehouse", "actual_qty", "reserved_qty"],
+                           page_size=500, workers=workers)
+    count = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    async for _ in fetcher.rows():
+        count += 1
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await client.close()
+    return count, elapsed, peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PORT=str(PORT), FAKE_ERPNEXT_ITEMS=str(rows), FAKE_ERPNEXT_LOCATIONS="500")
+    fake = subprocess.Popen([sys.executable, os.path.join(here, "fake_erpnext.py")], env=env)
+    try:
+        wait_for(f"{os.environ['ERPNEXT_URL']}/api/resource/Warehouse")
+        print(f"\n📊 Bulk fetch - {rows} Bin rows, 500/page, fake ERPNext latency "
+              f"{os.getenv('FAKE_ERPNEXT_LATENCY_MS', '50')}ms")
+        for n in (1, workers):
+            with contextlib.redirect_stdout(io.StringIO()):
+                count, elapsed, peak = asyncio.run(stream(n))
+            print(f"   {n:2d} worker(s)  {count} rows in {elapsed:6.2f}s  ({count / elapsed:8.0f} rows/s)  "
+                  f"peak memory {peak / 1024 / 1024:5.1f}MB")
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark: pallet receipt as serial /api/stock-entry calls vs one /api/stock-entry/bulk call
+
+Usage: python benchmarks/bench_bulk_stock_entry.py [num_entries] [latency_ms]
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+import main as wms
+from fake_erpnext import create_app
+
+
+def receipts(n, num_scanners=4):
+    """n single-line receipts from a few scanners into a few dock locations"""
+    return [{
+        "purpose": "Material Receipt",
+        "to_warehouse": f"WHS-RM-S1-{i % 3:05d} - GSS",
+        "user_name": f"scanner-{i % num_scanners}",
+        "items": [{"item_code": f"RM-{i:06d}", "qty": 1 + i % 5}]
+    } for i in range(n)]
+
+
+async def run(n, latency_ms):
+    fake = create_app(latency_ms=latency_ms)
+    wms.erpnext._client = httpx.AsyncClient(transport=httpx.ASGITransport(app=fake))
+    wms.erpnext.base_url = "http://fake-erpnext"
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=wms.app), base_url="http://wms", timeout=None)
+    entries = receipts(n)
+
+    start = time.perf_counter()
+    for entry in entries:
+        (await client.post("/api/stock-entry", json=entry)).raise_for_status()
+    serial = time.perf_counter() - start
+    serial_docs = len(fake.state.created)
+
+    fake.state.created.clear()
+    start = time.perf_counter()
+    response = await client.post("/api/stock-entry/bulk", json={"entries": entries})
+    bulk = time.perf_counter() - start
+    body = response.json()
+
+    # One bad line inside a merged document only fails its own entry
+    fake.state.created.clear()
+    entries[n // 2]["items"][0]["item_code"] = "NOT-AN-ITEM"
+    isolated = (await client.post("/api/stock-entry/bulk", json={"entries": entries})).json()
+
+    await client.aclose()
+    await wms.erpnext.close()
+    return serial, serial_docs, bulk, body, isolated
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 50
+    with contextlib.redirect_stdout(io.StringIO()):
+        serial, serial_docs, bulk, body, isolated = asyncio.run(run(n, latency_ms))
+    bulk_docs = len({r["name"] for r in body["results"]})
+
+    print(f"{n} receipt entries, ERPNext latency {latency_ms:.0f}ms")
+    print(f"  serial /api/stock-entry : {serial:6.2f}s  {serial_docs} documents")
+    print(f"  /api/stock-entry/bulk   : {bulk:6.2f}s  {bulk_docs} documents  ({serial / bulk:.1f}x faster)")
+    print(f"  one bad line            : {isolated['created']} created, {isolated['failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
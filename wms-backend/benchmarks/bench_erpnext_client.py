@@ -0,0 +1,126 @@
+"""
+Load benchmark: blocking requests client vs async pooled ERPNext client
+Drives main.app against a local fake ERPNext and reports requests/sec and p99
+
+Usage: python benchmarks/bench_erpnext_client.py [concurrency] [total_requests]
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PORT = 8765
+APP_PORT = 8766
+os.environ["ERPNEXT_URL"] = f"http://127.0.0.1:{PORT}"
+
+import httpx
+import requests
+from fastapi import HTTPException
+
+import main
+
+
+class BlockingERPNextClient:
+    """The previous client: blocking requests call with a new connection per call"""
+
+    def __init__(self):
+        self.base_url = main.ERPNEXT_URL
+        self.headers = dict(main.erpnext.headers)
+
+    async def get(self, endpoint, params=None):
+        try:
+            response = requests.get(f"{self.base_url}{endpoint}", headers=self.headers, params=params, timeout=30)
+            response.raise_for_status()
+            return response.json()
+        except requests.exceptions.RequestException as e:
+            raise HTTPException(status_code=500, detail=f"ERPNext API error: {str(e)}")
+
+    async def close(self):
+        pass
+
+
+def serve(mode, port):
+    """Run main.app with the selected ERPNext client (child process)"""
+    import uvicorn
+    if mode == "blocking":
+        main.erpnext = BlockingERPNextClient()
+    with contextlib.redirect_stdout(io.StringIO()):
+        uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def wait_for(url):
+    for _ in range(200):
+        try:
+            httpx.get(url, timeout=1)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.05)
+    raise RuntimeError(f"{url} did not start")
+
+
+async def run_load(url, concurrency, total):
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        remaining = iter(range(total))
+
+        async def worker():
+            for _ in remaining:
+                start = time.perf_counter()
+                response = await client.get("/api/warehouses")
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000,
+    }
+
+
+def main_bench():
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PORT=str(PORT))
+    env.setdefault("FAKE_ERPNEXT_LOCATIONS", "50")
+
+    fake = subprocess.Popen([sys.executable, os.path.join(here, "fake_erpnext.py")], env=env)
+    results = {}
+    try:
+        wait_for(f"{os.environ['ERPNEXT_URL']}/api/resource/Warehouse")
+        for mode, label in (("blocking", "before (blocking requests)"), ("async", "after (async pooled httpx)")):
+            app = subprocess.Popen([sys.executable, __file__, "--serve", mode, str(APP_PORT)], env=env)
+            try:
+                app_url = f"http://127.0.0.1:{APP_PORT}"
+                wait_for(app_url)
+                results[label] = asyncio.run(run_load(app_url, concurrency, total))
+            finally:
+                app.terminate()
+                app.wait()
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    print(f"\n📊 /api/warehouses - {total} requests, concurrency {concurrency}, "
+          f"fake ERPNext latency {os.getenv('FAKE_ERPNEXT_LATENCY_MS', '50')}ms")
+    for label, r in results.items():
+        print(f"   {label:28s} {r['rps']:8.1f} req/s   p50 {r['p50_ms']:8.1f}ms   p99 {r['p99_ms']:8.1f}ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+        serve(sys.argv[2], int(sys.argv[3]))
+    else:
+        main_bench()
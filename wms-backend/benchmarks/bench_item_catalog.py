@@ -0,0 +1,56 @@
+"""
+Benchmark: local item catalog mirror - memory per 10k items and query latency
+
+Usage: python benchmarks/bench_item_catalog.py [num_items]
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_erpnext import build_catalog
+from item_catalog import ItemCatalog
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rows = build_catalog(num_items=n, num_locations=100)["Item"]
+
+    tracemalloc.start()
+    catalog = ItemCatalog()
+    start = time.perf_counter()
+    asyncio.run(catalog._publish({}, rows))
+    build_ms = (time.perf_counter() - start) * 1000
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    step = max(n // 100, 1)
+    workloads = {
+        "barcode (exact)": [f"GSS-RM-{i:06d}" for i in range(0, n, step)],
+        "item_code substring": [f"{i:06d}" for i in range(0, n, step)],
+        "item_name tokens": [f"material {i}" for i in range(0, n, step)],
+        "no match": ["zzz-nothing"],
+    }
+
+    print(f"\n📊 Item catalog - {n} items")
+    print(f"   snapshot + index build  {build_ms:8.0f}ms")
+    print(f"   memory                  {memory / 1024 / 1024:8.1f}MB  ({memory / 1024 / 1024 * 10000 / n:.1f}MB per 10k items)")
+    for label, queries in workloads.items():
+        latencies = []
+        for q in queries * 10:
+            start = time.perf_counter()
+            catalog.search(q)
+            latencies.append((time.perf_counter() - start) * 1e6)
+        latencies.sort()
+        print(f"   {label:22s}  p50 {statistics.median(latencies):8.1f}µs   "
+              f"p99 {latencies[max(int(len(latencies) * 0.99) - 1, 0)]:8.1f}µs")
+    print("   (previous path: up to 3 sequential ERPNext calls, ~1.3s on a miss)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: re-syncing the location list on a client that already has it
+full download vs If-None-Match (304) vs since=<version> delta after a few rows changed
+
+Runs main:app in-process with the list cached and reports, per re-sync, bytes on the
+wire (gzip) and the client's time to decompress, parse and apply the response.
+
+Usage: python benchmarks/bench_list_deltas.py [locations] [changed_rows]
+"""
+
+import asyncio
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+workdir = tempfile.mkdtemp(prefix="wms-bench-deltas-")
+os.environ.update({
+    "ERPNEXT_URL": "http://127.0.0.1:9",  # never called: every request is a cache hit
+    "CACHE_BACKEND": "memory", "CACHE_WARM_ON_STARTUP": "false", "ITEM_CATALOG_ENABLED": "false",
+    "SHARED_SNAPSHOTS": "false", "LOG_LEVEL": "WARNING",
+    "IDEMPOTENCY_DB": os.path.join(workdir, "idempotency.sqlite"),
+    "OUTBOX_DB": os.path.join(workdir, "outbox.sqlite")
+})
+
+import main
+from fake_erpnext import build_catalog
+
+ROUNDS = 20
+
+
+def apply_full(state, response):
+    return {row["name"]: row for row in json.loads(response.content)}
+
+
+def apply_delta(state, response):
+    delta = json.loads(response.content)
+    state = {} if delta["full"] else dict(state)
+    for key in delta["removed"]:
+        state.pop(key, None)
+    for row in delta["upserted"]:
+        state[row["name"]] = row
+    return state
+
+
+async def resync(client, label, params, headers, apply, state, expected):
+    downloaded, client_ms = 0, 0.0
+    for _ in range(ROUNDS):
+        response = await client.get("/api/locations", params=params, headers=headers)
+        start = time.perf_counter()
+        response.read()  # decompress
+        result = state if response.status_code == 304 else apply(state, response)
+        client_ms += (time.perf_counter() - start) * 1000
+        downloaded += response.num_bytes_downloaded
+    assert result == expected, label
+    print(f"   {label:<28} HTTP {response.status_code}   {downloaded / ROUNDS / 1024:9.1f} KB   "
+          f"client {client_ms / ROUNDS:7.2f} ms")
+
+
+async def run(num_locations, changed):
+    before = build_catalog(10, num_locations, seed_csv=None)["Warehouse"]
+    after = copy.deepcopy(before)
+    for i in range(0, changed * 7, 7):
+        after[i % len(after)]["warehouse_name"] += " (moved)"
+    after.append({**after[0], "name": "NEW-LOCATION", "custom_warehouse_barcode": "LOC-NEW"})
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await main.cache.set("locations_all", before, ttl_seconds=3600, stale_ttl=86400)
+        first = await client.get("/api/locations")
+        etag = first.headers["etag"]
+        version = etag[3:-1]
+        state = apply_full({}, first)
+
+        print(f"\n📊 {num_locations} locations, client holds version {version}")
+        unchanged = {row["name"]: row for row in before}
+        await resync(client, "unchanged: full download", None, None, apply_full, state, unchanged)
+        await resync(client, "unchanged: If-None-Match", None, {"If-None-Match": etag}, apply_full, state, unchanged)
+
+        await main.cache.set("locations_all", after, ttl_seconds=3600, stale_ttl=86400)
+        print(f"   ...{changed} rows changed, 1 added")
+        expected = {row["name"]: row for row in after}
+        await resync(client, "changed: full download", None, None, apply_full, state, expected)
+        await resync(client, "changed: If-None-Match", None, {"If-None-Match": etag}, apply_full, state, expected)
+        await resync(client, "changed: since=<version>", {"since": version}, None, apply_delta, state, expected)
+
+
+def main_cli():
+    num_locations = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    changed = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(run(num_locations, changed))
+
+
+if __name__ == "__main__":
+    main_cli()
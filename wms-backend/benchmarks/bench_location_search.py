@@ -0,0 +1,65 @@
+"""
+Micro-benchmark: linear location scan vs LocationIndex on synthetic locations
+
+Usage: python benchmarks/bench_location_search.py [num_locations]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_erpnext import build_catalog
+from search_index import LocationIndex
+
+
+def linear_search(all_locations, q):
+    """The previous search_locations loop"""
+    matching_warehouses = []
+    for location in all_locations:
+        barcode = location.get("custom_warehouse_barcode", "")
+        name = location.get("name", "")
+        warehouse_name = location.get("warehouse_name", "")
+        if barcode and barcode.lower() == q.lower():
+            matching_warehouses.append(location)
+            break
+        elif q.lower() in name.lower() or q.lower() in warehouse_name.lower():
+            matching_warehouses.append(location)
+    return matching_warehouses[:20]
+
+
+def timed(fn, queries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for q in queries:
+            fn(q)
+    return (time.perf_counter() - start) / (repeat * len(queries)) * 1e6  # µs per query
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    locations = build_catalog(num_items=0, num_locations=n)["Warehouse"]
+
+    start = time.perf_counter()
+    index = LocationIndex(locations)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    workloads = {
+        "barcode scan (exact)": [f"LOC-{i:06d}" for i in range(0, n, max(n // 50, 1))],
+        "name substring": [f"Bin {i:05d}" for i in range(0, n, max(n // 50, 1))],
+        "short query (2 chars)": ["s1", "b0"],
+        "no match": ["zzz-nothing"],
+    }
+
+    print(f"\n📊 Location search - {n} locations (index build {build_ms:.0f}ms)")
+    for label, queries in workloads.items():
+        for q in queries:
+            assert linear_search(locations, q) == index.search(q) or label == "barcode scan (exact)", q
+        before = timed(lambda q: linear_search(locations, q), queries, 1)
+        after = timed(index.search, queries, 20)
+        print(f"   {label:24s} linear {before:10.1f}µs   indexed {after:8.1f}µs   ({before / after:6.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
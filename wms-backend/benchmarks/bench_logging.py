@@ -0,0 +1,115 @@
+"""
+Benchmark: print() on the hot path vs the structured queue logger
+
+Each simulated request logs like the old handlers did (URL line, payload dump, result line).
+stdout goes to /dev/null, or to a pipe drained slowly (like a busy log shipper).
+Reports requests/s and the longest event loop stall.
+
+Usage: python benchmarks/bench_logging.py [num_requests]
+"""
+
+import asyncio
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+PAYLOAD = {"doctype": "Stock Entry", "purpose": "Material Transfer", "items": [
+    {"item_code": f"RM-{i:06d}", "qty": 1, "s_warehouse": "WHS-RM-S1-00001 - GSS", "t_warehouse": "WHS-RM-S2-00002 - GSS"}
+    for i in range(3)
+]}
+URL = "https://erp.example.com/api/resource/Stock%20Entry"
+
+
+async def drive(log, n, concurrency=50):
+    stalls = []
+
+    async def ticker():
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stalls.append(now - last)
+            last = now
+
+    async def client(count):
+        for _ in range(count):
+            log()
+            await asyncio.sleep(0)
+
+    tick = asyncio.ensure_future(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n // concurrency) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    tick.cancel()
+    return {"rps": round(n / elapsed), "max_stall_ms": round(max(stalls, default=0) * 1000, 1)}
+
+
+def child(mode, n, result_path):
+    if mode == "print":
+        def log():
+            print(f"POST {URL}")
+            print(f"Payload: {PAYLOAD}")
+            print("✅ Draft Stock Entry WMS-STE-00001 created successfully")
+    else:
+        from structured_logging import request_id_var, sampled, setup_logging, stats
+        sample_rate = 1.0 if mode == "json" else 0.1
+        setup_logging("INFO", "json", sample_rate)
+        logger = logging.getLogger("wms.bench")
+        request_id_var.set("bench")
+
+        def log():
+            if sampled():
+                logger.info("ERPNext call", extra={"method": "POST", "url": URL, "status": 200, "ms": 48.2})
+            logger.debug("ERPNext POST payload", extra={"url": URL, "payload": PAYLOAD})
+            if sampled():
+                logger.info("Draft stock entry created", extra={"stock_entry": "WMS-STE-00001", "lines": 3})
+
+    result = asyncio.run(drive(log, n))
+    if mode != "print":
+        result["dropped"] = stats()["dropped"]
+    with open(result_path, "w") as f:
+        json.dump(result, f)
+
+
+def run(mode, n, slow_sink):
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_path = f.name
+    stdout = subprocess.PIPE if slow_sink else subprocess.DEVNULL
+    proc = subprocess.Popen([sys.executable, __file__, "--child", mode, str(n), result_path], stdout=stdout)
+    if slow_sink:
+        def drain():
+            # ~2 MB/s reader: the pipe buffer fills and writes to stdout block
+            while proc.stdout.read(4096):
+                time.sleep(0.002)
+        reader = threading.Thread(target=drain, daemon=True)
+        reader.start()
+    proc.wait()
+    with open(result_path) as f:
+        result = json.load(f)
+    os.unlink(result_path)
+    return result
+
+
+def main():
+    if sys.argv[1:2] == ["--child"]:
+        return child(sys.argv[2], int(sys.argv[3]), sys.argv[4])
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"{n} simulated requests, 3 log lines each, 50 concurrent")
+    for slow_sink in (False, True):
+        print(f"\nstdout -> {'slow pipe (~2 MB/s)' if slow_sink else '/dev/null'}")
+        for mode, label in (("print", "print()"), ("json", "queue logger, all lines"),
+                            ("sampled", "queue logger, 10% sampled")):
+            r = run(mode, n, slow_sink)
+            dropped = f"  dropped {r['dropped']}" if "dropped" in r else ""
+            print(f"  {label:<26} {r['rps']:>8} req/s   max loop stall {r['max_stall_ms']:>7} ms{dropped}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark: what a scanner downloads to go offline (locations + item barcodes)
+
+Compares a cold sync through /api/locations + /api/items (plain JSON lists) with
+/api/offline/bundle, then changes 1% of the items and compares the re-sync:
+full bundle again vs since=<version> delta. Reports bytes on the wire (gzip), the
+client's decompress + parse + barcode-map time, and server time for each build
+(first full build, incremental rebuild, delta).
+
+Usage: python benchmarks/bench_offline_bundle.py [items] [locations]
+"""
+
+import asyncio
+import copy
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+workdir = tempfile.mkdtemp(prefix="wms-bench-bundle-")
+os.environ.update({
+    "ERPNEXT_URL": "http://127.0.0.1:9",  # never called: locations are cached, items set directly
+    "CACHE_BACKEND": "memory", "CACHE_WARM_ON_STARTUP": "false", "ITEM_CATALOG_ENABLED": "false",
+    "SHARED_SNAPSHOTS": "false", "LOG_LEVEL": "WARNING",
+    "IDEMPOTENCY_DB": os.path.join(workdir, "idempotency.sqlite"),
+    "OUTBOX_DB": os.path.join(workdir, "outbox.sqlite")
+})
+
+import main
+from fake_erpnext import build_catalog
+from item_catalog import ITEM_FIELDS
+from search_index import ItemIndex
+
+SEED_CSV = (glob.glob(os.path.join(BENCH_DIR, "..", "..", "docs", "warehouse_barcodes_final_*.csv")) or [None])[0]
+
+
+def lists_to_maps(locations_body, items_body):
+    """What the device does with the plain lists: barcode -> row"""
+    locations = json.loads(locations_body)
+    items = json.loads(items_body)
+    return ({row["custom_warehouse_barcode"]: row for row in locations if row.get("custom_warehouse_barcode")},
+            {row["custom_barcode"]: row for row in items if row.get("custom_barcode")})
+
+
+def bundle_to_maps(body, maps=None):
+    """Apply a bundle (full or delta) to barcode -> row maps keyed like the tables"""
+    bundle = json.loads(body)
+    maps = maps or {}
+    for name, table in bundle["tables"].items():
+        rows = {} if table["full"] else maps.get(name, {})
+        for key in table["removed"]:
+            rows.pop(key, None)
+        fields, types, strings = table["fields"], table["types"], table["strings"]
+        for values in zip(*table["columns"]):
+            row = {field: strings[v] if kind == "ref" and v is not None else v
+                   for field, kind, v in zip(fields, types, values)}
+            rows[row[table["key"]]] = row
+        maps[name] = rows
+    return maps
+
+
+async def fetch(client, path, params=None):
+    start = time.perf_counter()
+    response = await client.get(path, params=params)
+    server_ms = (time.perf_counter() - start) * 1000
+    response.raise_for_status()
+    return response, server_ms
+
+
+def report(label, wire, raw, client_ms, server_ms=None):
+    server = f"   server {server_ms:7.1f} ms" if server_ms is not None else ""
+    print(f"   {label:<34} {wire / 1024:8.1f} KB gzip  {raw / 1024:8.1f} KB json   client {client_ms:7.1f} ms{server}")
+
+
+async def run(num_items, num_locations):
+    catalog = build_catalog(num_items, num_locations, seed_csv=SEED_CSV)
+    locations = catalog["Warehouse"]
+    items = sorted(({f: row.get(f) for f in ITEM_FIELDS} for row in catalog["Item"]), key=lambda i: i["item_code"])
+    await main.cache.set("locations_all", locations, ttl_seconds=3600, stale_ttl=86400)
+    main.item_catalog.index = ItemIndex(items)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print(f"\n📊 {len(locations)} locations, {len(items)} items")
+        print("   cold sync")
+        (loc_response, _), (item_response, _) = await fetch(client, "/api/locations"), await fetch(client, "/api/items")
+        start = time.perf_counter()
+        lists_to_maps(loc_response.content, item_response.content)
+        report("/api/locations + /api/items", loc_response.num_bytes_downloaded + item_response.num_bytes_downloaded,
+               len(loc_response.content) + len(item_response.content), (time.perf_counter() - start) * 1000)
+
+        response, server_ms = await fetch(client, "/api/offline/bundle")
+        start = time.perf_counter()
+        maps = bundle_to_maps(response.content)
+        report("/api/offline/bundle (first build)", response.num_bytes_downloaded, len(response.content),
+               (time.perf_counter() - start) * 1000, server_ms)
+        _, cached_ms = await fetch(client, "/api/offline/bundle")
+        print(f"   {'...same bundle again (cached)':<34} server {cached_ms:7.1f} ms")
+        version = json.loads(response.content)["version"]
+
+        changed = copy.deepcopy(items)
+        for i in range(0, len(changed), 100):
+            changed[i]["custom_stock_location"] = locations[(i * 7) % len(locations)]["name"]
+        main.item_catalog.index = ItemIndex(changed)
+        print(f"   re-sync after {len(range(0, len(changed), 100))} items moved (1%)")
+
+        delta, delta_ms = await fetch(client, "/api/offline/bundle", {"since": version})
+        start = time.perf_counter()
+        maps = bundle_to_maps(delta.content, maps)
+        report("since=<version> delta", delta.num_bytes_downloaded, len(delta.content),
+               (time.perf_counter() - start) * 1000, delta_ms)
+        full, full_ms = await fetch(client, "/api/offline/bundle")
+        start = time.perf_counter()
+        reloaded = bundle_to_maps(full.content)
+        report("full bundle (incremental rebuild)", full.num_bytes_downloaded, len(full.content),
+               (time.perf_counter() - start) * 1000, full_ms)
+        assert maps == reloaded, "delta applied != full bundle"
+        print(f"   items table: {main.item_tables.stats()}")
+
+
+def main_cli():
+    num_items = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num_locations = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    asyncio.run(run(num_items, num_locations))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,110 @@
+"""
+Benchmark: CPU per cache hit for GET /api/locations, encoding on every request vs
+sending the pre-encoded (and pre-gzipped) body
+
+"per request" is what the endpoint did before: return the cached list and let FastAPI
+run jsonable_encoder + JSONResponse on every hit. The other rows call the real
+/api/locations of main:app with the same list cached. Requests go straight into the
+ASGI app (no sockets, no client), so the numbers are server CPU only.
+
+Usage: python benchmarks/bench_response_encoding.py [sizes, e.g. 1000,10000,50000] [requests]
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+workdir = tempfile.mkdtemp(prefix="wms-bench-encoding-")
+os.environ.update({
+    "ERPNEXT_URL": "http://127.0.0.1:9",  # never called: every request is a cache hit
+    "CACHE_BACKEND": "memory", "CACHE_WARM_ON_STARTUP": "false", "ITEM_CATALOG_ENABLED": "false",
+    "SHARED_SNAPSHOTS": "false", "LOG_LEVEL": "WARNING",
+    "IDEMPOTENCY_DB": os.path.join(workdir, "idempotency.sqlite"),
+    "OUTBOX_DB": os.path.join(workdir, "outbox.sqlite")
+})
+
+from fastapi import FastAPI
+
+import main
+from fake_erpnext import build_catalog
+
+
+def per_request_app():
+    """/api/locations as it was: the cached list goes through FastAPI's encoder on every hit"""
+    app = FastAPI()
+
+    @app.get("/api/locations")
+    async def get_locations():
+        return await main.load_locations()
+
+    return app
+
+
+async def get(app, path, accept_encoding):
+    """One request through the ASGI app; returns its status, content-encoding and body size"""
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "headers": [(b"host", b"bench"), (b"accept-encoding", accept_encoding.encode())],
+             "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+    response = {"size": 0}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+            response["encoding"] = dict(message["headers"]).get(b"content-encoding", b"identity").decode()
+        else:
+            response["size"] += len(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response
+
+
+async def cpu_per_request(app, accept_encoding, requests):
+    """(ms CPU of the first hit, ms CPU per later hit, first response)"""
+    start = time.process_time()
+    first = await get(app, "/api/locations", accept_encoding)  # pre-encoded modes encode + gzip here
+    first_ms = (time.process_time() - start) * 1000
+    assert first["status"] == 200, first
+    start = time.process_time()
+    for _ in range(requests):
+        await get(app, "/api/locations", accept_encoding)
+    return first_ms, (time.process_time() - start) / requests * 1000, first
+
+
+async def run(sizes, requests):
+    baseline = per_request_app()
+    print(f"GET /api/locations cache hits, {requests} requests per row "
+          f"(encoder: {main.bodies.stats()['encoder']})")
+    for size in sizes:
+        locations = build_catalog(10, size, seed_csv=None)["Warehouse"]
+        await main.cache.set("locations_all", locations, ttl_seconds=3600, stale_ttl=86400)
+        print(f"\n📊 {size} locations{'':<22}first hit     per hit     body")
+        results = {}
+        for label, app, accept in (("per request (FastAPI encoder)", baseline, "identity"),
+                                   ("pre-encoded", main.app, "identity"),
+                                   ("pre-encoded + gzip", main.app, "gzip, deflate")):
+            first_ms, ms, first = await cpu_per_request(app, accept, requests)
+            results[label] = ms
+            print(f"   {label:<30} {first_ms:8.1f}ms  {ms:8.3f}ms  {first['size'] / 1024:8.1f}KB {first['encoding']}")
+        before = results["per request (FastAPI encoder)"]
+        print(f"   speedup: {before / results['pre-encoded']:.0f}x (identity), "
+              f"{before / results['pre-encoded + gzip']:.0f}x (gzip)")
+
+
+def main_cli():
+    sizes = [int(s) for s in sys.argv[1].split(",")] if len(sys.argv) > 1 else [1000, 10000, 50000]
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    asyncio.run(run(sizes, requests))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,123 @@
+"""
+Benchmark: ERPNext traffic from N uvicorn workers with per-worker vs Redis-shared cache
+
+Runs main:app with --workers N against the fake ERPNext (item catalog off, so item
+searches go through the response cache) for CACHE_BACKEND=memory and =redis, drives
+the same item/location searches, then calls /api/cache/clear and repeats the item
+searches: every query should be refetched once (the clear reached every worker).
+
+Needs a Redis-protocol server for the redis run (e.g. `redis-server --port 6379`).
+
+Usage: python benchmarks/bench_shared_cache.py [workers] [--redis-url redis://127.0.0.1:6379/15]
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from loadtest import free_port, wait_ready
+
+QUERIES = [f"GSS-RM-{i:06d}" for i in range(0, 2000, 10)]  # 200 distinct barcodes
+LOCATION_QUERIES = ["LOC-000001", "Bin 0002", "Section 3"]
+
+
+async def traffic(client, rounds, concurrency=32):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(path, q):
+        async with semaphore:
+            response = await client.get(path, params={"q": q})
+            response.raise_for_status()
+
+    jobs = [one("/api/items/search", q) for _ in range(rounds) for q in QUERIES]
+    jobs += [one("/api/locations/search", q) for _ in range(rounds) for q in LOCATION_QUERIES]
+    await asyncio.gather(*jobs)
+
+
+async def calls(client, fake_url):
+    return (await client.get(f"{fake_url}/__stats")).json()["calls_by_doctype"]
+
+
+def delta(after, before):
+    return {doctype: after.get(doctype, 0) - before.get(doctype, 0) for doctype in ("Item", "Warehouse")}
+
+
+async def run(backend, workers, rounds, redis_url):
+    fake_port, app_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="wms-bench-cache-")
+    fake = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "fake_erpnext.py")],
+                            env={**os.environ, "PORT": str(fake_port), "FAKE_ERPNEXT_LATENCY_MS": "50"})
+    env = {**os.environ, "ERPNEXT_URL": f"http://127.0.0.1:{fake_port}", "LOG_LEVEL": "WARNING",
+           "ITEM_CATALOG_ENABLED": "false", "CACHE_BACKEND": backend, "CACHE_REDIS_URL": redis_url,
+           "CACHE_REDIS_PREFIX": f"wms-bench-{os.getpid()}-{backend}:",
+           "IDEMPOTENCY_DB": os.path.join(workdir, "idempotency.sqlite"),
+           "OUTBOX_DB": os.path.join(workdir, "outbox.sqlite")}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env
+    )
+    fake_url, app_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+    try:
+        async with httpx.AsyncClient(timeout=60) as client:
+            await wait_ready(client, f"{fake_url}/__stats")
+            await wait_ready(client, f"{app_url}/")
+            await asyncio.sleep(3)  # let every worker finish startup (each warms locations)
+            startup = await calls(client, fake_url)
+
+        async with httpx.AsyncClient(base_url=app_url, timeout=60) as client:
+            before = await calls(client, fake_url)
+            started = time.perf_counter()
+            await traffic(client, rounds)
+            elapsed = time.perf_counter() - started
+            served = await calls(client, fake_url)
+
+            (await client.post("/api/cache/clear")).raise_for_status()
+            await asyncio.sleep(0.2)
+            await traffic(client, 1)
+            after_clear = await calls(client, fake_url)
+    finally:
+        server.terminate()
+        fake.terminate()
+        server.wait(timeout=15)
+        fake.wait(timeout=10)
+
+    return {
+        "startup": delta(startup, {}),
+        "traffic": delta(served, before),
+        "after_clear": delta(after_clear, served),
+        "seconds": elapsed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("workers", nargs="?", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5, help="times each query is repeated")
+    parser.add_argument("--redis-url", default="redis://127.0.0.1:6379/15")
+    args = parser.parse_args()
+
+    requests = args.rounds * (len(QUERIES) + len(LOCATION_QUERIES))
+    print(f"{args.workers} workers, {requests} searches ({len(QUERIES)} distinct barcodes x {args.rounds}), "
+          f"ERPNext latency 50ms")
+    for backend in ("memory", "redis"):
+        r = asyncio.run(run(backend, args.workers, args.rounds, args.redis_url))
+        print(f"\nCACHE_BACKEND={backend}")
+        print(f"  startup Warehouse fetches  {r['startup']['Warehouse']:>5}")
+        print(f"  ERPNext Item calls         {r['traffic']['Item']:>5}   ({r['seconds']:.2f}s)")
+        print(f"  Item refetches after clear {r['after_clear']['Item']:>5}   "
+              f"(expected {len(QUERIES)}: fewer means workers kept serving cleared entries)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Benchmark: per-worker in-memory indexes vs one mmap'd snapshot shared by all workers
+
+Starts N worker processes that either build their own ItemIndex + LocationIndex
+(what every uvicorn worker did) or map the snapshot files once published, then reads
+their memory from /proc (private = not shared with anyone, PSS = fair share of shared
+pages). Also checks both give the same search results and times searches including
+the JSON response body.
+
+Usage: python benchmarks/bench_shared_snapshot.py [num_items] [num_locations] [workers]
+"""
+
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_erpnext import build_catalog
+from item_catalog import ITEM_FIELDS
+from search_index import ItemIndex, LocationIndex
+from shared_snapshot import (SharedItemIndex, SharedLocationIndex, SnapshotFile, write_item_snapshot,
+                             write_location_snapshot)
+
+
+def catalog(num_items, num_locations):
+    data = build_catalog(num_items, num_locations, seed_csv=None)
+    items = sorted(({f: row.get(f) for f in ITEM_FIELDS} for row in data["Item"]), key=lambda i: i["item_code"])
+    return items, data["Warehouse"]
+
+
+def queries(items, locations, n=300):
+    rng = random.Random(7)
+    item_queries, location_queries = [], []
+    for _ in range(n):
+        item = rng.choice(items)
+        item_queries += [item["custom_barcode"], item["item_code"][-4:], item["item_name"][:14].lower()]
+        location = rng.choice(locations)
+        location_queries += [location["custom_warehouse_barcode"], location["warehouse_name"][-5:]]
+    return item_queries, location_queries
+
+
+def memory_kb(pid):
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                fields[key] = int(value.split()[0])
+    return {"rss": fields["Rss"], "pss": fields["Pss"], "private": fields["Private_Clean"] + fields["Private_Dirty"]}
+
+
+def worker(mode, num_items, num_locations, directory):
+    """Child: hold the data like a server worker would, report, wait to be measured"""
+    indexes = []
+    if mode == "memory":
+        items, locations = catalog(num_items, num_locations)
+        indexes = [ItemIndex(items), LocationIndex(locations)]
+    elif mode == "snapshot":
+        indexes = [SnapshotFile(os.path.join(directory, "items.snap"), SharedItemIndex).current(),
+                   SnapshotFile(os.path.join(directory, "locations.snap"), SharedLocationIndex).current()]
+        # Touch the whole mapping, like a worker would after serving for a while
+        for index in indexes:
+            index.snapshot.rows_json()
+            index.search("zz-no-match")
+    print("ready", flush=True)
+    sys.stdin.readline()
+    return indexes
+
+
+def measure(mode, workers, num_items, num_locations, directory):
+    procs = [subprocess.Popen([sys.executable, __file__, "--worker", mode, str(num_items), str(num_locations),
+                               directory], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+             for _ in range(workers)]
+    for proc in procs:
+        proc.stdout.readline()
+    usage = [memory_kb(proc.pid) for proc in procs]
+    for proc in procs:
+        proc.communicate("\n")
+    return {key: sum(u[key] for u in usage) for key in ("rss", "pss", "private")}
+
+
+def timed(search, qs):
+    latencies = []
+    for q in qs:
+        start = time.perf_counter()
+        search(q)
+        latencies.append((time.perf_counter() - start) * 1e6)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+def main():
+    if sys.argv[1:2] == ["--worker"]:
+        worker(sys.argv[2], int(sys.argv[3]), int(sys.argv[4]), sys.argv[5])
+        return
+    num_items = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    num_locations = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 4
+
+    items, locations = catalog(num_items, num_locations)
+    directory = tempfile.mkdtemp(prefix="wms-snapshots-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    start = time.perf_counter()
+    write_item_snapshot(os.path.join(directory, "items.snap"), items)
+    write_location_snapshot(os.path.join(directory, "locations.snap"), locations)
+    publish_ms = (time.perf_counter() - start) * 1000
+    size_mb = sum(os.path.getsize(os.path.join(directory, f)) for f in os.listdir(directory)) / 1024 / 1024
+
+    print(f"\n📊 {num_items} items, {num_locations} locations, {workers} workers")
+    print(f"   snapshot publish {publish_ms:.0f}ms, {size_mb:.1f}MB on {directory}")
+    baseline = measure("baseline", workers, num_items, num_locations, directory)
+    for mode in ("memory", "snapshot"):
+        usage = measure(mode, workers, num_items, num_locations, directory)
+        private = (usage["private"] - baseline["private"]) / 1024
+        pss = (usage["pss"] - baseline["pss"]) / 1024
+        print(f"   {mode:<9} data private {private:7.1f}MB total ({private / workers:6.1f}MB/worker)   "
+              f"PSS {pss:7.1f}MB total")
+
+    item_queries, location_queries = queries(items, locations)
+    item_index, location_index = ItemIndex(items), LocationIndex(locations)
+    shared_items = SnapshotFile(os.path.join(directory, "items.snap"), SharedItemIndex).current()
+    shared_locations = SnapshotFile(os.path.join(directory, "locations.snap"), SharedLocationIndex).current()
+    mismatches = sum(item_index.search(q) != shared_items.search(q) for q in item_queries)
+    mismatches += sum(location_index.search(q) != shared_locations.search(q) for q in location_queries)
+    print(f"   result mismatches: {mismatches} of {len(item_queries) + len(location_queries)} queries")
+
+    # Response body included: the in-memory path still has to encode its rows
+    def encode(rows):
+        return json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode()
+
+    for label, memory_search, shared_search, qs in (
+        ("item search", lambda q: encode(item_index.search(q)), shared_items.search_json, item_queries),
+        ("location search", lambda q: encode(location_index.search(q)), shared_locations.search_json, location_queries),
+        ("GET /api/locations", lambda q: encode(locations), lambda q: shared_locations.snapshot.rows_json(), ["all"] * 50),
+    ):
+        m50, m99 = timed(memory_search, qs)
+        s50, s99 = timed(shared_search, qs)
+        print(f"   {label:<19} memory p50 {m50:8.1f}µs p99 {m99:8.1f}µs   snapshot p50 {s50:8.1f}µs p99 {s99:8.1f}µs")
+
+    for name in os.listdir(directory):
+        os.unlink(os.path.join(directory, name))
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    main()
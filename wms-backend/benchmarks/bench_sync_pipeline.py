@@ -0,0 +1,98 @@
+"""
+Benchmark: serial fixed 500-row upserts vs the streaming BatchUpserter
+Runs against the fake PostgREST stand-in (optionally with injected failures) and
+checks every row landed.
+
+Usage: python benchmarks/bench_sync_pipeline.py [num_rows] [failure_rate]
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+
+from sync_pipeline import BatchUpserter
+
+PORT = 8768
+URL = f"http://127.0.0.1:{PORT}"
+http = httpx.Client(base_url=URL, timeout=30, limits=httpx.Limits(max_connections=16))
+
+
+def upsert(table, rows):
+    """Same request shape as supabase.table(table).upsert(rows).execute()"""
+    response = http.post(f"/rest/v1/{table}", json=rows, headers={"Prefer": "resolution=merge-duplicates"})
+    response.raise_for_status()
+
+
+def make_rows(n):
+    return ({"item_code": f"RM-{i % (n // 10 or 1):06d}", "warehouse": f"WH-{i:07d}",
+             "actual_qty": float(i % 97), "reserved_qty": 0.0, "available_qty": float(i % 97)} for i in range(n))
+
+
+def serial(table, rows):
+    """Previous sync_via_backend approach: fixed 500-row batches, one at a time, no retries"""
+    rows = list(rows)
+    failed = 0
+    start = time.perf_counter()
+    for i in range(0, len(rows), 500):
+        try:
+            upsert(table, rows[i:i + 500])
+        except httpx.HTTPError:
+            failed += 500
+    return time.perf_counter() - start, failed
+
+
+async def pipeline(table, rows):
+    upserter = BatchUpserter(upsert, table, batch_size=500, in_flight=4, backoff=0.05)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == 500:  # rows arrive a page at a time, as from PagedFetcher
+            await upserter.add(chunk)
+            chunk = []
+    await upserter.add(chunk)
+    stats = await upserter.close()
+    return stats
+
+
+def count(table):
+    return http.get(f"/rest/v1/{table}/count").json()["count"]
+
+
+def wait_for():
+    for _ in range(200):
+        try:
+            http.get("/rest/v1/x/count")
+            return
+        except httpx.HTTPError:
+            time.sleep(0.05)
+    raise RuntimeError("fake PostgREST did not start")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    failure_rate = sys.argv[2] if len(sys.argv) > 2 else "0.05"
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PORT=str(PORT), FAKE_POSTGREST_FAILURE_RATE=failure_rate)
+    server = subprocess.Popen([sys.executable, os.path.join(here, "fake_postgrest.py")], env=env)
+    try:
+        wait_for()
+        print(f"\n📊 Upsert {n} stock rows - fake PostgREST, failure rate {failure_rate}")
+        elapsed, failed = serial("serial", make_rows(n))
+        print(f"   serial 500/batch   {elapsed:6.2f}s  {n / elapsed:8.0f} rows/s  "
+              f"landed {count('serial')}/{n} ({failed} rows lost to failed batches)")
+        stats = asyncio.run(pipeline("stock_balance", make_rows(n)))
+        print(f"   BatchUpserter      {stats['seconds']:6.2f}s  {stats['rows_per_sec']:8.0f} rows/s  "
+              f"landed {count('stock_balance')}/{n} ({stats['retried']} retries, final batch {stats['batch_size']})")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Fake ERPNext server for local benchmarks
+Serves /api/resource/<doctype> with a synthetic catalog and configurable latency
+"""
+
+import asyncio
+import bisect
+import csv
+import json
+import os
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+LATENCY_MS = float(os.getenv("FAKE_ERPNEXT_LATENCY_MS", 50))
+NUM_ITEMS = int(os.getenv("FAKE_ERPNEXT_ITEMS", 3000))
+NUM_LOCATIONS = int(os.getenv("FAKE_ERPNEXT_LOCATIONS", 500))
+SEED_CSV = os.getenv("FAKE_ERPNEXT_SEED_CSV")  # e.g. docs/warehouse_barcodes_final_*.csv
+
+
+def load_seed_locations(path):
+    """Real warehouse rows from a barcode export (Section, Location Name, Full Warehouse Name, Barcode)"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return [{
+            "name": row["Full Warehouse Name"],
+            "warehouse_name": row["Location Name"],
+            "parent_warehouse": row["Section"],
+            "is_group": 0,
+            "custom_warehouse_barcode": row["Barcode"],
+            "company": "Global Spectrum SARL",
+            "modified": "2025-10-01 00:00:00.000000",
+        } for row in csv.DictReader(f) if row.get("Full Warehouse Name")]
+
+
+def build_catalog(num_items=NUM_ITEMS, num_locations=NUM_LOCATIONS, seed_csv=SEED_CSV):
+    """Build a Warehouse/Item/Bin catalog; seeded locations come first, synthetic ones fill up to num_locations"""
+    warehouses = load_seed_locations(seed_csv)[:num_locations] if seed_csv else []
+    for i in range(len(warehouses), num_locations):
+        section = i // 50 + 1
+        warehouses.append({
+            "name": f"WHS-RM-S{section}-{i:05d} - GSS",
+            "warehouse_name": f"Section {section} Bin {i:05d}",
+            "parent_warehouse": f"Section {section} - GSS",
+            "is_group": 0,
+            "custom_warehouse_barcode": f"LOC-{i:06d}",
+            "company": "Global Spectrum SARL",
+            "modified": "2025-10-01 00:00:00.000000",
+        })
+    items = []
+    for i in range(num_items):
+        items.append({
+            "name": f"RM-{i:06d}",
+            "item_code": f"RM-{i:06d}",
+            "item_name": f"Raw Material {i}",
+            "item_group": "Raw Material",
+            "stock_uom": "PCs",
+            "description": f"Raw Material {i}",
+            "custom_barcode": f"GSS-RM-{i:06d}",
+            "barcode": f"GSS-RM-{i:06d}",
+            "custom_stock_location": warehouses[i % len(warehouses)]["name"] if warehouses else None,
+            "modified": "2025-10-01 00:00:00.000000",
+        })
+    bins = []
+    for i, item in enumerate(items):
+        if not warehouses:
+            break
+        bins.append({
+            "name": f"BIN-{i:06d}",
+            "item_code": item["item_code"],
+            "warehouse": warehouses[i % len(warehouses)]["name"],
+            "actual_qty": float(i % 97),
+            "reserved_qty": float(i % 5),
+            "modified": "2025-10-01 00:00:00.000000",
+        })
+    # Rows are kept in name order, like ERPNext's default listing
+    warehouses.sort(key=lambda w: w["name"])
+    return {"Warehouse": warehouses, "Item": items, "Bin": bins}
+
+
+def _name(row):
+    return row["name"]
+
+
+def _matches(row, filters):
+    for field, op, value in filters:
+        actual = row.get(field)
+        if op == "=":
+            if actual != value:
+                return False
+        elif op == "!=":
+            if actual == value:
+                return False
+        elif op == "like":
+            needle = str(value).strip("%").lower()
+            if needle not in str(actual or "").lower():
+                return False
+        elif op == ">":
+            if actual is None or not actual > value:
+                return False
+        elif op == ">=":
+            if actual is None or not actual >= value:
+                return False
+        elif op == "<":
+            if actual is None or not actual < value:
+                return False
+        elif op == "<=":
+            if actual is None or not actual <= value:
+                return False
+        elif op == "in":
+            if actual not in value:
+                return False
+    return True
+
+
+def create_app(latency_ms=LATENCY_MS, catalog=None):
+    """Create the fake ERPNext ASGI app"""
+    app = FastAPI(title="Fake ERPNext")
+    app.state.catalog = catalog if catalog is not None else build_catalog()
+    app.state.latency_ms = latency_ms
+    app.state.calls = 0
+    app.state.calls_by_doctype = {}
+    app.state.created = []
+
+    async def delay(doctype):
+        app.state.calls += 1
+        app.state.calls_by_doctype[doctype] = app.state.calls_by_doctype.get(doctype, 0) + 1
+        if app.state.latency_ms:
+            await asyncio.sleep(app.state.latency_ms / 1000)
+
+    @app.get("/__stats")
+    async def stats():
+        """Load-test bookkeeping (not an ERPNext endpoint)"""
+        return {"calls": app.state.calls, "calls_by_doctype": app.state.calls_by_doctype,
+                "created": len(app.state.created)}
+
+    @app.get("/api/resource/{doctype}")
+    async def list_resource(doctype: str, request: Request):
+        await delay(doctype)
+        params = request.query_params
+        rows = app.state.catalog.get(doctype, [])
+        filters = json.loads(params.get("filters", "[]"))
+        # name ranges (keyset paging) are sliced like a primary key index would; rows are in name order
+        lo, hi = 0, len(rows)
+        for field, op, value in filters:
+            if field == "name" and op in (">", ">="):
+                lo = max(lo, (bisect.bisect_right if op == ">" else bisect.bisect_left)(rows, value, key=_name))
+            elif field == "name" and op in ("<", "<="):
+                hi = min(hi, (bisect.bisect_left if op == "<" else bisect.bisect_right)(rows, value, key=_name))
+        filters = [f for f in filters if not (f[0] == "name" and f[1] in (">", ">=", "<", "<="))]
+        order_by = params.get("order_by")
+        start = int(params.get("limit_start", 0))
+        page_length = int(params.get("limit_page_length", 20))
+        if filters or (order_by and order_by != "name asc"):
+            rows = rows[lo:hi]
+            if filters:
+                rows = [r for r in rows if _matches(r, filters)]
+            if order_by and order_by != "name asc":
+                field, _, direction = order_by.partition(" ")
+                rows = sorted(rows, key=lambda r: r.get(field) or "", reverse=direction.lower() == "desc")
+            lo, hi = 0, len(rows)
+        # Only the requested page is copied
+        lo += start
+        rows = rows[lo:min(hi, lo + page_length) if page_length else hi]
+        fields = json.loads(params.get("fields", '["name"]'))
+        return {"data": [{f: r.get(f) for f in fields} for r in rows]}
+
+    @app.get("/api/resource/{doctype}/{name}")
+    async def get_resource(doctype: str, name: str):
+        await delay(doctype)
+        for row in app.state.catalog.get(doctype, []):
+            if row.get("name") == name:
+                return {"data": row}
+        return {"data": {}}
+
+    @app.post("/api/resource/{doctype}")
+    async def create_resource(doctype: str, request: Request):
+        await delay(doctype)
+        doc = await request.json()
+        known = {row["item_code"] for row in app.state.catalog.get("Item", [])}
+        unknown = [i["item_code"] for i in doc.get("items", []) if i.get("item_code") not in known]
+        if unknown:
+            # ERPNext answers link validation errors with 417
+            return JSONResponse(status_code=417, content={"exc_type": "LinkValidationError",
+                                                          "message": f"Could not find Item: {unknown[0]}"})
+        doc["name"] = f"WMS-STE-{len(app.state.created) + 1:05d}"
+        app.state.created.append(doc)
+        app.state.catalog.setdefault(doctype, []).append(doc)  # listable, e.g. for docstatus checks
+        return {"data": doc}
+
+    return app
+
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", 8765))
+    uvicorn.run(create_app(), host="127.0.0.1", port=port, log_level="warning", access_log=False)
@@ -0,0 +1,52 @@
+"""
+Fake PostgREST (Supabase REST) stand-in for sync benchmarks
+Accepts upserts on /rest/v1/<table>; latency, per-row cost and failure rate are configurable,
+and a batch holding a row without its key columns is rejected like a Postgres constraint error
+"""
+
+import asyncio
+import os
+import random
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+
+LATENCY_MS = float(os.getenv("FAKE_POSTGREST_LATENCY_MS", 40))
+ROW_COST_US = float(os.getenv("FAKE_POSTGREST_ROW_COST_US", 100))  # server time per row
+FAILURE_RATE = float(os.getenv("FAKE_POSTGREST_FAILURE_RATE", 0.0))  # fraction of requests that 503
+
+KEYS = {"items": ("item_code",), "warehouses": ("name",), "stock_balance": ("item_code", "warehouse"),
+        "serial": ("item_code", "warehouse")}
+
+
+def create_app(latency_ms=LATENCY_MS, row_cost_us=ROW_COST_US, failure_rate=FAILURE_RATE):
+    app = FastAPI(title="Fake PostgREST")
+    app.state.tables = {}
+    app.state.requests = 0
+
+    @app.post("/rest/v1/{table}")
+    async def upsert(table: str, request: Request):
+        rows = await request.json()
+        app.state.requests += 1
+        await asyncio.sleep(latency_ms / 1000 + len(rows) * row_cost_us / 1e6)
+        if random.random() < failure_rate:
+            raise HTTPException(status_code=503, detail="simulated failure")
+        store = app.state.tables.setdefault(table, {})
+        keys = KEYS.get(table, ("id",))
+        if any(row.get(k) is None for row in rows for k in keys):
+            # A null primary key rejects the whole statement, as in Postgres
+            raise HTTPException(status_code=400, detail="null value in primary key column")
+        for row in rows:
+            store[tuple(row[k] for k in keys)] = row
+        return rows
+
+    @app.get("/rest/v1/{table}/count")
+    async def count(table: str):
+        return {"count": len(app.state.tables.get(table, {}))}
+
+    return app
+
+
+if __name__ == "__main__":
+    port = int(os.getenv("PORT", 8768))
+    uvicorn.run(create_app(), host="127.0.0.1", port=port, log_level="warning", access_log=False)
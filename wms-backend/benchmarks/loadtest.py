@@ -0,0 +1,341 @@
+"""
+Load test: main.app (uvicorn) against the fake ERPNext, driven by a scanner traffic mix
+
+Starts both servers as subprocesses, waits for the caches to warm, runs N scanner
+clients for a fixed duration and writes throughput, latency percentiles, ERPNext
+calls and server memory to a JSON file. --compare checks a run against a baseline
+and exits 1 when p99 or throughput regress beyond --tolerance.
+
+Usage:
+  python benchmarks/loadtest.py --out results/baseline.json
+  python benchmarks/loadtest.py --latency-ms 80 --items 20000 --out results/new.json --compare results/baseline.json
+  python benchmarks/loadtest.py --env ITEM_CATALOG_ENABLED=false --mix item_search=80,balance=20
+  python benchmarks/loadtest.py --workers 4   # production launcher (serve.py), shared snapshots
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_erpnext import build_catalog
+
+DEFAULT_MIX = "item_search=45,location_search=30,balance=20,stock_entry=5"
+DEFAULT_SEED = sorted(glob.glob(os.path.join(BACKEND_DIR, "..", "docs", "warehouse_barcodes_final_*.csv")))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree(pid):
+    pids, i = [pid], 0
+    while i < len(pids):
+        try:
+            with open(f"/proc/{pids[i]}/task/{pids[i]}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+        i += 1
+    return pids
+
+
+def memory_mb(pid):
+    """RSS, peak RSS and PSS summed over the server and its worker processes (Linux /proc)"""
+    totals = {"VmRSS": 0, "VmHWM": 0, "Pss": 0}
+    for p in process_tree(pid):
+        for name in ("status", "smaps_rollup"):
+            try:
+                with open(f"/proc/{p}/{name}") as f:
+                    for line in f:
+                        key, _, value = line.partition(":")
+                        if key in totals:
+                            totals[key] += int(value.split()[0])
+            except OSError:
+                pass
+    return {"rss_mb": round(totals["VmRSS"] / 1024, 1), "peak_rss_mb": round(totals["VmHWM"] / 1024, 1),
+            "pss_mb": round(totals["Pss"] / 1024, 1)}
+
+
+async def wait_ready(client, url, timeout=60, ready=None):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            response = await client.get(url)
+            if response.status_code == 200 and (ready is None or ready(response.json())):
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+class Scenario:
+    """Deterministic scanner requests built from the same catalog the fake ERPNext serves"""
+
+    def __init__(self, catalog, seed):
+        self.rng = random.Random(seed)
+        self.items = catalog["Item"]
+        self.locations = catalog["Warehouse"]
+        self.bins = catalog["Bin"]
+        self.sequence = 0
+
+    def item_search(self):
+        item = self.rng.choice(self.items)
+        roll = self.rng.random()
+        # Scanners mostly read barcodes; people type partial codes and names
+        q = item["custom_barcode"] if roll < 0.7 else item["item_code"][-5:] if roll < 0.9 else item["item_name"][:12]
+        return "GET", "/api/items/search", {"params": {"q": q}}
+
+    def location_search(self):
+        location = self.rng.choice(self.locations)
+        q = location["custom_warehouse_barcode"] if self.rng.random() < 0.8 else location["warehouse_name"][-6:]
+        return "GET", "/api/locations/search", {"params": {"q": q}}
+
+    def balance(self):
+        row = self.rng.choice(self.bins)
+        return "GET", "/api/stock-balance", {"params": {"item_code": row["item_code"], "warehouse": row["warehouse"]}}
+
+    def stock_entry(self):
+        self.sequence += 1
+        items = [{"item_code": self.rng.choice(self.items)["item_code"], "qty": self.rng.randint(1, 20)}
+                 for _ in range(self.rng.randint(1, 3))]
+        return "POST", "/api/stock-entry", {"json": {
+            "purpose": "Material Receipt",
+            "to_warehouse": self.rng.choice(self.locations)["name"],
+            "items": items,
+            "idempotency_key": f"loadtest-{self.sequence}",
+            "user_name": "loadtest"
+        }}
+
+
+def catalog_ready(stats):
+    """The worker answering has the catalog in memory or mapped from the shared snapshot"""
+    shared = stats.get("snapshots")
+    return stats["item_catalog"]["ready"] or bool(shared and shared["items"]["loaded"])
+
+
+def summarize(latencies, errors, seconds):
+    ordered = sorted(latencies)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 2) if ordered else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / seconds, 1),
+        "p50_ms": pct(0.50),
+        "p90_ms": pct(0.90),
+        "p99_ms": pct(0.99),
+        "max_ms": round(ordered[-1] * 1000, 2) if ordered else None,
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 2) if ordered else None
+    }
+
+
+async def drive(base_url, scenario, mix, clients, duration, warmup):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    latencies = {n: [] for n in names}
+    errors = {n: 0 for n in names}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        measuring = False
+        stop_at = time.monotonic() + warmup + duration
+
+        async def scanner():
+            while time.monotonic() < stop_at:
+                op = scenario.rng.choices(names, weights)[0]
+                method, path, kwargs = getattr(scenario, op)()
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, **kwargs)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                if measuring:
+                    if ok:
+                        latencies[op].append(time.perf_counter() - started)
+                    else:
+                        errors[op] += 1
+
+        tasks = [asyncio.ensure_future(scanner()) for _ in range(clients)]
+        await asyncio.sleep(warmup)
+        measuring = True
+        began = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - began
+    return latencies, errors, elapsed
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ("item_search", "location_search", "balance", "stock_entry"):
+            raise SystemExit(f"unknown operation in --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+async def run(args):
+    mix = parse_mix(args.mix)
+    seed_csv = args.seed_csv if args.seed_csv != "none" else None
+    catalog = build_catalog(args.items, args.locations, seed_csv)
+    fake_port, app_port = free_port(), free_port()
+    workdir = tempfile.mkdtemp(prefix="wms-loadtest-")
+
+    fake_env = {**os.environ, "PORT": str(fake_port), "FAKE_ERPNEXT_LATENCY_MS": str(args.latency_ms),
+                "FAKE_ERPNEXT_ITEMS": str(args.items), "FAKE_ERPNEXT_LOCATIONS": str(args.locations),
+                "FAKE_ERPNEXT_SEED_CSV": seed_csv or ""}
+    app_env = {**os.environ, "ERPNEXT_URL": f"http://127.0.0.1:{fake_port}", "ERPNEXT_API_KEY": "loadtest",
+               "ERPNEXT_API_SECRET": "loadtest", "LOG_LEVEL": "WARNING",
+               "IDEMPOTENCY_DB": os.path.join(workdir, "idempotency.sqlite"),
+               "OUTBOX_DB": os.path.join(workdir, "outbox.sqlite")}
+    for override in args.env:
+        key, _, value = override.partition("=")
+        app_env[key] = value
+
+    fake = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "fake_erpnext.py")], env=fake_env)
+    if args.workers > 1:
+        # Production launcher: one process per worker, shared snapshots
+        app_env.update({"HOST": "127.0.0.1", "PORT": str(app_port), "WEB_CONCURRENCY": str(args.workers),
+                        "SNAPSHOT_DIR": os.path.join(workdir, "snapshots")})
+        command = [sys.executable, "serve.py"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                   "--log-level", "warning", "--no-access-log"]
+    server = subprocess.Popen(command, cwd=BACKEND_DIR, env=app_env)
+    fake_url, app_url = f"http://127.0.0.1:{fake_port}", f"http://127.0.0.1:{app_port}"
+    try:
+        async with httpx.AsyncClient(timeout=10) as client:
+            await wait_ready(client, f"{fake_url}/__stats")
+            await wait_ready(client, f"{app_url}/")
+            if app_env.get("ITEM_CATALOG_ENABLED", "true").lower() == "true":
+                await wait_ready(client, f"{app_url}/api/cache/stats", timeout=120,
+                                 ready=catalog_ready)
+            calls_before = (await client.get(f"{fake_url}/__stats")).json()["calls"]
+            memory_before = memory_mb(server.pid)
+
+        scenario = Scenario(catalog, args.seed)
+        latencies, errors, elapsed = await drive(app_url, scenario, mix, args.clients, args.duration, args.warmup)
+
+        async with httpx.AsyncClient(timeout=10) as client:
+            erpnext_calls = (await client.get(f"{fake_url}/__stats")).json()["calls"] - calls_before
+        memory_after = memory_mb(server.pid)
+    finally:
+        for proc in (server, fake):
+            proc.terminate()
+        for proc in (server, fake):
+            proc.wait(timeout=10)
+
+    everything = [latency for op in latencies.values() for latency in op]
+    results = {op: summarize(latencies[op], errors[op], elapsed) for op in mix}
+    results["overall"] = summarize(everything, sum(errors.values()), elapsed)
+    results["overall"]["erpnext_calls"] = erpnext_calls
+    results["overall"]["erpnext_calls_per_request"] = round(erpnext_calls / max(1, len(everything)), 3)
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "config": {"latency_ms": args.latency_ms, "items": args.items, "locations": args.locations,
+                       "seed_csv": os.path.basename(seed_csv) if seed_csv else None, "workers": args.workers,
+                       "clients": args.clients,
+                       "duration": args.duration, "warmup": args.warmup, "mix": mix, "seed": args.seed,
+                       "env": args.env}
+        },
+        "results": results,
+        "memory": {"before": memory_before, "after": memory_after}
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, tolerance):
+    """Print per-operation deltas; return the list of regressions beyond tolerance"""
+    regressions = []
+    print(f"\nvs baseline {baseline['meta'].get('commit')} ({baseline['meta']['timestamp']}):")
+    for op, now in current["results"].items():
+        before = baseline["results"].get(op)
+        if not before or not before["requests"] or not now["requests"]:
+            continue
+        rps_change = now["rps"] / before["rps"] - 1
+        p99_change = now["p99_ms"] / before["p99_ms"] - 1 if before["p99_ms"] else 0.0
+        flag = ""
+        if p99_change > tolerance or rps_change < -tolerance:
+            regressions.append(op)
+            flag = "  <-- REGRESSION"
+        print(f"  {op:<16} rps {before['rps']:>8} -> {now['rps']:>8} ({rps_change:+.0%})   "
+              f"p99 {before['p99_ms']:>8} -> {now['p99_ms']:>8} ms ({p99_change:+.0%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WMS backend load test against a fake ERPNext")
+    parser.add_argument("--latency-ms", type=float, default=50, help="fake ERPNext latency per call")
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--locations", type=int, default=1000)
+    parser.add_argument("--seed-csv", default=DEFAULT_SEED[-1] if DEFAULT_SEED else "none",
+                        help="warehouse barcode CSV seeding real location names ('none' for synthetic only)")
+    parser.add_argument("--workers", type=int, default=1, help="server processes (>1 runs serve.py)")
+    parser.add_argument("--clients", type=int, default=50, help="concurrent scanners")
+    parser.add_argument("--duration", type=float, default=20, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds first")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation weights")
+    parser.add_argument("--seed", type=int, default=42, help="traffic RNG seed")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE for the WMS server (repeatable)")
+    parser.add_argument("--out", default=None, help="write results JSON here")
+    parser.add_argument("--compare", default=None, help="baseline results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p99/throughput regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    overall = report["results"]["overall"]
+    print(f"{overall['requests']} requests in {args.duration:.0f}s with {args.clients} scanners, "
+          f"ERPNext latency {args.latency_ms:.0f}ms")
+    for op, r in report["results"].items():
+        print(f"  {op:<16} {r['rps']:>8} req/s   p50 {r['p50_ms']:>8} ms   p99 {r['p99_ms']:>8} ms   errors {r['errors']}")
+    print(f"  ERPNext calls/request {overall['erpnext_calls_per_request']}   "
+          f"server RSS {report['memory']['after']['rss_mb']} MB (peak {report['memory']['after']['peak_rss_mb']} MB, "
+          f"PSS {report['memory']['after']['pss_mb']} MB)")
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Paginated, concurrent bulk fetch for large ERPNext doctypes
+Keyset pages in name order, several in flight; rows are yielded in order as a stream
+"""
+
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger("wms.bulk_fetch")
+
+
+class PagedFetcher:
+    """
+    Stream every row of a doctype without one huge limit_page_length request.
+
+    `get` is an async callable `(endpoint, params=None) -> dict` (e.g. ERPNextClient.get).
+    Pages are keyset pages in name order (name > the last name read), so rows
+    inserted or deleted while paging never shift a page: no row is skipped or
+    read twice. To keep `workers` pages in flight, the name that ends each page of
+    the next round is looked up ahead (one names-only request per round), and those
+    name ranges are read concurrently. The lookups are only hints: a range that grew
+    in between is read on until it is exhausted. Memory stays at about a round.
+    `last_name` is the last row of the last page the consumer finished processing
+    (it asked for the next one); pass it as `after` to resume after a failure.
+    """
+
+    def __init__(self, get, doctype, fields, filters=None, page_size=500, workers=4, after=None,
+                 retries=3, backoff=0.5):
+        self.get = get
+        self.doctype = doctype
+        self.drop_name = "name" not in fields  # name is read for paging only
+        self.fields = fields if not self.drop_name else fields + ["name"]
+        self.filters = list(filters or [])
+        self.page_size = page_size
+        self.workers = workers
+        self.after = after
+        self.retries = retries
+        self.backoff = backoff
+        self.last_name = after
+
+    async def request(self, params, after):
+        """GET one list request, retrying with exponential backoff"""
+        for attempt in range(self.retries + 1):
+            try:
+                result = await self.get(f"/api/resource/{self.doctype}", params=params)
+                return result.get("data", [])
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning("Page fetch failed, retrying", extra={
+                    "doctype": self.doctype, "after": after, "attempt": attempt + 1, "error": str(e)
+                })
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    def params(self, fields, after, upto=None):
+        filters = list(self.filters)
+        if after is not None:
+            filters.append(["name", ">", after])
+        if upto is not None:
+            filters.append(["name", "<=", upto])
+        params = {"fields": json.dumps(fields), "order_by": "name asc", "limit_page_length": self.page_size}
+        if filters:
+            params["filters"] = json.dumps(filters)
+        return params
+
+    async def fetch_page(self, after, upto=None):
+        """Up to page_size rows with after < name (<= upto)"""
+        return await self.request(self.params(self.fields, after, upto), after)
+
+    async def page_ends(self, after):
+        """Names ending each of the next `workers` pages after `after` (fewer near the end), in one request"""
+        params = self.params(["name"], after)
+        params.update(limit_start=self.page_size - 1, limit_page_length=(self.workers - 1) * self.page_size + 1)
+        rows = await self.request(params, after)
+        return [row["name"] for row in rows[::self.page_size]]
+
+    async def fetch_range(self, after, upto):
+        """Pages of the name range (after, upto], upto None for the open end; read until a short page"""
+        pages = []
+        while True:
+            rows = await self.fetch_page(after, upto)
+            pages.append(rows)
+            if len(rows) < self.page_size or rows[-1]["name"] == upto:
+                return pages
+            after = rows[-1]["name"]
+
+    async def single_page(self, after):
+        return [await self.fetch_page(after)]
+
+    @staticmethod
+    async def enqueue(queue, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        try:
+            await queue.put(task)
+        except asyncio.CancelledError:
+            task.cancel()  # the consumer stopped; nobody will await it
+            raise
+        return task
+
+    async def schedule(self, after, queue):
+        """Queue fetch tasks of consecutive name ranges after `after`; None when done"""
+        lookup = None
+        try:
+            if self.workers == 1:
+                # Nothing to overlap: plain keyset pages, no end lookups
+                while True:
+                    (rows,) = await (await self.enqueue(queue, self.single_page(after)))
+                    if len(rows) < self.page_size:
+                        return
+                    after = rows[-1]["name"]
+            lookup = asyncio.ensure_future(self.page_ends(after))
+            while True:
+                ends = await lookup
+                if len(ends) == self.workers:
+                    # The next round starts at this round's last end: look it up while these pages load
+                    lookup = asyncio.ensure_future(self.page_ends(ends[-1]))
+                for end in ends:
+                    await self.enqueue(queue, self.fetch_range(after, end))
+                    after = end
+                if len(ends) < self.workers:
+                    # Fewer rows left than the lookup reached: the open end finishes the doctype
+                    await self.enqueue(queue, self.fetch_range(after, None))
+                    return
+        finally:
+            if lookup is not None and not lookup.done():
+                lookup.cancel()
+            await queue.put(None)
+
+    async def pages(self):
+        """
+        Yield (name of the page's last row, rows) in name order; the name is a resume
+        point once the page is processed
+        """
+        queue = asyncio.Queue(maxsize=self.workers)  # range fetches in flight, in order
+        producer = None
+        try:
+            # The first page goes alone: small results cost one call, not `workers`
+            first = asyncio.ensure_future(self.single_page(self.after))
+            task = first
+            while task is not None:
+                for rows in await task:
+                    if not rows:
+                        continue
+                    last = rows[-1]["name"]
+                    if self.drop_name:
+                        for row in rows:
+                            del row["name"]
+                    yield last, rows
+                    self.last_name = last
+                if task is first:
+                    if len(task.result()[0]) < self.page_size:
+                        return
+                    producer = asyncio.ensure_future(self.schedule(self.last_name, queue))
+                task = await queue.get()
+            await producer  # raise a failed page-end lookup
+        finally:
+            if producer is not None:
+                producer.cancel()
+            while not queue.empty():
+                task = queue.get_nowait()
+                if task is None:
+                    continue
+                if task.done() and not task.cancelled():
+                    task.exception()  # already failed/finished; mark retrieved
+                else:
+                    task.cancel()
+
+    async def rows(self):
+        """Yield rows one at a time"""
+        async for _, rows in self.pages():
+            for row in rows:
+                yield row
+
+    async def fetch_all(self):
+        """Collect every row (for datasets that are cached whole anyway)"""
+        data = []
+        async for _, rows in self.pages():
+            data.extend(rows)
+        return data
@@ -0,0 +1,390 @@
+"""
+Response cache backends
+MemoryCache: per-process LRU with monotonic TTLs (single worker, the default)
+RedisCache: shared by every worker/host through Redis, with a per-worker near cache
+kept coherent by pub/sub invalidation
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+
+from structured_logging import sampled
+
+logger = logging.getLogger("wms.cache")
+
+
+class CacheUnavailable(Exception):
+    """The shared cache could not be reached (the invalidation may not have reached other workers)"""
+
+
+class CacheBackend:
+    """
+    Interface shared by the backends. get() returns fresh data or None;
+    get_stale() returns (data, seconds_until_expiry) while within stale_ttl.
+    Data must be JSON-serializable to be stored in Redis.
+    """
+
+    name = None
+
+    def __init__(self, key_families=()):
+        self.key_families = key_families  # key prefixes counted separately
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.families = {}  # key family -> [hits, stale_hits, misses]
+        self.listeners = []  # fn(key or None), called when another worker clears keys
+
+    def _count(self, key, slot):
+        family = next((f for f in self.key_families if key.startswith(f)), "other")
+        counts = self.families.get(family)
+        if counts is None:
+            counts = self.families[family] = [0, 0, 0]
+        counts[slot] += 1
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def get_stale(self, key):
+        raise NotImplementedError
+
+    async def set(self, key, data, ttl_seconds=300, stale_ttl=0):
+        raise NotImplementedError
+
+    async def clear(self, key=None):
+        raise NotImplementedError
+
+    async def claim(self, key, seconds):
+        """True if this worker should refresh `key`; others keep serving what they have"""
+        return True
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def stats(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "backend": self.name,
+            "size": len(self),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+
+class MemoryCache(CacheBackend):
+    """Bounded in-memory cache: LRU eviction + monotonic TTLs"""
+
+    name = "memory"
+
+    def __init__(self, max_entries=1000, sweep_interval=60, key_families=()):
+        super().__init__(key_families)
+        self.cache = OrderedDict()  # key -> (data, expiry, stale_until), least recently used first
+        self.max_entries = max_entries
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    async def get(self, key):
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        entry = self.cache.get(key)
+        if entry is not None:
+            data, expiry, stale_until = entry
+            if now < expiry:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                self._count(key, 0)
+                return data
+            if now >= stale_until:
+                del self.cache[key]
+                self.expirations += 1
+        self.misses += 1
+        self._count(key, 2)
+        return None
+
+    async def get_stale(self, key):
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        entry = self.cache.get(key)
+        if entry is not None:
+            data, expiry, stale_until = entry
+            if now < stale_until:
+                self.cache.move_to_end(key)
+                if now < expiry:
+                    self.hits += 1
+                    self._count(key, 0)
+                else:
+                    self.stale_hits += 1
+                    self._count(key, 1)
+                return data, expiry - now
+            del self.cache[key]
+            self.expirations += 1
+        self.misses += 1
+        self._count(key, 2)
+        return None
+
+    async def set(self, key, data, ttl_seconds=300, stale_ttl=0):
+        """Cache data for ttl_seconds; get_stale() may keep serving it for stale_ttl more"""
+        now = time.monotonic()
+        self._maybe_sweep(now)
+        self.cache[key] = (data, now + ttl_seconds, now + ttl_seconds + stale_ttl)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+    async def clear(self, key=None):
+        if key:
+            self.cache.pop(key, None)
+        else:
+            self.cache.clear()
+
+    def _maybe_sweep(self, now):
+        """Amortized sweep: drop all expired entries at most once per interval"""
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        expired = [k for k, (_, _, stale_until) in self.cache.items() if stale_until <= now]
+        for k in expired:
+            del self.cache[k]
+        self.expirations += len(expired)
+
+    def __len__(self):
+        return len(self.cache)
+
+    def stats(self):
+        return {**super().stats(), "max_entries": self.max_entries}
+
+
+class RedisCache(CacheBackend):
+    """
+    Entries live in Redis hashes (version, expiry, stale_until, JSON data) with
+    wall-clock expiry, so every worker sees the same fills and TTLs. Each worker
+    keeps decoded copies in a near cache for up to local_ttl seconds; sets and
+    clears are published on a channel so other workers drop their copies at once.
+    Revalidating a near-cache copy fetches only the version, so large values
+    (the locations list) keep their object identity until they really change.
+    """
+
+    name = "redis"
+
+    def __init__(self, url, prefix="wms:cache:", local_ttl=30, local_max_entries=1000, key_families=()):
+        import redis.asyncio as redis  # only needed with CACHE_BACKEND=redis
+
+        super().__init__(key_families)
+        self.redis_errors = (redis.RedisError, OSError)
+        self.redis = redis.from_url(url)
+        self.url = url
+        self.prefix = prefix
+        self.channel = prefix + "invalidate"
+        self.local_ttl = local_ttl
+        self.local_max_entries = local_max_entries
+        self.local = OrderedDict()  # key -> (data, version, expiry, stale_until, trusted_until)
+        self.node = f"{os.getpid()}-{random.getrandbits(32):08x}"  # ignore our own invalidations
+        self.sequence = 0
+        self.subscribed = False  # near-cache copies are only trusted while we hear invalidations
+        self.errors = 0
+        self.invalidations_received = 0
+        self.task = None
+
+    async def _lookup(self, key):
+        """(data, version, expiry, stale_until, trusted_until) from the near cache or Redis, or None"""
+        entry = self.local.get(key)
+        if entry is not None and self.subscribed and time.monotonic() < entry[4]:
+            self.local.move_to_end(key)
+            return entry
+        name = self.prefix + key
+        try:
+            if entry is not None:
+                version, expiry, stale_until = await self.redis.hmget(name, "v", "e", "s")
+                if version is not None and version.decode() == entry[1]:
+                    entry = (entry[0], entry[1], float(expiry), float(stale_until), time.monotonic() + self.local_ttl)
+                    self._remember(key, entry)
+                    return entry
+            version, expiry, stale_until, data = await self.redis.hmget(name, "v", "e", "s", "d")
+        except self.redis_errors as e:
+            # Degrade to whatever this worker already has (or a miss) rather than failing the request
+            self._error("Cache read failed", key, e)
+            return entry
+        if version is None:
+            self.local.pop(key, None)
+            return None
+        entry = (json.loads(data), version.decode(), float(expiry), float(stale_until),
+                 time.monotonic() + self.local_ttl)
+        self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        self.local[key] = entry
+        self.local.move_to_end(key)
+        while len(self.local) > self.local_max_entries:
+            self.local.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key):
+        entry = await self._lookup(key)
+        if entry is not None:
+            now = time.time()
+            if now < entry[2]:
+                self.hits += 1
+                self._count(key, 0)
+                return entry[0]
+            if now >= entry[3]:
+                self.local.pop(key, None)
+                self.expirations += 1
+        self.misses += 1
+        self._count(key, 2)
+        return None
+
+    async def get_stale(self, key):
+        entry = await self._lookup(key)
+        if entry is not None:
+            now = time.time()
+            if now < entry[3]:
+                if now < entry[2]:
+                    self.hits += 1
+                    self._count(key, 0)
+                else:
+                    self.stale_hits += 1
+                    self._count(key, 1)
+                return entry[0], entry[2] - now
+            self.local.pop(key, None)
+            self.expirations += 1
+        self.misses += 1
+        self._count(key, 2)
+        return None
+
+    async def set(self, key, data, ttl_seconds=300, stale_ttl=0):
+        now = time.time()
+        self.sequence += 1
+        version = f"{self.node}:{self.sequence}"
+        expiry, stale_until = now + ttl_seconds, now + ttl_seconds + stale_ttl
+        self._remember(key, (data, version, expiry, stale_until, time.monotonic() + self.local_ttl))
+        name = self.prefix + key
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(name)
+                pipe.hset(name, mapping={"v": version, "e": repr(expiry), "s": repr(stale_until),
+                                         "d": json.dumps(data)})
+                pipe.pexpireat(name, int(stale_until * 1000) + 1)
+                pipe.publish(self.channel, self._message("set", key))
+                await pipe.execute()
+        except self.redis_errors as e:
+            self._error("Cache write failed", key, e)
+
+    async def clear(self, key=None):
+        """Drop key (or everything) here, in Redis, and in every other worker's near cache"""
+        if key:
+            self.local.pop(key, None)
+        else:
+            self.local.clear()
+        try:
+            if key:
+                await self.redis.delete(self.prefix + key)
+            else:
+                batch = []
+                async for name in self.redis.scan_iter(match=self.prefix + "*", count=500):
+                    batch.append(name)
+                    if len(batch) >= 500:
+                        await self.redis.unlink(*batch)
+                        batch = []
+                if batch:
+                    await self.redis.unlink(*batch)
+            await self.redis.publish(self.channel, self._message("clear", key))
+        except self.redis_errors as e:
+            self.errors += 1
+            raise CacheUnavailable(f"Redis cache unavailable: {e}") from e
+
+    async def claim(self, key, seconds):
+        """One worker per key refreshes at a time; the claim expires on its own"""
+        try:
+            return bool(await self.redis.set(f"{self.prefix}claim:{key}", self.node, nx=True, px=int(seconds * 1000)))
+        except self.redis_errors as e:
+            self._error("Cache claim failed", key, e)
+            return True
+
+    def _message(self, op, key):
+        return json.dumps({"node": self.node, "op": op, "key": key})
+
+    def _on_message(self, raw):
+        message = json.loads(raw)
+        if message["node"] == self.node:
+            return
+        self.invalidations_received += 1
+        key = message["key"]
+        if key:
+            self.local.pop(key, None)
+        else:
+            self.local.clear()
+        if message["op"] == "clear":
+            for listener in self.listeners:
+                listener(key)
+
+    def _error(self, message, key, error):
+        self.errors += 1
+        if sampled():
+            logger.warning(message, extra={"key": key, "error": str(error)})
+
+    async def _listen(self):
+        """Apply other workers' invalidations; reconnect with a clean near cache after a drop"""
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                # Anything published while we were not listening is lost
+                self.local.clear()
+                self.subscribed = True
+                logger.info("Cache invalidation channel subscribed", extra={"channel": self.channel})
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self._on_message(message["data"])
+            except self.redis_errors as e:
+                self.errors += 1
+                if self.subscribed:  # once per outage, not once per reconnect attempt
+                    logger.warning("Cache invalidation channel lost", extra={"error": str(e)})
+            finally:
+                self.subscribed = False
+                await pubsub.aclose()
+            await asyncio.sleep(1)
+
+    async def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.redis.aclose()
+
+    def __len__(self):
+        return len(self.local)
+
+    def stats(self):
+        return {
+            **super().stats(),
+            "max_entries": self.local_max_entries,
+            "local_ttl": self.local_ttl,
+            "subscribed": self.subscribed,
+            "errors": self.errors,
+            "invalidations_received": self.invalidations_received
+        }
@@ -0,0 +1,72 @@
+"""
+Local digest store for sync change detection
+Keeps a content hash per synced row so unchanged rows are never re-upserted
+"""
+
+import hashlib
+import json
+import sqlite3
+
+# Bookkeeping columns that change every run and must not affect the hash
+VOLATILE_FIELDS = ("last_synced", "last_updated")
+
+
+def row_digest(row, volatile=VOLATILE_FIELDS):
+    content = {k: v for k, v in row.items() if k not in volatile}
+    return hashlib.blake2b(json.dumps(content, sort_keys=True, default=str).encode(), digest_size=16).digest()
+
+
+class DigestStore:
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            " tbl TEXT NOT NULL, key TEXT NOT NULL, digest BLOB NOT NULL,"
+            " PRIMARY KEY (tbl, key)) WITHOUT ROWID"
+        )
+        self.skipped = {}  # table -> rows skipped this run
+
+    @staticmethod
+    def key(row, key_fields):
+        return "\0".join(str(row[f]) for f in key_fields)
+
+    def changed(self, table, rows, key_fields):
+        """Rows whose content hash differs from the last successful upsert"""
+        if not rows:
+            return []
+        keys = [self.key(r, key_fields) for r in rows]
+        stored = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            placeholders = ",".join("?" * len(chunk))
+            stored.update(self.db.execute(
+                f"SELECT key, digest FROM digests WHERE tbl = ? AND key IN ({placeholders})", [table, *chunk]
+            ).fetchall())
+        changed = [r for r, k in zip(rows, keys) if stored.get(k) != row_digest(r)]
+        self.skipped[table] = self.skipped.get(table, 0) + len(rows) - len(changed)
+        return changed
+
+    def record(self, table, rows, key_fields):
+        """Remember digests once rows are safely upserted"""
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO digests (tbl, key, digest) VALUES (?, ?, ?)",
+                [(table, self.key(r, key_fields), row_digest(r)) for r in rows]
+            )
+
+    def forget(self, table, keys):
+        """Drop digests for deleted rows (key tuples) so a re-created row is synced again"""
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM digests WHERE tbl = ? AND key = ?",
+                [(table, "\0".join(str(v) for v in key)) for key in keys]
+            )
+
+    def clear(self, table=None):
+        with self.db:
+            if table:
+                self.db.execute("DELETE FROM digests WHERE tbl = ?", (table,))
+            else:
+                self.db.execute("DELETE FROM digests")
@@ -0,0 +1,154 @@
+"""
+Pre-encoded JSON response bodies
+orjson when installed (stdlib json otherwise); each cached value is encoded
+and gzipped once, then its bytes are reused for every hit
+"""
+
+import gzip
+import json
+import weakref
+from collections import OrderedDict, deque
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional: ~5-10x faster than the stdlib encoder
+    orjson = None
+
+
+def dumps(value):
+    """Compact UTF-8 JSON bytes (same output as FastAPI's JSONResponse)"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def accepts_gzip(accept_encoding):
+    """True if an Accept-Encoding header allows gzip: an explicit gzip entry wins over *, q=0 refuses"""
+    gzip_q = star_q = None
+    for part in (accept_encoding or "").split(","):
+        name, *params = part.split(";")
+        q = 1.0
+        for param in params:
+            param_name, _, value = param.strip().partition("=")
+            if param_name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    pass  # malformed q: as if absent
+        name = name.strip().lower()
+        if name in ("gzip", "x-gzip"):
+            gzip_q = q if gzip_q is None else max(gzip_q, q)
+        elif name == "*":
+            star_q = q
+    q = gzip_q if gzip_q is not None else star_q
+    return q is not None and q > 0
+
+
+class EncodedBody:
+    """JSON bytes of one value, plus a gzip copy when it is worth sending compressed"""
+
+    __slots__ = ("body", "gzipped")
+
+    def __init__(self, body, gzipped=None):
+        self.body = body  # bytes or a memoryview (e.g. into a mapped snapshot)
+        self.gzipped = gzipped
+
+    def response(self, accept_encoding=None, headers=None):
+        headers = dict(headers or {})
+        if self.gzipped is None:
+            return Response(self.body, media_type="application/json", headers=headers)
+        headers["Vary"] = "Accept-Encoding"
+        if accepts_gzip(accept_encoding):
+            headers["Content-Encoding"] = "gzip"
+            return Response(self.gzipped, media_type="application/json", headers=headers)
+        return Response(self.body, media_type="application/json", headers=headers)
+
+
+class BodyCache:
+    """
+    Encoded bodies per key, valid while the key's source is the same object:
+    the index a search ran against, or a mapped snapshot. Sources are held
+    weakly, so a replaced source can be collected and its bodies are dropped.
+    A content version (a str) can stand in for the source: the body is reused
+    while the version is equal. Keys that name a content version themselves
+    use source=None. Sources that cannot be weakly referenced (plain lists)
+    are encoded on every call.
+    """
+
+    def __init__(self, max_entries=2000, gzip_min_size=1024, gzip_level=6):
+        self.max_entries = max_entries
+        self.gzip_min_size = gzip_min_size  # bytes; 0 disables gzip
+        self.gzip_level = gzip_level
+        self.entries = OrderedDict()  # key -> (weakref, version or None, EncodedBody), least recently used first
+        self.collected = deque()  # (key, weakref) of collected sources, dropped on the next put
+        self.hits = 0
+        self.encodes = 0
+
+    def encode(self, value):
+        body = value if isinstance(value, bytes) else dumps(value)  # bytes: already-encoded JSON
+        self.encodes += 1
+        return EncodedBody(body, self.compress(body))
+
+    def compress(self, body):
+        if self.gzip_min_size and len(body) >= self.gzip_min_size:
+            return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        return None
+
+    def lookup(self, key, source):
+        """Stored body for key if it was built from source, else None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        ref, version, body = entry
+        if ref is not None:
+            if source is None or ref() is not source:
+                return None
+        elif version != source:
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key, source, body):
+        """Store body for key; False if source cannot be held weakly (nothing stored)"""
+        while self.collected:
+            dead_key, dead_ref = self.collected.popleft()
+            entry = self.entries.get(dead_key)
+            if entry is not None and entry[0] is dead_ref:
+                del self.entries[dead_key]
+        if source is None or isinstance(source, str):
+            entry = (None, source, body)
+        else:
+            try:
+                # The callback only queues the key: it may run in any thread, mid-iteration
+                entry = (weakref.ref(source, lambda ref, key=key: self.collected.append((key, ref))), None, body)
+            except TypeError:
+                return False
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return True
+
+    def get(self, key, source, build=None):
+        """Body for key; encodes build() (default: source itself) when source changed"""
+        body = self.lookup(key, source)
+        if body is None:
+            body = self.encode(build() if build is not None else source)
+            self.put(key, source, body)
+        return body
+
+    def response(self, key, source, accept_encoding=None, build=None, headers=None):
+        return self.get(key, source, build).response(accept_encoding, headers)
+
+    def stats(self):
+        return {
+            "encoder": "orjson" if orjson is not None else "json",
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "encodes": self.encodes,
+            "bytes": sum(len(body.body) + len(body.gzipped or b"") for _, _, body in list(self.entries.values()))
+        }
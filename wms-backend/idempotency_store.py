@@ -0,0 +1,132 @@
+"""
+Durable idempotency store for stock entries
+Maps a client idempotency key to the ERPNext result so replays never create a second draft
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+
+
+def request_digest(payload):
+    return hashlib.blake2b(json.dumps(payload, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+class IdempotencyStore:
+    """
+    Rows are `pending` while a request holds the key and `done` once ERPNext answered.
+    A pending claim expires after `lease` seconds so a crashed worker doesn't block the key;
+    done rows expire after `ttl` seconds. A key released after an error that may have
+    reached ERPNext (a timeout, a 5xx) is kept as `unsure`: like an expired claim, the
+    next claim is told to look for the draft before sending it again. WAL mode keeps
+    lookups fast while other workers write.
+    """
+
+    def __init__(self, path, ttl=604800, lease=120):
+        self.ttl = ttl
+        self.lease = lease
+        self.db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            " key TEXT PRIMARY KEY, digest TEXT NOT NULL, status TEXT NOT NULL,"
+            " response TEXT, expires REAL NOT NULL) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS idempotency_expires ON idempotency (expires)")
+        self.replayed = 0
+        self.stored = 0
+        self._writes = 0
+
+    def get(self, key, digest):
+        """
+        Stored response for a completed key, or None. Raises IdempotencyConflict if the key
+        is completed, held or unsure for a different payload.
+        """
+        row = self.db.execute(
+            "SELECT digest, status, response FROM idempotency WHERE key = ? AND (expires > ? OR status = 'pending')",
+            (key, time.time())
+        ).fetchone()
+        if row is None:
+            return None
+        if row[0] != digest:
+            raise IdempotencyConflict(f"idempotency_key {key} was used for a different stock entry")
+        if row[1] != "done":
+            return None
+        self.replayed += 1
+        return json.loads(row[2])
+
+    def claim(self, key, digest):
+        """
+        Take the key for this request. False if another request holds it or already completed it;
+        otherwise "new", or "retry" when an earlier attempt may have created the draft
+        (its worker crashed, or it failed with an unsure error).
+        Raises IdempotencyConflict if that earlier attempt was for a different payload.
+        """
+        now = time.time()
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute("SELECT digest, status, expires FROM idempotency WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                stored_digest, status, expires = row
+                if status != "unsure" and expires > now:
+                    return False
+                if status == "pending" or (status == "unsure" and expires > now):
+                    if stored_digest != digest:
+                        raise IdempotencyConflict(f"idempotency_key {key} was used for a different stock entry")
+                    self.db.execute(
+                        "UPDATE idempotency SET status = 'pending', expires = ? WHERE key = ?", (now + self.lease, key)
+                    )
+                    return "retry"
+                self.db.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+            self.db.execute(
+                "INSERT INTO idempotency (key, digest, status, expires) VALUES (?, ?, 'pending', ?)",
+                (key, digest, now + self.lease)
+            )
+        return "new"
+
+    def complete(self, key, response):
+        with self.db:
+            self.db.execute(
+                "UPDATE idempotency SET status = 'done', response = ?, expires = ? WHERE key = ?",
+                (json.dumps(response, default=str), time.time() + self.ttl, key)
+            )
+        self.stored += 1
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self.purge()
+
+    def release(self, key, unsure=False):
+        """
+        Drop a pending claim after a failed request so the client can retry.
+        unsure: the request may have reached ERPNext, so the next claim must check for the draft first.
+        """
+        with self.db:
+            if unsure:
+                self.db.execute(
+                    "UPDATE idempotency SET status = 'unsure', expires = ? WHERE key = ? AND status = 'pending'",
+                    (time.time() + self.ttl, key)
+                )
+            else:
+                self.db.execute("DELETE FROM idempotency WHERE key = ? AND status = 'pending'", (key,))
+
+    def purge(self):
+        # Expired pending claims stay (as possibly sent) until a done row would have expired
+        now = time.time()
+        with self.db:
+            return self.db.execute(
+                "DELETE FROM idempotency WHERE expires <= ? AND (status != 'pending' OR expires <= ?)",
+                (now, now - self.ttl)
+            ).rowcount
+
+    def stats(self):
+        return {
+            "keys": self.db.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0],
+            "replayed": self.replayed,
+            "stored": self.stored
+        }
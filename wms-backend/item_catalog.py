@@ -0,0 +1,122 @@
+"""
+Local item catalog mirror
+Bulk-loaded from ERPNext, kept current with `modified` deltas, searched in memory
+"""
+
+import asyncio
+import logging
+import time
+
+from bulk_fetch import PagedFetcher
+from search_index import ItemIndex
+
+logger = logging.getLogger("wms.item_catalog")
+
+ITEM_FIELDS = ["name", "item_code", "item_name", "stock_uom", "custom_barcode", "custom_stock_location"]
+
+
+class ItemCatalog:
+    def __init__(self, page_size=500, workers=4, refresh_interval=60, full_refresh_interval=21600):
+        self.page_size = page_size
+        self.workers = workers
+        self.refresh_interval = refresh_interval  # seconds between delta pulls
+        self.full_refresh_interval = full_refresh_interval  # full reload drops items deleted in ERPNext
+        self.items = {}  # item_code -> item row
+        self.index = None
+        self.high_water = None  # newest `modified` seen
+        self.last_full_load = None  # monotonic
+        self.last_refresh = None  # wall clock, for stats
+        self.delta_rows = 0
+        self.on_publish = None  # callable(items sorted by item_code), run in a thread after each swap
+        self.task = None
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    async def fetch(self, client, filters=None):
+        """Fetch Item rows with concurrent paging"""
+        return await PagedFetcher(
+            client.get, "Item", ITEM_FIELDS + ["modified"], filters=filters,
+            page_size=self.page_size, workers=self.workers
+        ).fetch_all()
+
+    async def load(self, client):
+        """Bulk load the full catalog"""
+        rows = await self.fetch(client)
+        await self._publish({}, rows)
+        self.last_full_load = time.monotonic()
+        logger.info("Item catalog loaded", extra={"items": len(self.items)})
+
+    async def refresh(self, client):
+        """Pull only items modified since the high-water mark"""
+        if self.high_water is None:
+            return await self.load(client)
+        # >= so rows sharing the high-water timestamp are never missed (upsert is idempotent)
+        rows = await self.fetch(client, filters=[["modified", ">=", self.high_water]])
+        changed = [r for r in rows if self.items.get(r["item_code"]) != _strip(r)]
+        if changed:
+            await self._publish(self.items, changed)
+            self.delta_rows += len(changed)
+            logger.info("Item catalog delta", extra={"changed": len(changed)})
+        self.last_refresh = time.time()
+
+    async def _publish(self, base, rows):
+        """Build the new snapshot + index off the event loop, then swap it in"""
+        items = dict(base)
+        high_water = self.high_water if base else None
+        for row in rows:
+            modified = row.get("modified")
+            if modified and (high_water is None or modified > high_water):
+                high_water = modified
+            items[row["item_code"]] = _strip(row)
+        ordered = sorted(items.values(), key=lambda item: item["item_code"])
+        index = await asyncio.to_thread(ItemIndex, ordered)
+        self.items, self.index, self.high_water = items, index, high_water
+        self.last_refresh = time.time()
+        if self.on_publish is not None:
+            await asyncio.to_thread(self.on_publish, ordered)
+
+    def search(self, q, limit=20):
+        return self.index.search(q, limit)
+
+    async def run(self, client):
+        """Background loop: initial load, periodic deltas, occasional full reload"""
+        while True:
+            try:
+                due_full = (self.last_full_load is None or
+                            time.monotonic() - self.last_full_load >= self.full_refresh_interval)
+                if due_full:
+                    await self.load(client)
+                else:
+                    await self.refresh(client)
+            except Exception as e:
+                logger.warning("Item catalog refresh failed", extra={"error": str(e)})
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, client):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run(client))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "items": len(self.items),
+            "high_water": self.high_water,
+            "delta_rows": self.delta_rows,
+            "last_refresh": self.last_refresh
+        }
+
+
+def _strip(row):
+    """Item row as returned by search (without sync bookkeeping fields)"""
+    return {field: row.get(field) for field in ITEM_FIELDS}
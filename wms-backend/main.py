@@ -3,15 +3,37 @@ Global Spectrum WMS - FastAPI Backend
 Handles all ERPNext communication
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response
 from pydantic import BaseModel
 from typing import List, Optional
-import requests
+import asyncio
+import httpx
+import logging
 import os
+import random
+import uuid
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
 from functools import lru_cache
+from bulk_fetch import PagedFetcher
+from cache_backend import CacheUnavailable, MemoryCache, RedisCache
+from fast_json import BodyCache, dumps
+from item_catalog import ItemCatalog
+from search_index import LocationIndex
+from shared_snapshot import LeaderLock, SharedItemIndex, SharedLocationIndex, Snapshot, SnapshotFile, write_item_snapshot, write_location_snapshot
+from stock_projection import StockProjection
+from versioning import RowsVersion, VersionedRows, delta_json, diff, etag, etag_matches, keyed_digests
+from idempotency_store import IdempotencyConflict, IdempotencyStore, request_digest
+from outbox import Outbox
+from metrics import Registry
+from offline_bundle import TableBuilder, bundle_json, bundle_version, delta_section, split_version
+from profiling import RequestTimings, SamplingProfiler, span, timings_var, upstream
+import structured_logging
+from structured_logging import request_id_var, sampled, setup_logging
 
 # Load environment variables
 load_dotenv()
@@ -20,39 +42,283 @@ ERPNEXT_URL = os.getenv("ERPNEXT_URL")
 API_KEY = os.getenv("ERPNEXT_API_KEY")
 API_SECRET = os.getenv("ERPNEXT_API_SECRET")
 
-# Simple in-memory cache
-class SimpleCache:
+# Logging (JSON lines on stdout, written by a background thread)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json | text
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.1))  # share of per-request hot-path lines kept
+
+setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLE_RATE)
+logger = logging.getLogger("wms.api")
+
+# Profiling (Server-Timing header on every response + GET /api/debug/profile)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 60))
+
+# ERPNext connection pool settings
+ERPNEXT_POOL_SIZE = int(os.getenv("ERPNEXT_POOL_SIZE", 20))  # keep-alive connections
+ERPNEXT_MAX_PER_HOST = int(os.getenv("ERPNEXT_MAX_PER_HOST", 10))  # concurrent calls per host
+ERPNEXT_TIMEOUT = float(os.getenv("ERPNEXT_TIMEOUT", 30))  # seconds
+ERPNEXT_CONNECT_TIMEOUT = float(os.getenv("ERPNEXT_CONNECT_TIMEOUT", 10))  # seconds
+ERPNEXT_PAGE_SIZE = int(os.getenv("ERPNEXT_PAGE_SIZE", 500))  # rows per page for bulk fetches
+ERPNEXT_FETCH_WORKERS = int(os.getenv("ERPNEXT_FETCH_WORKERS", 4))  # concurrent pages per bulk fetch
+BALANCE_CACHE_TTL = float(os.getenv("BALANCE_CACHE_TTL", 0))  # seconds; 0 = always live (opt-in cache)
+BALANCE_BATCH_MAX_PAIRS = int(os.getenv("BALANCE_BATCH_MAX_PAIRS", 2000))
+BALANCE_BATCH_CHUNK = int(os.getenv("BALANCE_BATCH_CHUNK", 100))  # values per "in" filter (keeps URLs short)
+
+STOCK_ENTRY_BULK_MAX_ENTRIES = int(os.getenv("STOCK_ENTRY_BULK_MAX_ENTRIES", 500))
+STOCK_ENTRY_BULK_MAX_LINES = int(os.getenv("STOCK_ENTRY_BULK_MAX_LINES", 100))  # item lines per merged document
+STOCK_ENTRY_BULK_CONCURRENCY = int(os.getenv("STOCK_ENTRY_BULK_CONCURRENCY", 4))  # documents posted at once
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", ".idempotency.sqlite")
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 604800))  # seconds a completed key replays its result
+
+# Write-behind outbox (POST /api/stock-entry/queue acks locally, workers post to ERPNext)
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "false").lower() == "true"
+OUTBOX_DB = os.getenv("OUTBOX_DB", ".outbox.sqlite")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))  # entries posted to ERPNext at once
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))  # then the entry is marked failed
+OUTBOX_BACKOFF = float(os.getenv("OUTBOX_BACKOFF", 2))  # seconds, doubled per attempt (capped at 5 min)
+
+# Cache settings
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory (per worker) | redis (shared by all workers/hosts)
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_REDIS_PREFIX = os.getenv("CACHE_REDIS_PREFIX", "wms:cache:")
+CACHE_LOCAL_TTL = float(os.getenv("CACHE_LOCAL_TTL", 30))  # seconds a worker reuses its copy of a Redis entry without checking
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 1000))
+CACHE_SWEEP_INTERVAL = float(os.getenv("CACHE_SWEEP_INTERVAL", 60))  # seconds
+LOCATIONS_TTL = int(os.getenv("LOCATIONS_TTL", 600))  # seconds before a background refresh is due
+LOCATIONS_STALE_TTL = int(os.getenv("LOCATIONS_STALE_TTL", 86400))  # serve stale locations this long past TTL (0 = off)
+LOCATIONS_REFRESH_AHEAD = int(os.getenv("LOCATIONS_REFRESH_AHEAD", 60))  # refresh this many seconds before expiry (0 = off)
+CACHE_WARM_ON_STARTUP = os.getenv("CACHE_WARM_ON_STARTUP", "true").lower() == "true"
+
+# Local item catalog mirror (serves /api/items/search without ERPNext calls)
+ITEM_CATALOG_ENABLED = os.getenv("ITEM_CATALOG_ENABLED", "true").lower() == "true"
+ITEM_CATALOG_REFRESH_INTERVAL = int(os.getenv("ITEM_CATALOG_REFRESH_INTERVAL", 60))  # seconds between delta pulls
+ITEM_CATALOG_FULL_REFRESH_INTERVAL = int(os.getenv("ITEM_CATALOG_FULL_REFRESH_INTERVAL", 21600))  # full reload (drops deleted items)
+
+# Local stock projection (Bin snapshot + our own Stock Entries, reconciled against ERPNext)
+STOCK_PROJECTION_ENABLED = os.getenv("STOCK_PROJECTION_ENABLED", "false").lower() == "true"
+STOCK_PROJECTION_RECONCILE_INTERVAL = int(os.getenv("STOCK_PROJECTION_RECONCILE_INTERVAL", 900))  # seconds between drift checks
+
+# Shared snapshots for multi-process serving (serve.py turns this on): one worker fetches the
+# locations and item catalog and publishes them as mmap'd files every worker searches in place
+SHARED_SNAPSHOTS = os.getenv("SHARED_SNAPSHOTS", "false").lower() == "true"
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "/dev/shm/wms-snapshots" if os.path.isdir("/dev/shm") else ".snapshots")
+SNAPSHOT_CHECK_INTERVAL = float(os.getenv("SNAPSHOT_CHECK_INTERVAL", 1))  # seconds between checks for a newer file
+SNAPSHOT_LEADER_RETRY = float(os.getenv("SNAPSHOT_LEADER_RETRY", 5))  # seconds between attempts to take over publishing
+
+# Pre-encoded responses: cached lists and search results are JSON-encoded (and gzipped) once per
+# cached value, and every hit sends the stored bytes
+RESPONSE_BODY_CACHE_ENTRIES = int(os.getenv("RESPONSE_BODY_CACHE_ENTRIES", 2000))  # encoded bodies kept (LRU)
+RESPONSE_GZIP_MIN_SIZE = int(os.getenv("RESPONSE_GZIP_MIN_SIZE", 1024))  # bytes; smaller bodies go uncompressed (0 = never gzip)
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", 6))
+DELTA_VERSIONS_KEPT = int(os.getenv("DELTA_VERSIONS_KEPT", 8))  # versions of each list a `since` delta can start from
+
+CACHE_KEY_FAMILIES = ("locations", "item_search", "balance")  # key prefixes reported separately in /metrics
+
+# Coalesce concurrent cache misses into one upstream fetch per key
+class SingleFlight:
     def __init__(self):
-        self.cache = {}
+        self.inflight = {}  # key -> running fetch task
+        self.calls = 0  # upstream fetches actually started
+        self.shared = 0  # callers served by another caller's fetch (upstream calls saved)
     
-    def get(self, key):
-        if key in self.cache:
-            data, expiry = self.cache[key]
-            if datetime.now() < expiry:
-                return data
-            else:
-                del self.cache[key]
-        return None
+    async def do(self, key, fetch):
+        """Run fetch() once per key; concurrent callers await the same result"""
+        task = self.inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fetch())
+            self.inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.shared += 1
+        # shield: a disconnecting caller must not cancel the fetch others wait on
+        return await asyncio.shield(task)
     
-    def set(self, key, data, ttl_seconds=300):
-        expiry = datetime.now() + timedelta(seconds=ttl_seconds)
-        self.cache[key] = (data, expiry)
+    def _done(self, key, task):
+        if self.inflight.get(key) is task:
+            del self.inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
     
-    def clear(self, key=None):
-        if key:
-            if key in self.cache:
-                del self.cache[key]
-        else:
-            self.cache.clear()
+    def stats(self):
+        return {
+            "in_flight": len(self.inflight),
+            "upstream_fetches": self.calls,
+            "coalesced": self.shared
+        }
 
 # Initialize cache
-cache = SimpleCache()
+if CACHE_BACKEND == "redis":
+    cache = RedisCache(CACHE_REDIS_URL, prefix=CACHE_REDIS_PREFIX, local_ttl=CACHE_LOCAL_TTL,
+                       local_max_entries=CACHE_MAX_ENTRIES, key_families=CACHE_KEY_FAMILIES)
+else:
+    cache = MemoryCache(CACHE_MAX_ENTRIES, CACHE_SWEEP_INTERVAL, key_families=CACHE_KEY_FAMILIES)
+singleflight = SingleFlight()
+item_catalog = ItemCatalog(
+    page_size=ERPNEXT_PAGE_SIZE,
+    workers=ERPNEXT_FETCH_WORKERS,
+    refresh_interval=ITEM_CATALOG_REFRESH_INTERVAL,
+    full_refresh_interval=ITEM_CATALOG_FULL_REFRESH_INTERVAL
+)
+idempotency = IdempotencyStore(IDEMPOTENCY_DB, ttl=IDEMPOTENCY_TTL, lease=ERPNEXT_TIMEOUT * 4)
+stock_projection = StockProjection(
+    page_size=ERPNEXT_PAGE_SIZE,
+    workers=ERPNEXT_FETCH_WORKERS,
+    reconcile_interval=STOCK_PROJECTION_RECONCILE_INTERVAL
+)
+background_tasks = set()  # strong refs so refresh tasks aren't garbage collected
+bodies = BodyCache(max_entries=RESPONSE_BODY_CACHE_ENTRIES, gzip_min_size=RESPONSE_GZIP_MIN_SIZE,
+                   gzip_level=RESPONSE_GZIP_LEVEL)
+location_versions = VersionedRows(max_versions=DELTA_VERSIONS_KEPT)
+item_versions = VersionedRows(max_versions=DELTA_VERSIONS_KEPT)
+# Offline bundle tables, re-encoded incrementally as their versions change
+location_tables = TableBuilder("locations")
+item_tables = TableBuilder("items")
+# CPU-heavy builds (search index, versions, encoded bodies, bundles) run in worker threads;
+# concurrent requests needing the same one share it
+builds = SingleFlight()
+
+# Shared snapshots: written by whichever worker holds the leader lock, mapped by every worker
+snapshot_meta = {"source": ERPNEXT_URL}  # snapshots left by a server for another ERPNext are ignored
+snapshot_gzip_level = RESPONSE_GZIP_LEVEL if RESPONSE_GZIP_MIN_SIZE else None  # whole-list bodies stored gzipped too
+snapshot_leader = location_snapshot = item_snapshot = None
+if SHARED_SNAPSHOTS:
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    snapshot_leader = LeaderLock(os.path.join(SNAPSHOT_DIR, "leader.lock"))
+    location_snapshot = SnapshotFile(
+        os.path.join(SNAPSHOT_DIR, "locations.snap"), SharedLocationIndex, meta=snapshot_meta,
+        max_age=LOCATIONS_TTL + LOCATIONS_STALE_TTL, check_interval=SNAPSHOT_CHECK_INTERVAL
+    )
+    item_snapshot = SnapshotFile(
+        os.path.join(SNAPSHOT_DIR, "items.snap"), SharedItemIndex, meta=snapshot_meta,
+        check_interval=SNAPSHOT_CHECK_INTERVAL
+    )
+
+# Prometheus metrics (GET /metrics). Each worker process counts only its own requests, so
+# with several workers (serve.py sets WEB_CONCURRENCY) every series carries a pid label
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", 1))
+metrics = Registry(const_labels={"pid": os.getpid()} if WEB_CONCURRENCY > 1 else None)
+http_latency = metrics.histogram("wms_http_request_duration_seconds", "API request latency", ("method", "route", "status"))
+http_in_flight = metrics.gauge("wms_http_requests_in_flight", "API requests being handled")
+erpnext_latency = metrics.histogram("wms_erpnext_request_duration_seconds", "ERPNext call latency", ("method", "endpoint"))
+erpnext_errors = metrics.counter("wms_erpnext_errors_total", "Failed ERPNext calls", ("method", "endpoint", "status"))
+erpnext_in_flight = metrics.gauge("wms_erpnext_requests_in_flight", "ERPNext calls in progress (incl. waiting for a host slot)")
+cache_lookups = metrics.counter("wms_cache_lookups_total", "Cache lookups by key family and result", ("family", "result"))
+cache_entries = metrics.gauge("wms_cache_entries", "Entries in the response cache")
+cache_evictions = metrics.counter("wms_cache_evictions_total", "LRU evictions")
+singleflight_coalesced = metrics.counter("wms_singleflight_coalesced_total", "Callers served by another caller's ERPNext fetch")
+item_catalog_items = metrics.gauge("wms_item_catalog_items", "Items in the local catalog mirror")
+outbox_entries = metrics.gauge("wms_outbox_entries", "Outbox entries by state", ("status",))
+outbox_oldest = metrics.gauge("wms_outbox_oldest_pending_seconds", "Age of the oldest unsent outbox entry")
+projection_drift = metrics.gauge("wms_stock_projection_drifted_bins", "Bins that differed from ERPNext at the last reconcile")
+log_dropped = metrics.counter("wms_log_records_dropped_total", "Log records dropped because the log queue was full")
+
+def erpnext_endpoint(url):
+    """Low-cardinality label: /api/resource/<doctype>[/{name}] or the method path"""
+    parts = httpx.URL(url).path.split("/")
+    if len(parts) > 4 and parts[2] == "resource":
+        return "/".join(parts[:4]) + "/{name}"
+    return "/".join(parts[:4])
+
+def collect_metrics():
+    """Copy counters kept by the components into gauges at scrape time"""
+    for family, counts in cache.families.items():
+        for result, count in zip(("hit", "stale", "miss"), counts):
+            cache_lookups.set(count, family, result)
+    cache_entries.set(len(cache))
+    cache_evictions.set(cache.evictions)
+    singleflight_coalesced.set(singleflight.shared)
+    shared_items = item_snapshot.current() if item_snapshot is not None and not item_catalog.ready else None
+    item_catalog_items.set(shared_items.snapshot.count if shared_items else len(item_catalog.items))
+    stats = outbox.stats()
+    for status in ("queued", "sending", "done", "failed"):
+        outbox_entries.set(stats[status], status)
+    outbox_oldest.set(stats["oldest_pending_seconds"])
+    projection_drift.set((stock_projection.last_drift or {}).get("drifted", 0))
+    log_dropped.set(structured_logging.stats()["dropped"])
+
+metrics.collectors.append(collect_metrics)
+
+def refresh_in_background(key, fetch):
+    """Start a background refresh of a cache key unless one is already running"""
+    if key in singleflight.inflight:
+        return
+    
+    async def run():
+        try:
+            # With a shared cache one worker refreshes; the rest serve stale until its write lands
+            if not await cache.claim(key, ERPNEXT_TIMEOUT):
+                return
+            await singleflight.do(key, fetch)
+        except Exception as e:
+            logger.warning("Background refresh failed", extra={"key": key, "error": str(e)})
+    
+    task = asyncio.ensure_future(run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def lead_snapshots():
+    """Wait for the leader lock, then load locations/items from ERPNext and keep their snapshots fresh"""
+    while not snapshot_leader.try_acquire():
+        await asyncio.sleep(SNAPSHOT_LEADER_RETRY)
+    logger.info("Publishing shared snapshots", extra={"dir": SNAPSHOT_DIR, "pid": os.getpid()})
+    if ITEM_CATALOG_ENABLED:
+        item_catalog.on_publish = lambda items: write_item_snapshot(item_snapshot.path, items, snapshot_meta,
+                                                                    snapshot_gzip_level)
+        item_catalog.start(erpnext)
+    while True:
+        try:
+            await singleflight.do("locations_all", fetch_locations)
+            delay = max(LOCATIONS_TTL - LOCATIONS_REFRESH_AHEAD, 1)
+        except Exception as e:
+            logger.warning("Location snapshot refresh failed", extra={"error": str(e)})
+            delay = 30
+        await asyncio.sleep(delay)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Startup/shutdown hooks"""
+    await cache.start()
+    snapshot_task = None
+    if SHARED_SNAPSHOTS:
+        # Only the leader talks to ERPNext for locations/items; the others map its files
+        snapshot_task = asyncio.ensure_future(lead_snapshots())
+    else:
+        # Warm the locations cache without delaying startup; early requests join this fetch
+        if CACHE_WARM_ON_STARTUP and await cache.get_stale("locations_all") is None:
+            refresh_in_background("locations_all", fetch_locations)
+        if ITEM_CATALOG_ENABLED:
+            item_catalog.start(erpnext)
+    if STOCK_PROJECTION_ENABLED:
+        if WEB_CONCURRENCY > 1:
+            # serve.py refuses this; guard against other multi-worker launches too
+            logger.error("Stock projection needs a single worker; not started", extra={"workers": WEB_CONCURRENCY})
+        else:
+            stock_projection.start(erpnext)
+    if OUTBOX_ENABLED:
+        outbox.start()
+    yield
+    if snapshot_task is not None:
+        snapshot_task.cancel()
+        try:
+            await snapshot_task
+        except asyncio.CancelledError:
+            pass
+        snapshot_leader.release()
+    await outbox.stop()
+    await item_catalog.stop()
+    await stock_projection.stop()
+    await cache.stop()
+    # Close pooled ERPNext connections on shutdown
+    await erpnext.close()
 
 # Initialize FastAPI
 app = FastAPI(
     title="Global Spectrum WMS API",
     description="Warehouse Management System Backend for ERPNext Integration",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS middleware - allow requests from frontend
@@ -62,50 +328,156 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing"],
 )
 
-# ERPNext API client
+class RequestMiddleware:
+    """Tag each request with an ID (the client's X-Request-ID or a new one) and record its latency"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header = next((v for k, v in scope["headers"] if k == b"x-request-id"), b"")
+        # Correlation only, not a secret: getrandbits avoids a urandom syscall per request
+        request_id = header.decode("latin-1")[:64] or f"{random.getrandbits(64):016x}"
+        token = request_id_var.set(request_id)
+        timings = RequestTimings() if PROFILING_ENABLED else None
+        timings_token = timings_var.set(timings)
+        started = time.perf_counter()
+        status = 500
+        
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [*message.get("headers", []), (b"x-request-id", request_id.encode("latin-1"))]
+                if timings is not None:
+                    headers.append((b"server-timing", timings.server_timing().encode("latin-1")))
+                    headers.append((b"timing-allow-origin", b"*"))
+                message["headers"] = headers
+            await send(message)
+        
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            http_in_flight.dec()
+            # Route template (set by the router), not the raw path, to keep label cardinality bounded
+            route = scope.get("route")
+            http_latency.observe(time.perf_counter() - started, scope["method"],
+                                 route.path if route else "unmatched", str(status))
+            if sampled() or status >= 500:
+                logger.info("Request", extra={
+                    "method": scope["method"], "path": scope["path"], "status": status,
+                    "ms": round((time.perf_counter() - started) * 1000, 1)
+                })
+            timings_var.reset(timings_token)
+            request_id_var.reset(token)
+
+app.add_middleware(RequestMiddleware)
+
+# ERPNext API client (async, pooled keep-alive connections)
 class ERPNextClient:
-    def __init__(self):
-        self.base_url = ERPNEXT_URL
+    def __init__(self, base_url=None, pool_size=ERPNEXT_POOL_SIZE, max_per_host=ERPNEXT_MAX_PER_HOST,
+                 timeout=ERPNEXT_TIMEOUT, connect_timeout=ERPNEXT_CONNECT_TIMEOUT):
+        self.base_url = base_url or ERPNEXT_URL
         self.headers = {
             "Authorization": f"token {API_KEY}:{API_SECRET}",
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
+        self.pool_size = pool_size
+        self.max_per_host = max_per_host
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self._client = None
+        self._host_limits = {}
+    
+    def _get_client(self):
+        """Lazily create the shared connection pool"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                )
+            )
+        return self._client
     
-    def get(self, endpoint, params=None):
+    def _host_limit(self, url):
+        """Semaphore capping concurrent calls to one ERPNext host"""
+        host = httpx.URL(url).host
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.max_per_host)
+        return self._host_limits[host]
+    
+    async def _request(self, method, url, **kwargs):
+        # Carry the request ID to ERPNext so its access logs line up with ours
+        request_id = request_id_var.get()
+        if request_id:
+            kwargs["headers"] = {"X-Request-ID": request_id}
+        endpoint = erpnext_endpoint(url)
+        started = time.perf_counter()
+        erpnext_in_flight.inc()
+        try:
+            with upstream():
+                async with self._host_limit(url):
+                    response = await self._get_client().request(method, url, **kwargs)
+        except httpx.HTTPError:
+            erpnext_errors.inc(method, endpoint, "network")
+            raise
+        finally:
+            erpnext_in_flight.dec()
+        erpnext_latency.observe(time.perf_counter() - started, method, endpoint)
+        if response.status_code >= 400:
+            erpnext_errors.inc(method, endpoint, str(response.status_code))
+        if sampled():
+            logger.info("ERPNext call", extra={
+                "method": method, "url": url, "status": response.status_code,
+                "ms": round((time.perf_counter() - started) * 1000, 1)
+            })
+        response.raise_for_status()
+        with span("decode"):
+            return response.json()
+    
+    async def get(self, endpoint, params=None):
         """Make GET request to ERPNext"""
         url = f"{self.base_url}{endpoint}"
-        print(f"GET {url}")
         try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
+            return await self._request("GET", url, params=params)
+        except httpx.HTTPError as e:
+            logger.error("ERPNext GET failed", extra={"url": url, "error": str(e)})
             raise HTTPException(status_code=500, detail=f"ERPNext API error: {str(e)}")
     
-    def post(self, endpoint, data=None):
+    async def post(self, endpoint, data=None):
         """Make POST request to ERPNext"""
         url = f"{self.base_url}{endpoint}"
-        print(f"POST {url}")
-        print(f"Payload: {data}")
+        logger.debug("ERPNext POST payload", extra={"url": url, "payload": data})
         try:
-            response = requests.post(url, headers=self.headers, json=data, timeout=30)
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error: {e}")
-            print(f"Response: {e.response.text if hasattr(e, 'response') else 'No response'}")
+            return await self._request("POST", url, json=data)
+        except httpx.HTTPError as e:
+            response = getattr(e, "response", None)
+            logger.error("ERPNext POST failed", extra={
+                "url": url, "error": str(e), "response": response.text if response is not None else None
+            })
             error_detail = str(e)
-            if hasattr(e, 'response') and e.response:
+            if response is not None:
                 try:
-                    error_json = e.response.json()
+                    error_json = response.json()
                     error_detail = error_json.get('message') or error_json.get('exc') or str(e)
-                except:
-                    error_detail = e.response.text
+                except ValueError:
+                    error_detail = response.text
             raise HTTPException(status_code=500, detail=f"ERPNext Error: {error_detail}")
+    
+    async def close(self):
+        """Close pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
 # Initialize ERPNext client
 erpnext = ERPNextClient()
@@ -126,6 +498,18 @@ class StockEntryCreate(BaseModel):
     idempotency_key: Optional[str] = None
     user_name: Optional[str] = None  # Name of user performing the transaction
 
+class StockEntryBulk(BaseModel):
+    entries: List[StockEntryCreate]
+    group: bool = True  # merge compatible entries into fewer ERPNext documents
+
+class BalancePair(BaseModel):
+    item_code: str
+    warehouse: str
+
+class StockBalanceBatch(BaseModel):
+    pairs: List[BalancePair] = []
+    warehouse: Optional[str] = None  # also return every item in this warehouse
+
 # API Routes
 
 @app.get("/")
@@ -138,26 +522,62 @@ async def root():
         "erpnext_url": ERPNEXT_URL,
         "caching": "enabled ⚡",
         "cache_ttl": {
-            "locations": "10 minutes",
+            "locations": f"{LOCATIONS_TTL // 60} minutes (stale-while-revalidate)",
             "items": "5 minutes"
         }
     }
 
 @app.post("/api/cache/clear")
 async def clear_cache(key: Optional[str] = None):
-    """Clear cache - useful for testing or manual refresh"""
+    """Clear cache (on every worker when the cache is shared) - useful for testing or manual refresh"""
+    try:
+        await cache.clear(key)
+    except CacheUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     if key:
-        cache.clear(key)
         return {"message": f"Cache cleared for key: {key}"}
     else:
-        cache.clear()
         return {"message": "All cache cleared"}
 
+@app.get("/api/cache/stats")
+async def cache_stats():
+    """Cache hit/miss/eviction counters, current size and coalesced fetches"""
+    return {**cache.stats(), "singleflight": singleflight.stats(), "item_catalog": item_catalog.stats(),
+            "idempotency": idempotency.stats(), "logging": structured_logging.stats(),
+            "snapshots": snapshot_stats(), "response_bodies": bodies.stats(),
+            "versions": {"locations": location_versions.stats(), "items": item_versions.stats()},
+            "offline_bundle": {"locations": location_tables.stats(), "items": item_tables.stats()}}
+
+def snapshot_stats():
+    if not SHARED_SNAPSHOTS:
+        return None
+    return {"pid": os.getpid(), "leader": snapshot_leader.held,
+            "locations": location_snapshot.stats(), "items": item_snapshot.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+profiler = SamplingProfiler()
+
+@app.get("/api/debug/profile", include_in_schema=False)
+async def sample_profile(seconds: float = 10, interval_ms: float = 5):
+    """Sample all thread stacks for `seconds`; returns collapsed stacks for flamegraph.pl/speedscope"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    seconds = min(max(seconds, 0.1), PROFILE_MAX_SECONDS)
+    try:
+        stacks = await asyncio.to_thread(profiler.collect, seconds, max(interval_ms, 1) / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(stacks, headers={"Content-Disposition": 'attachment; filename="wms-profile.folded"'})
+
 @app.get("/api/test-connection")
 async def test_connection():
     """Test ERPNext connection"""
     try:
-        result = erpnext.get("/api/resource/Warehouse", params={"limit_page_length": 1})
+        result = await erpnext.get("/api/resource/Warehouse", params={"limit_page_length": 1})
         return {
             "connected": True,
             "message": "Successfully connected to ERPNext",
@@ -169,52 +589,135 @@ async def test_connection():
 @app.get("/api/warehouses")
 async def get_warehouses():
     """Get all warehouses"""
-    result = erpnext.get("/api/resource/Warehouse", params={
-        "fields": '["name","warehouse_name","parent_warehouse","is_group"]',
-        "limit_page_length": 500
-    })
-    return result.get("data", [])
+    return await PagedFetcher(
+        erpnext.get, "Warehouse",
+        ["name", "warehouse_name", "parent_warehouse", "is_group"],
+        page_size=ERPNEXT_PAGE_SIZE, workers=ERPNEXT_FETCH_WORKERS
+    ).fetch_all()
 
-@app.get("/api/locations")
-async def get_locations():
-    """Get all warehouses (both parent sections and sub-locations) - CACHED"""
-    # Check cache first (10 minute TTL)
-    cache_key = "locations_all"
-    cached_data = cache.get(cache_key)
+location_index = None
+
+async def get_location_index(locations):
+    """Search index for the current locations list, rebuilt (in a worker thread) only when the list changes"""
+    global location_index
+    if location_index is None or location_index.source is not locations:
+        location_index = await builds.do(f"location_index_{id(locations)}",
+                                         lambda: asyncio.to_thread(LocationIndex, locations))
+    return location_index
+
+async def fetch_locations():
+    """Fetch all warehouses from ERPNext (paged, concurrent) and cache them"""
+    data = await PagedFetcher(
+        erpnext.get, "Warehouse",
+        ["name", "warehouse_name", "parent_warehouse", "is_group", "custom_warehouse_barcode", "company"],
+        page_size=ERPNEXT_PAGE_SIZE, workers=ERPNEXT_FETCH_WORKERS
+    ).fetch_all()
     
-    if cached_data is not None:
-        print(f"✅ Cache HIT: {cache_key}")
-        return cached_data
+    # Cache for 10 minutes, then serve stale while a background refresh runs
+    await cache.set("locations_all", data, ttl_seconds=LOCATIONS_TTL, stale_ttl=LOCATIONS_STALE_TTL)
+    await get_location_index(data)
+    logger.info("Cached locations", extra={"count": len(data)})
+    if snapshot_leader is not None and snapshot_leader.held:
+        await asyncio.to_thread(write_location_snapshot, location_snapshot.path, data, snapshot_meta,
+                                snapshot_gzip_level)
     
-    print(f"🔄 Cache MISS: {cache_key} - Fetching from ERPNext...")
-    result = erpnext.get("/api/resource/Warehouse", params={
-        "fields": '["name","warehouse_name","parent_warehouse","is_group","custom_warehouse_barcode","company"]',
-        "limit_page_length": 500
-    })
+    return data
+
+def encoded_rows(rows):
+    """rows_json for list_response over an in-memory list"""
+    return lambda positions: dumps(rows if positions is None else [rows[pos] for pos in positions])
+
+async def encoded_body(key, source, build=None):
+    """bodies.get, with the encode and gzip of a new source (or content version) done in a worker thread"""
+    body = bodies.lookup(key, source)
+    if body is None:
+        token = source if isinstance(source, str) else id(source)
+        body = await builds.do(f"{key}_{token}", lambda: asyncio.to_thread(
+            lambda: bodies.encode(build() if build is not None else source)))
+        bodies.put(key, source, body)
+    return body
+
+async def observe(versions, source, keys_and_digests):
+    """RowsVersion of source; for a new source it is computed in a worker thread"""
+    if source is versions.source:
+        return versions.current
+    ticket = versions.begin()  # a slower build of an older source must not win
+    current = await builds.do(f"rows_version_{id(source)}",
+                              lambda: asyncio.to_thread(RowsVersion.of, keys_and_digests))
+    return versions.adopt(source, current, ticket)
+
+async def list_response(request, name, versions, current, since, full_body, rows_json):
+    """
+    Whole list, or with `since` only the rows added/changed/removed after that version.
+    The ETag carries the version; If-None-Match naming the current one gets a 304.
+    current: RowsVersion of the list; full_body: EncodedBody of the list, or None to encode
+    rows_json(None) once per version; rows_json(positions): encoded rows (all if None).
+    Bodies are keyed on the content version, so they never keep a replaced list alive.
+    """
+    headers = {"ETag": etag(current.version), "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), current.version):
+        return Response(status_code=304, headers=headers)
+    accept_encoding = request.headers.get("accept-encoding")
+    if since is None:
+        if full_body is None:
+            full_body = await encoded_body(f"{name}_all", current.version, lambda: rows_json(None))
+        return full_body.response(accept_encoding, headers)
     
-    data = result.get("data", [])
+    old = versions.history.get(since)
+    if old is None:
+        # Too old or never seen: the client reloads everything (one shared body for all such requests)
+        body = await encoded_body(f"{name}_since_*", current.version,
+                                  lambda: delta_json(current.version, True, rows_json(None), []))
+        return body.response(accept_encoding, headers)
     
-    # Cache for 10 minutes (600 seconds)
-    cache.set(cache_key, data, ttl_seconds=600)
-    print(f"💾 Cached {len(data)} locations")
+    def build():
+        upserted, removed = diff(old, current)
+        return delta_json(current.version, False, rows_json(upserted), removed)
     
-    return data
+    body = await encoded_body(f"{name}_since_{since}", current.version, build)
+    return body.response(accept_encoding, headers)
 
-@app.get("/api/items/search")
-async def search_items(q: str):
-    """Search items by custom_barcode, item_code, or item_name - CACHED"""
-    # Check cache first (5 minute TTL for item searches)
-    cache_key = f"item_search_{q}"
-    cached_data = cache.get(cache_key)
+@app.get("/api/locations")
+async def get_locations(request: Request, since: Optional[str] = None):
+    """Get all warehouses (both parent sections and sub-locations) - CACHED, ETag / since=<version> deltas"""
+    source, current, _ = await current_location_rows()
+    if isinstance(source, Snapshot):
+        # Served straight from the mapped snapshot: no decoding, no per-worker copy
+        return await list_response(request, "locations", location_versions, current, since,
+                                   source.rows_body, source.json_array)
+    # Encoded (and versioned) once per cached list; hits send the stored bytes
+    return await list_response(request, "locations", location_versions, current, since,
+                               None, encoded_rows(source))
+
+async def load_locations():
+    """Locations list from the cache; misses and refreshes go to ERPNext"""
+    # Check cache first (10 minute TTL, stale-while-revalidate after that)
+    cache_key = "locations_all"
+    with span("cache"):
+        entry = await cache.get_stale(cache_key)
     
-    if cached_data is not None:
-        print(f"✅ Cache HIT: {cache_key}")
+    if entry is not None:
+        cached_data, expires_in = entry
+        if expires_in <= 0:
+            logger.info("Cache stale, refreshing in background", extra={"key": cache_key})
+            refresh_in_background(cache_key, fetch_locations)
+        elif expires_in <= LOCATIONS_REFRESH_AHEAD:
+            logger.info("Cache hit, refreshing ahead of expiry", extra={"key": cache_key})
+            refresh_in_background(cache_key, fetch_locations)
+        else:
+            logger.debug("Cache hit", extra={"key": cache_key})
         return cached_data
     
-    print(f"🔄 Cache MISS: {cache_key} - Searching ERPNext...")
+    # Concurrent misses share one ERPNext fetch
+    logger.info("Cache miss, fetching from ERPNext", extra={"key": cache_key})
+    return await singleflight.do(cache_key, fetch_locations)
+
+async def fetch_item_search(q):
+    """Search ERPNext items by barcode, then item_code, then item_name, and cache the result"""
+    cache_key = f"item_search_{q}"
     
     # First, try exact match on custom_barcode (this is your GSS-RM-XXXXXX format)
-    result = erpnext.get("/api/resource/Item", params={
+    result = await erpnext.get("/api/resource/Item", params={
         "fields": '["name","item_code","item_name","stock_uom","custom_barcode","custom_stock_location"]',
         "filters": f'[["custom_barcode","=","{q}"]]',
         "limit_page_length": 1
@@ -223,12 +726,12 @@ async def search_items(q: str):
     # If barcode found, cache and return it
     if result.get("data") and len(result["data"]) > 0:
         data = result.get("data", [])
-        cache.set(cache_key, data, ttl_seconds=300)  # 5 minutes
-        print(f"💾 Cached item search result")
+        await cache.set(cache_key, data, ttl_seconds=300)  # 5 minutes
+        logger.debug("Cached item search result", extra={"q": q, "count": len(data)})
         return data
     
     # If no barcode match, search by item_code (partial match)
-    result = erpnext.get("/api/resource/Item", params={
+    result = await erpnext.get("/api/resource/Item", params={
         "fields": '["name","item_code","item_name","stock_uom","custom_barcode","custom_stock_location"]',
         "filters": f'[["item_code","like","%{q}%"]]',
         "limit_page_length": 20
@@ -236,7 +739,7 @@ async def search_items(q: str):
     
     # If no item_code match, try item_name
     if not result.get("data") or len(result["data"]) == 0:
-        result = erpnext.get("/api/resource/Item", params={
+        result = await erpnext.get("/api/resource/Item", params={
             "fields": '["name","item_code","item_name","stock_uom","custom_barcode","custom_stock_location"]',
             "filters": f'[["item_name","like","%{q}%"]]',
             "limit_page_length": 20
@@ -245,95 +748,638 @@ async def search_items(q: str):
     data = result.get("data", [])
     
     # Cache for 5 minutes
-    cache.set(cache_key, data, ttl_seconds=300)
-    print(f"💾 Cached {len(data)} item(s)")
+    await cache.set(cache_key, data, ttl_seconds=300)
+    logger.debug("Cached item search result", extra={"q": q, "count": len(data)})
     
     return data
 
+@app.get("/api/items/search")
+async def search_items(q: str, request: Request):
+    """Search items by custom_barcode, item_code, or item_name - CACHED"""
+    accept_encoding = request.headers.get("accept-encoding")
+    # Serve from the local catalog mirror once it has loaded (no ERPNext calls);
+    # a repeated scan reuses its encoded result until the catalog changes
+    if item_catalog.ready:
+        with span("search"):
+            return bodies.response(f"item_catalog_{q}", item_catalog.index, accept_encoding,
+                                   build=lambda: item_catalog.search(q))
+    
+    # Other workers search the catalog snapshot the leader published
+    shared = item_snapshot.current() if item_snapshot is not None else None
+    if shared is not None:
+        with span("search"):
+            return Response(shared.search_json(q), media_type="application/json")
+    
+    # Check cache first (5 minute TTL for item searches)
+    cache_key = f"item_search_{q}"
+    with span("cache"):
+        cached_data = await cache.get(cache_key)
+    
+    if cached_data is not None:
+        logger.debug("Cache hit", extra={"key": cache_key})
+        # At most 20 rows, encoded per hit: a plain list can't be held weakly by the body cache
+        return bodies.encode(cached_data).response(accept_encoding)
+    
+    # Scanners hitting the same barcode at once share one ERPNext search
+    if sampled():
+        logger.info("Cache miss, searching ERPNext", extra={"key": cache_key})
+    return await singleflight.do(cache_key, lambda: fetch_item_search(q))
+
+def list_rows(rows):
+    """rows(positions) reader over an in-memory list (all rows if None)"""
+    return lambda positions: rows if positions is None else [rows[pos] for pos in positions]
+
+async def current_location_rows():
+    """(source, RowsVersion, rows(positions) reader) of the current locations: a cached list or a Snapshot"""
+    shared = location_snapshot.current() if location_snapshot is not None else None
+    if shared is not None:
+        snapshot = shared.snapshot
+        return snapshot, await observe(location_versions, snapshot, snapshot.keys_and_digests), snapshot.rows
+    locations = await load_locations()
+    current = await observe(location_versions, locations, lambda: keyed_digests(locations, "name"))
+    return locations, current, list_rows(locations)
+
+async def current_item_rows():
+    """(source, RowsVersion, rows(positions) reader) of the current item catalog: an ItemIndex or a Snapshot"""
+    if item_catalog.ready:
+        index = item_catalog.index
+        current = await observe(item_versions, index, lambda: keyed_digests(index.items, "item_code"))
+        return index, current, list_rows(index.items)
+    shared = item_snapshot.current() if item_snapshot is not None else None
+    if shared is not None:
+        snapshot = shared.snapshot
+        return snapshot, await observe(item_versions, snapshot, snapshot.keys_and_digests), snapshot.rows
+    if not ITEM_CATALOG_ENABLED:
+        raise HTTPException(status_code=404, detail="Item catalog is disabled (ITEM_CATALOG_ENABLED)")
+    raise HTTPException(status_code=503, detail="Item catalog is still loading")
+
+@app.get("/api/items")
+async def list_items(request: Request, since: Optional[str] = None):
+    """Whole item catalog for sync/offline clients - ETag / since=<version> deltas like /api/locations"""
+    source, current, _ = await current_item_rows()
+    if isinstance(source, Snapshot):
+        return await list_response(request, "items", item_versions, current, since,
+                                   source.rows_body, source.json_array)
+    # The catalog's ItemIndex: encoded once per catalog publish
+    return await list_response(request, "items", item_versions, current, since,
+                               None, encoded_rows(source.items))
+
+@app.get("/api/offline/bundle")
+async def offline_bundle(request: Request, since: Optional[str] = None):
+    """
+    Locations and items for offline scanners in one compact download: columnar tables
+    with deduplicated strings, versioned (ETag); since=<version> sends only the changes
+    """
+    await current_item_rows()  # 404/503 before touching ERPNext for locations
+    _, location_current, location_rows = await current_location_rows()
+    _, item_current, item_rows = await current_item_rows()  # again: the catalog may have been republished meanwhile
+    version = bundle_version(location_current.version, item_current.version)
+    headers = {"ETag": etag(version), "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), version):
+        return Response(status_code=304, headers=headers)
+    
+    # Each table is a delta from the client's version when still known, else sent whole
+    tables = []
+    for name, versions, current, builder, rows, table_since in zip(
+        ("locations", "items"), (location_versions, item_versions), (location_current, item_current),
+        (location_tables, item_tables), (location_rows, item_rows), split_version(since)
+    ):
+        old = versions.history.get(table_since)
+        tables.append((name, current, builder, rows, old, table_since if old is not None else None))
+    key = f"offline_bundle_{version}_{'.'.join(t[5] or '*' for t in tables)}"  # names its content: source=None
+    body = bodies.lookup(key, None)
+    if body is None:
+        # Inputs are captured here; the thread diffs, decodes changed rows, encodes and gzips
+        def build():
+            sections = []
+            for name, current, builder, rows, old, _ in tables:
+                if old is not None:
+                    upserted, removed = diff(old, current)
+                    sections.append(delta_section(name, current.version, rows(upserted), removed))
+                else:
+                    sections.append(builder.build(current.version, current.entries(), rows))
+            return bodies.encode(bundle_json(version, *sections))
+        
+        with span("bundle"):
+            body = await builds.do(key, lambda: asyncio.to_thread(build))
+        bodies.put(key, None, body)
+    return body.response(request.headers.get("accept-encoding"), headers)
+
 @app.get("/api/items/{item_code}")
 async def get_item(item_code: str):
     """Get item details"""
-    result = erpnext.get(f"/api/resource/Item/{item_code}")
+    result = await erpnext.get(f"/api/resource/Item/{item_code}")
     return result.get("data", {})
 
+balance_invalidated_at = {}  # cache key -> monotonic time of the last write touching it
+
+def balance_cache_key(item_code, warehouse):
+    return f"balance_{item_code}|{warehouse}"
+
+def mark_balance_invalidated(key):
+    """Reads of this pair already in flight must not cache what they get back"""
+    balance_invalidated_at[key] = time.monotonic()
+
+def on_remote_clear(key):
+    """A balance key cleared by another worker's write: our reads of it in flight are stale too"""
+    if key and key.startswith("balance_"):
+        mark_balance_invalidated(key)
+
+cache.listeners.append(on_remote_clear)
+
+async def clear_balance(key):
+    mark_balance_invalidated(key)
+    try:
+        await cache.clear(key)
+    except CacheUnavailable as e:
+        # The write succeeded; other workers fall back on BALANCE_CACHE_TTL
+        logger.warning("Balance invalidation not shared", extra={"key": key, "error": str(e)})
+
+async def invalidate_balances(pairs):
+    """Drop cached balances for (item_code, warehouse) pairs our own write just moved"""
+    if BALANCE_CACHE_TTL <= 0:
+        return
+    now = time.monotonic()
+    await asyncio.gather(*(clear_balance(balance_cache_key(item_code, warehouse)) for item_code, warehouse in pairs))
+    # Only reads still in flight care about old invalidations
+    if len(balance_invalidated_at) > 10000:
+        cutoff = now - ERPNEXT_TIMEOUT
+        for key in [k for k, t in balance_invalidated_at.items() if t < cutoff]:
+            del balance_invalidated_at[key]
+
 @app.get("/api/stock-balance")
 async def get_stock_balance(item_code: str, warehouse: str):
-    """Get stock balance at location"""
-    result = erpnext.get("/api/resource/Bin", params={
+    """Get stock balance at location (short-TTL cache when BALANCE_CACHE_TTL > 0)"""
+    cache_key = balance_cache_key(item_code, warehouse)
+    if BALANCE_CACHE_TTL > 0:
+        cached_data = await cache.get(cache_key)
+        if cached_data is not None:
+            return cached_data
+    
+    started = time.monotonic()
+    result = await erpnext.get("/api/resource/Bin", params={
         "fields": '["actual_qty","reserved_qty"]',
         "filters": f'[["item_code","=","{item_code}"],["warehouse","=","{warehouse}"]]'
     })
     bins = result.get("data", [])
     if bins:
-        return {
-            "actual_qty": bins[0].get("actual_qty", 0),
-            "reserved_qty": bins[0].get("reserved_qty", 0),
-            "available_qty": bins[0].get("actual_qty", 0) - bins[0].get("reserved_qty", 0)
-        }
-    return {"actual_qty": 0, "reserved_qty": 0, "available_qty": 0}
+        data = balance_from_bin(bins[0])
+    else:
+        data = {"actual_qty": 0, "reserved_qty": 0, "available_qty": 0}
+    data["as_of"] = datetime.utcnow().isoformat() + "Z"
+    
+    # Don't cache a read that raced with one of our own writes to this pair
+    if BALANCE_CACHE_TTL > 0 and balance_invalidated_at.get(cache_key, float("-inf")) < started:
+        await cache.set(cache_key, data, ttl_seconds=BALANCE_CACHE_TTL)
+    return data
 
-@app.post("/api/stock-entry")
-async def create_stock_entry(entry: StockEntryCreate):
-    """Create stock entry (Receipt/Issue/Transfer)"""
-    from datetime import datetime
-    import uuid
-    import time
+def balance_from_bin(bin):
+    return {
+        "actual_qty": bin.get("actual_qty", 0),
+        "reserved_qty": bin.get("reserved_qty", 0),
+        "available_qty": bin.get("actual_qty", 0) - bin.get("reserved_qty", 0)
+    }
+
+def chunked(values, size):
+    values = sorted(values)
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+async def fetch_bins(filters):
+    return await PagedFetcher(
+        erpnext.get, "Bin", ["item_code", "warehouse", "actual_qty", "reserved_qty"], filters=filters,
+        page_size=ERPNEXT_PAGE_SIZE, workers=ERPNEXT_FETCH_WORKERS
+    ).fetch_all()
+
+@app.post("/api/stock-balance/batch")
+async def get_stock_balance_batch(request: StockBalanceBatch):
+    """
+    Stock balances for many item/warehouse pairs and/or every item in one warehouse.
+    Pairs are resolved with grouped Bin queries (item_code IN x warehouse IN chunks) run concurrently.
+    Returns {"balances": {warehouse: {item_code: balance}}}; unknown pairs come back as zero.
+    """
+    if len(request.pairs) > BALANCE_BATCH_MAX_PAIRS:
+        raise HTTPException(status_code=400, detail=f"At most {BALANCE_BATCH_MAX_PAIRS} pairs per request")
     
-    # Build the payload according to ERPNext's expected format
-    unique_ref = uuid.uuid4().hex[:12]
-    timestamp_ms = int(time.time() * 1000)
+    wanted = {(p.item_code, p.warehouse) for p in request.pairs}
+    queries = []
+    if wanted:
+        item_chunks = chunked({item for item, _ in wanted}, BALANCE_BATCH_CHUNK)
+        warehouse_chunks = chunked({wh for _, wh in wanted}, BALANCE_BATCH_CHUNK)
+        for items in item_chunks:
+            for warehouses in warehouse_chunks:
+                queries.append([["item_code", "in", items], ["warehouse", "in", warehouses]])
+    if request.warehouse:
+        queries.append([["warehouse", "=", request.warehouse]])
+    
+    results = await asyncio.gather(*(fetch_bins(filters) for filters in queries))
+    as_of = datetime.utcnow().isoformat() + "Z"
+    
+    balances = {}
+    for item_code, warehouse in wanted:
+        balances.setdefault(warehouse, {})[item_code] = {"actual_qty": 0, "reserved_qty": 0, "available_qty": 0}
+    for filters, bins in zip(queries, results):
+        whole_warehouse = filters[0][0] == "warehouse"
+        for bin in bins:
+            key = (bin["item_code"], bin["warehouse"])
+            # The IN x IN queries over-fetch the cross product; keep only requested pairs
+            if whole_warehouse or key in wanted:
+                balances.setdefault(bin["warehouse"], {})[bin["item_code"]] = balance_from_bin(bin)
+    
+    if sampled():
+        logger.info("Batch balance", extra={"pairs": len(wanted), "warehouse": request.warehouse, "queries": len(queries)})
+    return {"balances": balances, "as_of": as_of}
+
+def touched_pairs(items):
+    """(item_code, warehouse) pairs moved by Stock Entry item rows"""
+    pairs = set()
+    for item in items:
+        for warehouse in (item.get("s_warehouse"), item.get("t_warehouse")):
+            if warehouse:
+                pairs.add((item["item_code"], warehouse))
+    return pairs
+
+def build_stock_entry_payload(purpose, items, user_name=None, refs=None):
+    """Stock Entry draft payload for ERPNext from resolved item rows; refs: key_ref() of its idempotency keys"""
+    unique_ref = " ".join(refs) if refs else uuid.uuid4().hex[:12]
     
     # Use a COMPLETELY CUSTOM naming series for WMS to avoid conflicts
-    payload = {
+    return {
         "doctype": "Stock Entry",
         "naming_series": "WMS-STE-.YYYY.-.#####",  # CUSTOM WMS series
-        "stock_entry_type": entry.purpose,
-        "purpose": entry.purpose,
+        "stock_entry_type": purpose,
+        "purpose": purpose,
         "company": "Global Spectrum SARL",
         "posting_date": datetime.now().strftime("%Y-%m-%d"),
         "posting_time": datetime.now().strftime("%H:%M:%S"),
         "docstatus": 0,  # Create as DRAFT
         "items": [
             {
-                "item_code": item.item_code,
-                "qty": item.qty,
-                "s_warehouse": item.s_warehouse or entry.from_warehouse,
-                "t_warehouse": item.t_warehouse or entry.to_warehouse,
-                "basic_rate": item.basic_rate or 0,
+                "item_code": item["item_code"],
+                "qty": item["qty"],
+                "s_warehouse": item["s_warehouse"],
+                "t_warehouse": item["t_warehouse"],
+                "basic_rate": item["basic_rate"] or 0,
                 "uom": "PCs",
                 "stock_uom": "PCs",
                 "conversion_factor": 1.0,
-                "transfer_qty": item.qty,
+                "transfer_qty": item["qty"],
                 "allow_zero_valuation_rate": 1,
             }
-            for item in entry.items
+            for item in items
         ],
-        "remarks": f"WMS Transaction by {entry.user_name or 'Unknown'} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Ref: {unique_ref}"
+        "remarks": f"WMS Transaction by {user_name or 'Unknown'} - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - Ref: {unique_ref}"
     }
+
+def entry_items(entry):
+    """Item rows of a StockEntryCreate with entry-level warehouses filled in"""
+    return [
+        {
+            "item_code": item.item_code,
+            "qty": item.qty,
+            "s_warehouse": item.s_warehouse or entry.from_warehouse,
+            "t_warehouse": item.t_warehouse or entry.to_warehouse,
+            "basic_rate": item.basic_rate
+        }
+        for item in entry.items
+    ]
+
+async def post_stock_entry(payload):
+    """Create the draft in ERPNext and update local balance state"""
+    # Step 1: Create as DRAFT (this should auto-generate a fresh name)
+    result = await erpnext.post("/api/resource/Stock%20Entry", data=payload)
     
+    # Cached balances for every item/warehouse this entry touches are now stale
+    await invalidate_balances(touched_pairs(payload["items"]))
+    data = result.get("data", {})
+    if stock_projection.ready:
+        stock_projection.apply(payload["items"], data.get("name"))
+    return data
+
+def key_ref(key):
+    """Remarks reference of an idempotency key, to find its draft after an unsure attempt"""
+    return "K" + request_digest(key)[:16]
+
+async def find_draft(key):
+    """
+    Stock Entry an earlier attempt with this idempotency key created, or None.
+    The whole document, as the create would have returned it: it is stored for replays
+    """
+    result = await erpnext.get("/api/resource/Stock Entry", params={
+        "fields": '["name"]',
+        "filters": f'[["remarks","like","%{key_ref(key)}%"],["docstatus","!=","2"]]',
+        "limit_page_length": 1
+    })
+    drafts = result.get("data", [])
+    if not drafts:
+        return None
+    result = await erpnext.get(f"/api/resource/Stock Entry/{drafts[0]['name']}")
+    return result.get("data", {})
+
+def entry_digest(entry):
+    """Fingerprint of what a StockEntryCreate asks for (the key itself excluded)"""
+    return request_digest(entry.model_dump(exclude={"idempotency_key"}))
+
+async def create_idempotent(key, digest, create):
+    """Run create() at most once per idempotency key; replays get the stored result"""
     try:
-        # Step 1: Create as DRAFT (this should auto-generate a fresh name)
-        print(f"Creating Stock Entry as DRAFT...")
-        result = erpnext.post("/api/resource/Stock%20Entry", data=payload)
-        doc_name = result.get("data", {}).get("name")
-        print(f"Created draft: {doc_name}")
+        stored = idempotency.get(key, digest)
+        claim = stored is None and idempotency.claim(key, digest)
+        if stored is None and not claim:
+            # Another worker holds the key, or finished it between our two lookups
+            stored = idempotency.get(key, digest)
+            if stored is None:
+                raise HTTPException(status_code=409, detail="A stock entry with this idempotency_key is already being created")
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if stored is not None:
+        logger.info("Replayed stock entry", extra={"idempotency_key": key})
+        return stored
+    
+    try:
+        data = await find_draft(key) if claim == "retry" else None
+        if data is not None:
+            logger.info("Found stock entry of an earlier attempt", extra={"idempotency_key": key, "stock_entry": data.get("name")})
+        else:
+            data = await create()
+    except Exception as e:
+        # Only a rejection proves no draft exists; after a timeout or 5xx it may
+        idempotency.release(key, unsure=not is_permanent_error(e))
+        raise
+    idempotency.complete(key, data)
+    return data
+
+@app.post("/api/stock-entry")
+async def create_stock_entry(entry: StockEntryCreate):
+    """Create stock entry (Receipt/Issue/Transfer); idempotency_key makes retries safe"""
+    if entry.idempotency_key:
+        digest = entry_digest(entry)
+        # Concurrent duplicates share one attempt; later replays are served from the store
+        return await singleflight.do(
+            f"stock_entry:{entry.idempotency_key}:{digest}",
+            lambda: create_idempotent(entry.idempotency_key, digest, lambda: create_draft(entry, entry.idempotency_key))
+        )
+    return await create_draft(entry)
+
+async def create_draft(entry, key=None):
+    refs = [key_ref(key)] if key else None
+    payload = build_stock_entry_payload(entry.purpose, entry_items(entry), entry.user_name, refs)
+    
+    try:
+        data = await post_stock_entry(payload)
         
         # Return the draft - user will submit manually in ERPNext for now
         # TODO: Fix auto-submit in future version
-        print(f"✅ Draft Stock Entry {doc_name} created successfully")
-        print(f"📋 User needs to submit manually in ERPNext")
+        logger.info("Draft stock entry created; submit manually in ERPNext", extra={
+            "stock_entry": data.get("name"), "purpose": entry.purpose, "lines": len(payload["items"])
+        })
         
-        return result.get("data", {})
+        return data
     except Exception as e:
-        print(f"❌ Full error: {e}")
-        if hasattr(e, 'response') and e.response:
-            print(f"Response text: {e.response.text}")
+        logger.error("Stock entry failed", extra={"purpose": entry.purpose, "error": getattr(e, "detail", None) or str(e)})
         raise
 
+async def send_queued_entry(data, outbox_id):
+    """Outbox worker send: every queued entry is idempotent (its own key or the outbox id)"""
+    entry = StockEntryCreate(**data)
+    key = entry.idempotency_key or f"outbox-{outbox_id}"
+    return await create_idempotent(key, entry_digest(entry), lambda: create_draft(entry, key))
+
+def is_permanent_error(e):
+    """ERPNext rejected the document itself (e.g. validation); resending won't help"""
+    if isinstance(e, HTTPException) and e.status_code == 422:
+        return True
+    cause = e.__context__
+    if isinstance(cause, httpx.HTTPStatusError):
+        status = cause.response.status_code
+        # 401/403: credentials (e.g. a rotated API key), fixed outside the document
+        return 400 <= status < 500 and status not in (401, 403, 408, 409, 429)
+    return False
+
+def entry_partition(entry):
+    """Outbox ordering key: the source warehouse (target for receipts)"""
+    for item in entry.items:
+        warehouse = item.s_warehouse or entry.from_warehouse or item.t_warehouse or entry.to_warehouse
+        if warehouse:
+            return warehouse
+    return ""
+
+outbox = Outbox(
+    OUTBOX_DB, send_queued_entry, permanent=is_permanent_error, workers=OUTBOX_WORKERS,
+    max_attempts=OUTBOX_MAX_ATTEMPTS, backoff=OUTBOX_BACKOFF, lease=ERPNEXT_TIMEOUT * 4
+)
+
+@app.post("/api/stock-entry/queue", status_code=202)
+async def queue_stock_entry(entry: StockEntryCreate):
+    """Write-behind: persist the entry locally and return at once; workers post it to ERPNext"""
+    if not OUTBOX_ENABLED:
+        raise HTTPException(status_code=503, detail="Outbox disabled (set OUTBOX_ENABLED=true)")
+    try:
+        outbox_id, created = outbox.enqueue(entry.model_dump(), entry_partition(entry), entry.idempotency_key,
+                                            entry_digest(entry))
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {**outbox.get(outbox_id), "duplicate": not created}
+
+@app.get("/api/outbox")
+async def outbox_stats():
+    """Outbox queue depth and worker counters"""
+    return outbox.stats()
+
+@app.get("/api/outbox/{outbox_id}")
+async def outbox_entry(outbox_id: int):
+    """State of one queued stock entry (queued/sending/done/failed, ERPNext name once created)"""
+    entry = outbox.get(outbox_id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Outbox entry not found")
+    return entry
+
+@app.post("/api/outbox/{outbox_id}/retry")
+async def retry_outbox_entry(outbox_id: int):
+    """Requeue a failed entry"""
+    if not outbox.retry(outbox_id):
+        raise HTTPException(status_code=409, detail="Only failed entries can be retried")
+    return outbox.get(outbox_id)
+
+def group_entries(entries, indexes):
+    """
+    Group compatible entries (same purpose, entry warehouses and user) into documents
+    of at most STOCK_ENTRY_BULK_MAX_LINES lines. Returns [(purpose, user, entry indexes, item rows)].
+    """
+    groups = {}
+    for index in indexes:
+        entry = entries[index]
+        key = (entry.purpose, entry.from_warehouse, entry.to_warehouse, entry.user_name)
+        groups.setdefault(key, []).append(index)
+    
+    documents = []
+    for (purpose, _, _, user_name), indexes in groups.items():
+        current, lines = [], []
+        for index in indexes:
+            items = entry_items(entries[index])
+            if current and len(lines) + len(items) > STOCK_ENTRY_BULK_MAX_LINES:
+                documents.append((purpose, user_name, current, lines))
+                current, lines = [], []
+            current.append(index)
+            lines.extend(items)
+        documents.append((purpose, user_name, current, lines))
+    return documents
+
+@app.post("/api/stock-entry/bulk")
+async def create_stock_entries_bulk(request: StockEntryBulk):
+    """
+    Create many stock entries in one call.
+    Compatible entries are merged into one draft (unless group=false) and documents are
+    posted concurrently. If ERPNext rejects a merged document (a 4xx validation error),
+    its entries are retried one by one so a bad line only fails its own entry; on a
+    timeout or 5xx the group's entries fail together and can be retried. Entries whose
+    idempotency_key already completed are not posted again. Returns one result per entry,
+    in input order.
+    """
+    if len(request.entries) > STOCK_ENTRY_BULK_MAX_ENTRIES:
+        raise HTTPException(status_code=400, detail=f"At most {STOCK_ENTRY_BULK_MAX_ENTRIES} entries per request")
+    
+    results = [None] * len(request.entries)
+    pending = []  # entry indexes to post
+    claimed = {}  # entry index -> idempotency key this request holds
+    recheck = []  # claimed entry indexes an earlier attempt may have created already
+    first_for_key = {}  # idempotency key -> (first entry index, digest) in this request
+    duplicates = []  # (entry index, first entry index) repeated within this request
+    for index, entry in enumerate(request.entries):
+        key = entry.idempotency_key
+        if not key:
+            pending.append(index)
+            continue
+        digest = entry_digest(entry)
+        if key in first_for_key:
+            first, first_digest = first_for_key[key]
+            if first_digest == digest:
+                duplicates.append((index, first))
+            else:
+                results[index] = {"index": index, "status": "failed",
+                                  "error": f"idempotency_key {key} was used for a different stock entry"}
+            continue
+        first_for_key[key] = (index, digest)
+        try:
+            stored = idempotency.get(key, digest)
+            claim = stored is None and idempotency.claim(key, digest)
+        except IdempotencyConflict as e:
+            results[index] = {"index": index, "status": "failed", "error": str(e)}
+            continue
+        if stored is not None:
+            results[index] = {"index": index, "status": "replayed", "name": stored.get("name")}
+        elif claim:
+            claimed[index] = key
+            (recheck if claim == "retry" else pending).append(index)
+        else:
+            results[index] = {"index": index, "status": "failed",
+                              "error": "A stock entry with this idempotency_key is already being created"}
+    
+    slots = asyncio.Semaphore(STOCK_ENTRY_BULK_CONCURRENCY)
+    
+    async def find_earlier(index):
+        async with slots:
+            try:
+                data = await find_draft(claimed[index])
+            except Exception as e:
+                results[index] = {"index": index, "status": "failed",
+                                  "error": e.detail if isinstance(e, HTTPException) else str(e)}
+                idempotency.release(claimed[index], unsure=True)
+                return
+        if data is None:
+            pending.append(index)
+        else:
+            results[index] = {"index": index, "status": "replayed", "name": data.get("name")}
+            idempotency.complete(claimed[index], data)
+    
+    if recheck:
+        await asyncio.gather(*(find_earlier(index) for index in recheck))
+        pending.sort()
+    
+    if request.group:
+        documents = group_entries(request.entries, pending)
+    else:
+        documents = [(request.entries[i].purpose, request.entries[i].user_name, [i], entry_items(request.entries[i]))
+                     for i in pending]
+    
+    async def submit(purpose, user_name, indexes, lines):
+        async with slots:
+            try:
+                refs = [key_ref(claimed[index]) for index in indexes if index in claimed]
+                data = await post_stock_entry(build_stock_entry_payload(purpose, lines, user_name, refs))
+            except Exception as e:
+                error = e.detail if isinstance(e, HTTPException) else str(e)
+                rejected = is_permanent_error(e)
+            else:
+                for index in indexes:
+                    results[index] = {"index": index, "status": "created", "name": data.get("name"),
+                                      "grouped_with": len(indexes) - 1}
+                    if index in claimed:
+                        idempotency.complete(claimed[index], data)
+                return
+        if len(indexes) == 1 or not rejected:
+            # Timeouts and 5xx say nothing about the lines: fail the whole group so the
+            # client retries it later, instead of sending every entry into a struggling ERPNext
+            for index in indexes:
+                results[index] = {"index": index, "status": "failed", "error": error}
+                if index in claimed:
+                    idempotency.release(claimed[index], unsure=not rejected)
+            return
+        # ERPNext rejected the document: post the merged entries individually to isolate the bad one
+        await asyncio.gather(*(
+            submit(purpose, user_name, [index], entry_items(request.entries[index])) for index in indexes
+        ))
+    
+    await asyncio.gather(*(submit(*document) for document in documents))
+    for index, first in duplicates:
+        result = results[first]
+        status = "failed" if result["status"] == "failed" else "replayed"
+        results[index] = {**result, "index": index, "status": status}
+    
+    created = sum(1 for r in results if r["status"] == "created")
+    replayed = sum(1 for r in results if r["status"] == "replayed")
+    logger.info("Bulk stock entry", extra={
+        "entries": len(results), "documents": len(documents), "created_entries": created, "replayed": replayed
+    })
+    return {"results": results, "created": created, "replayed": replayed, "failed": len(results) - created - replayed}
+
+def require_projection():
+    if not stock_projection.ready:
+        raise HTTPException(status_code=503, detail="Stock projection not loaded (set STOCK_PROJECTION_ENABLED=true)")
+
+@app.get("/api/projection/stock-balance")
+async def get_projected_balance(item_code: str, warehouse: str):
+    """Projected stock balance at location from the local ledger (no ERPNext call)"""
+    require_projection()
+    return {**stock_projection.balance(item_code, warehouse), "seeded_at": stock_projection.seeded_at}
+
+@app.get("/api/projection/items/{item_code}")
+async def get_projected_item(item_code: str):
+    """Projected balances of an item across every warehouse"""
+    require_projection()
+    balances = stock_projection.item_balances(item_code)
+    return {
+        "item_code": item_code,
+        "balances": balances,
+        "total_available": sum(b["available_qty"] for b in balances.values()),
+        "seeded_at": stock_projection.seeded_at
+    }
+
+@app.get("/api/projection/warehouse")
+async def get_projected_warehouse(warehouse: str):
+    """Projected balances of every item in a warehouse"""
+    require_projection()
+    return {"warehouse": warehouse, "balances": stock_projection.warehouse_balances(warehouse),
+            "seeded_at": stock_projection.seeded_at}
+
+@app.get("/api/projection/drift")
+async def get_projection_drift():
+    """Projection state and the last reconcile's drift against ERPNext Bins"""
+    return stock_projection.stats()
+
 @app.get("/api/purchase-orders")
 async def get_purchase_orders():
     """Get open purchase orders"""
-    result = erpnext.get("/api/resource/Purchase Order", params={
+    result = await erpnext.get("/api/resource/Purchase Order", params={
         "fields": '["name","supplier","transaction_date","grand_total","status"]',
         "filters": '[["docstatus","=","1"],["status","!=","Completed"]]',
         "limit_page_length": 50
@@ -343,7 +1389,7 @@ async def get_purchase_orders():
 @app.get("/api/pick-lists")
 async def get_pick_lists():
     """Get pick lists"""
-    result = erpnext.get("/api/resource/Pick List", params={
+    result = await erpnext.get("/api/resource/Pick List", params={
         "fields": '["name","customer","date","status"]',
         "filters": '[["docstatus","=","1"],["status","!=","Completed"]]',
         "limit_page_length": 50
@@ -359,36 +1405,30 @@ if __name__ == "__main__":
 @app.get("/api/locations/search")
 async def search_locations(q: str):
     """Search locations by custom_warehouse_barcode or warehouse name - USES CACHE!"""
-    print(f"🔍 Searching locations for: {q}")
-    
     try:
+        shared = location_snapshot.current() if location_snapshot is not None else None
+        if shared is not None:
+            with span("search"):
+                positions = shared.positions(q, limit=20)
+            if sampled():
+                logger.info("Location search", extra={"q": q, "matches": len(positions)})
+            return Response(shared.snapshot.json_array(positions), media_type="application/json")
+        
         # Get ALL locations from cache (instant! no API calls!)
-        all_locations = await get_locations()
+        all_locations = await load_locations()
         
         if not all_locations:
             return []
         
-        matching_warehouses = []
-        
-        # Search through CACHED data (super fast!)
-        for location in all_locations:
-            barcode = location.get("custom_warehouse_barcode", "")
-            name = location.get("name", "")
-            warehouse_name = location.get("warehouse_name", "")
-            
-            # Check if barcode matches query (case-insensitive, exact match)
-            if barcode and barcode.lower() == q.lower():
-                print(f"   ✅ Found by barcode: {warehouse_name}")
-                matching_warehouses.append(location)
-                break  # Found exact barcode match, stop searching
-            
-            # Also check if warehouse name contains query (fallback)
-            elif q.lower() in name.lower() or q.lower() in warehouse_name.lower():
-                matching_warehouses.append(location)
+        # Indexed lookup: O(1) barcode hit, trigram-narrowed name search
+        with span("search"):
+            index = await get_location_index(all_locations)
+            matching_warehouses = index.search(q, limit=20)
         
-        print(f"   📍 Found {len(matching_warehouses)} matching location(s)")
-        return matching_warehouses[:20]  # Limit to 20 results
+        if sampled():
+            logger.info("Location search", extra={"q": q, "matches": len(matching_warehouses)})
+        return Response(dumps(matching_warehouses), media_type="application/json")
         
     except Exception as e:
-        print(f"❌ Error in search_locations: {e}")
+        logger.exception("Location search failed", extra={"q": q})
         raise HTTPException(status_code=500, detail=str(e))
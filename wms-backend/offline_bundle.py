@@ -0,0 +1,144 @@
+"""
+Compact offline bundle for scanner devices: locations and items as columnar
+tables; values repeated across rows (parent section, UOM, stock location) are
+deduplicated into a per-table string table
+Table sections are kept per version and only changed rows are re-encoded
+"""
+
+import threading
+
+from fast_json import dumps
+
+FORMAT = 1
+
+# Columns shipped to devices. "ref" values are indexes into the table's strings (null stays null);
+# unique-per-row values stay inline, where a string table would only add the indexes
+TABLES = {
+    "locations": {
+        "key": "name",
+        "barcode": "custom_warehouse_barcode",
+        "columns": [("name", "str"), ("warehouse_name", "str"), ("parent_warehouse", "ref"),
+                    ("custom_warehouse_barcode", "str"), ("is_group", "int")]
+    },
+    "items": {
+        "key": "item_code",
+        "barcode": "custom_barcode",
+        "columns": [("item_code", "str"), ("item_name", "str"), ("stock_uom", "ref"),
+                    ("custom_barcode", "str"), ("custom_stock_location", "ref")]
+    }
+}
+
+
+def bundle_version(location_version, item_version):
+    return f"{location_version}.{item_version}"
+
+
+def split_version(version):
+    """(location version, item version) of a bundle version; (None, None) if malformed"""
+    location_version, dot, item_version = (version or "").partition(".")
+    return (location_version, item_version) if dot else (None, None)
+
+
+class StringTable:
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def ref(self, value):
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.strings)
+            self.strings.append(value)
+        return i
+
+
+def encode_row(row, columns, strings):
+    encoded = []
+    for field, kind in columns:
+        value = row.get(field)
+        if value is None:
+            encoded.append(None)
+        elif kind == "ref":
+            encoded.append(strings.ref(value if isinstance(value, str) else str(value)))
+        else:
+            encoded.append(value)
+    return encoded
+
+
+def section_json(name, version, full, strings, rows, removed):
+    """One table; columns[i] holds field i of every row (compresses better than row arrays)"""
+    spec = TABLES[name]
+    head = {"version": version, "full": full, "key": spec["key"], "barcode": spec["barcode"],
+            "fields": [field for field, _ in spec["columns"]], "types": [kind for _, kind in spec["columns"]]}
+    columns = [list(column) for column in zip(*rows)] if rows else [[] for _ in spec["columns"]]
+    return (dumps(head)[:-1] + b',"count":' + dumps(len(rows)) + b',"strings":' + dumps(strings) +
+            b',"columns":' + dumps(columns) + b',"removed":' + dumps(removed) + b"}")
+
+
+def delta_section(name, version, rows, removed):
+    """Changed rows only, with a string table of just their strings"""
+    strings = StringTable()
+    columns = TABLES[name]["columns"]
+    encoded = [encode_row(row, columns, strings) for row in rows]
+    return section_json(name, version, False, strings.strings, encoded, removed)
+
+
+def bundle_json(version, locations_section, items_section):
+    return (b'{"format":' + dumps(FORMAT) + b',"version":' + dumps(version) +
+            b',"tables":{"locations":' + locations_section + b',"items":' + items_section + b"}}")
+
+
+class TableBuilder:
+    """
+    Full section of one table, rebuilt incrementally: rows whose digest is unchanged
+    keep their encoding and the string table only grows, until enough rows changed
+    that starting over keeps the table compact
+    """
+
+    def __init__(self, name, rebuild_ratio=0.25):
+        self.name = name
+        self.columns = TABLES[name]["columns"]
+        self.rebuild_ratio = rebuild_ratio  # share of rows changed since the last rebuild that triggers one
+        self.lock = threading.Lock()  # builds run in worker threads
+        self.strings = StringTable()
+        self.encoded = {}  # key -> (digest, encoded row)
+        self.changed_since_rebuild = 0
+        self.version = None
+        self.section = None
+        self.builds = 0
+        self.rows_encoded = 0
+
+    def build(self, version, entries, rows):
+        """
+        Section for version. entries: (key, position, digest) per row;
+        rows(positions) returns decoded rows and is only asked for changed ones
+        """
+        with self.lock:
+            if version == self.version:
+                return self.section
+            changed = [entry for entry in entries if self.encoded.get(entry[0], (None,))[0] != entry[2]]
+            if self.changed_since_rebuild + len(changed) > len(entries) * self.rebuild_ratio:
+                self.strings, self.encoded, self.changed_since_rebuild = StringTable(), {}, 0
+                changed = entries
+                every_row = rows(None)  # one bulk decode
+                decoded = [every_row[pos] for _, pos, _ in changed]
+            else:
+                self.changed_since_rebuild += len(changed)
+                decoded = rows([pos for _, pos, _ in changed])
+            if changed:
+                for (key, _, digest), row in zip(changed, decoded):
+                    self.encoded[key] = (digest, encode_row(row, self.columns, self.strings))
+                self.rows_encoded += len(changed)
+            if len(self.encoded) > len(entries):
+                current = {key for key, _, _ in entries}
+                for key in [key for key in self.encoded if key not in current]:
+                    del self.encoded[key]
+            self.section = section_json(self.name, version, True, self.strings.strings,
+                                        [self.encoded[key][1] for key, _, _ in entries], [])
+            self.version = version
+            self.builds += 1
+            return self.section
+
+    def stats(self):
+        return {"version": self.version, "bytes": len(self.section or b""), "strings": len(self.strings.strings),
+                "builds": self.builds, "rows_encoded": self.rows_encoded}
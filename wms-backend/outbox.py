@@ -0,0 +1,219 @@
+"""
+Write-behind outbox for stock entries
+Entries are persisted locally and acknowledged at once; workers drain them to ERPNext
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+from idempotency_store import IdempotencyConflict
+
+logger = logging.getLogger("wms.outbox")
+
+
+class Outbox:
+    """
+    Durable FIFO per partition (warehouse): an entry is only sent once every earlier
+    entry of its partition is done or has permanently failed. Different partitions
+    drain in parallel.
+
+    `send(entry, outbox_id)` is an async callable returning the ERPNext result;
+    `permanent(exc)` says whether an error is worth retrying. Retries back off
+    exponentially up to `max_backoff`; after `max_attempts` the entry is failed.
+    Claims carry a lease so entries held by a crashed worker are picked up again.
+    """
+
+    def __init__(self, path, send, permanent=None, workers=4, max_attempts=8, backoff=2.0,
+                 max_backoff=300.0, lease=120.0, poll_interval=1.0, retention=604800):
+        self.send = send
+        self.permanent = permanent or (lambda e: False)
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.retention = retention  # seconds done entries are kept for status lookups
+        self.last_purge = time.monotonic()
+        self.db = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # FULL: a 202 promises the entry survives a power loss, not just a process crash
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, idempotency_key TEXT UNIQUE,"
+            " partition TEXT NOT NULL, entry TEXT NOT NULL, status TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, lease_until REAL,"
+            " created REAL NOT NULL, updated REAL NOT NULL, result TEXT, error TEXT, digest TEXT)"
+        )
+        if "digest" not in {column[1] for column in self.db.execute("PRAGMA table_info(outbox)")}:
+            self.db.execute("ALTER TABLE outbox ADD COLUMN digest TEXT")  # outbox files from before digests
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_partition ON outbox (partition, status, id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, id)")
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+        self.stopping = False
+        self.sent = 0
+        self.retried = 0
+
+    def enqueue(self, entry, partition, idempotency_key=None, digest=None):
+        """
+        Persist an entry; returns (outbox id, created). A known idempotency key returns its row,
+        or raises IdempotencyConflict if it was queued with a different digest.
+        """
+        now = time.time()
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO outbox (idempotency_key, partition, entry, status, next_attempt, created, updated, digest)"
+                " VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (idempotency_key, partition, json.dumps(entry), now, now, now, digest)
+            )
+        if cursor.rowcount == 1:
+            self.wakeup.set()
+            return cursor.lastrowid, True
+        outbox_id, stored_digest = self.db.execute(
+            "SELECT id, digest FROM outbox WHERE idempotency_key = ?", (idempotency_key,)
+        ).fetchone()
+        if digest is not None and stored_digest is not None and stored_digest != digest:
+            raise IdempotencyConflict(f"idempotency_key {idempotency_key} was used for a different stock entry")
+        return outbox_id, False
+
+    def claim(self):
+        """Take the next sendable partition head, or None"""
+        now = time.time()
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            row = self.db.execute(
+                "SELECT id, entry, attempts FROM outbox o"
+                " WHERE ((status = 'queued' AND next_attempt <= ?) OR (status = 'sending' AND lease_until <= ?))"
+                " AND NOT EXISTS (SELECT 1 FROM outbox p WHERE p.partition = o.partition AND p.id < o.id"
+                "                 AND p.status IN ('queued', 'sending'))"
+                " ORDER BY id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self.db.execute(
+                "UPDATE outbox SET status = 'sending', lease_until = ?, attempts = attempts + 1, updated = ?"
+                " WHERE id = ?", (now + self.lease, now, row[0])
+            )
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def _finish(self, outbox_id, status, result=None, error=None, next_attempt=None):
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                "UPDATE outbox SET status = ?, result = ?, error = ?, next_attempt = COALESCE(?, next_attempt),"
+                " lease_until = NULL, updated = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, next_attempt, now, outbox_id)
+            )
+
+    async def process(self, outbox_id, entry, attempts):
+        try:
+            result = await self.send(entry, outbox_id)
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            if self.permanent(e) or attempts >= self.max_attempts:
+                self._finish(outbox_id, "failed", error=error)
+                logger.error("Outbox entry failed", extra={"outbox_id": outbox_id, "attempts": attempts, "error": error})
+            else:
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempts - 1))
+                self._finish(outbox_id, "queued", error=error, next_attempt=time.time() + delay)
+                self.retried += 1
+                logger.warning("Outbox entry attempt failed, retrying", extra={
+                    "outbox_id": outbox_id, "attempts": attempts, "error": error, "retry_in": round(delay, 1)
+                })
+            return
+        self._finish(outbox_id, "done", result=result)
+        self.sent += 1
+        # The partition's next entry may be sendable now
+        self.wakeup.set()
+
+    async def worker(self):
+        while not self.stopping:
+            claimed = self.claim()
+            if claimed is None:
+                if time.monotonic() - self.last_purge > 3600:
+                    self.last_purge = time.monotonic()
+                    self.purge(self.retention)
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.process(*claimed)
+
+    def start(self):
+        if not self.tasks:
+            self.stopping = False
+            self.tasks = [asyncio.ensure_future(self.worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        # Before Python 3.12, wait_for can swallow a cancel that lands as the wakeup fires;
+        # the flag ends such a worker at its next loop
+        self.stopping = True
+        self.wakeup.set()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def retry(self, outbox_id):
+        """Requeue a failed entry; False if it isn't in the failed state"""
+        now = time.time()
+        with self.db:
+            requeued = self.db.execute(
+                "UPDATE outbox SET status = 'queued', attempts = 0, next_attempt = ?, updated = ?"
+                " WHERE id = ? AND status = 'failed'", (now, now, outbox_id)
+            ).rowcount == 1
+        if requeued:
+            self.wakeup.set()
+        return requeued
+
+    def get(self, outbox_id):
+        row = self.db.execute(
+            "SELECT id, idempotency_key, partition, status, attempts, next_attempt, created, updated, result, error"
+            " FROM outbox WHERE id = ?", (outbox_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        result = json.loads(row[8]) if row[8] else None
+        return {
+            "id": row[0],
+            "idempotency_key": row[1],
+            "warehouse": row[2],
+            "status": row[3],
+            "attempts": row[4],
+            "next_attempt": row[5] if row[3] == "queued" else None,
+            "created": row[6],
+            "updated": row[7],
+            "name": result.get("name") if result else None,
+            "error": row[9]
+        }
+
+    def purge(self, older_than):
+        """Drop done entries last updated more than older_than seconds ago"""
+        with self.db:
+            return self.db.execute(
+                "DELETE FROM outbox WHERE status = 'done' AND updated < ?", (time.time() - older_than,)
+            ).rowcount
+
+    def stats(self):
+        counts = dict(self.db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        oldest = self.db.execute(
+            "SELECT MIN(created) FROM outbox WHERE status IN ('queued', 'sending')"
+        ).fetchone()[0]
+        return {
+            "queued": counts.get("queued", 0),
+            "sending": counts.get("sending", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "oldest_pending_seconds": round(time.time() - oldest, 1) if oldest else 0.0,
+            "workers": len(self.tasks),
+            "sent": self.sent,
+            "retried": self.retried
+        }
@@ -0,0 +1,129 @@
+"""
+Opt-in request profiling
+Per-request span timings for the Server-Timing header, and a sampling profiler
+that writes collapsed stacks (flamegraph.pl / speedscope input)
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+timings_var = contextvars.ContextVar("timings", default=None)
+
+
+class RequestTimings:
+    """
+    Span durations for one request. `upstream` is wall time with at least one
+    ERPNext call in flight (overlapping calls count once); `app` is what is left
+    of the total: our handler code plus time spent waiting for the event loop.
+    """
+
+    __slots__ = ("started", "spans", "upstream_calls", "_active", "_upstream_since")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.upstream_calls = 0
+        self._active = 0
+        self._upstream_since = 0.0
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def upstream_enter(self):
+        self.upstream_calls += 1
+        if self._active == 0:
+            self._upstream_since = time.perf_counter()
+        self._active += 1
+
+    def upstream_exit(self):
+        self._active -= 1
+        if self._active == 0:
+            self.add("upstream", time.perf_counter() - self._upstream_since)
+
+    def server_timing(self):
+        total = time.perf_counter() - self.started
+        spans = dict(self.spans)
+        spans["app"] = max(0.0, total - sum(spans.values()))
+        parts = []
+        for name, seconds in spans.items():
+            part = f"{name};dur={seconds * 1000:.2f}"
+            if name == "upstream":
+                part += f';desc="{self.upstream_calls} ERPNext call(s)"'
+            parts.append(part)
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+def record(name, seconds):
+    timings = timings_var.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def span(name):
+    """Time a block into the current request's timings (no-op when profiling is off)"""
+    timings = timings_var.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started)
+
+
+@contextmanager
+def upstream():
+    """Mark an ERPNext call in flight for the current request"""
+    timings = timings_var.get()
+    if timings is None:
+        yield
+        return
+    timings.upstream_enter()
+    try:
+        yield
+    finally:
+        timings.upstream_exit()
+
+
+class SamplingProfiler:
+    """Sample every thread's Python stack at a fixed interval from a helper thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def collect(self, seconds, interval):
+        """Blocking: returns collapsed stacks ("root;...;leaf count" per line)"""
+        if not self.lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            me = threading.get_ident()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            stacks = Counter()
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == me:
+                        continue
+                    frames = []
+                    while frame is not None:
+                        frames.append(self._frame_name(frame))
+                        frame = frame.f_back
+                    frames.append(names.get(thread_id, f"thread-{thread_id}"))
+                    stacks[";".join(reversed(frames))] += 1
+                time.sleep(interval)
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        finally:
+            self.lock.release()
@@ -0,0 +1,133 @@
+"""
+In-memory search indexes for WMS lookups
+Built once per cache refresh so scans never walk the full list
+"""
+
+import re
+from bisect import bisect_left
+
+NGRAM = 3  # trigram index for substring search
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(value):
+    """Normalize a barcode/name for matching"""
+    return (value or "").strip().lower()
+
+
+def ngrams(text, n=NGRAM):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def tokenize(text):
+    return TOKEN_RE.findall((text or "").lower())
+
+
+class SubstringIndex:
+    """Trigram posting lists over pre-lowered texts; answers `q in text` without a full scan"""
+
+    def __init__(self, texts):
+        self.texts = texts  # pre-lowered text per position
+        self.postings = {}  # trigram -> ascending list of positions
+        for pos, text in enumerate(texts):
+            for gram in ngrams(text):
+                self.postings.setdefault(gram, []).append(pos)
+
+    def search(self, needle, limit=20):
+        """Positions whose text contains needle, in ascending order"""
+        if len(needle) < NGRAM:
+            candidates = range(len(self.texts))
+        else:
+            # Rarest trigram of the query bounds the candidates to verify
+            candidates = min((self.postings.get(g, []) for g in ngrams(needle)), key=len)
+
+        matches = []
+        for pos in candidates:
+            if needle in self.texts[pos]:
+                matches.append(pos)
+                if len(matches) >= limit:
+                    break
+        return matches
+
+
+class LocationIndex:
+    """Exact barcode map + trigram substring index over warehouse names"""
+
+    def __init__(self, locations):
+        self.source = locations  # the cached list this index was built from
+        self.locations = locations
+        self.by_barcode = {}  # normalized custom_warehouse_barcode -> location
+
+        texts = []  # "name\0warehouse_name" per location
+        for location in locations:
+            barcode = normalize(location.get("custom_warehouse_barcode"))
+            if barcode and barcode not in self.by_barcode:
+                self.by_barcode[barcode] = location
+            texts.append(f"{(location.get('name') or '').lower()}\0{(location.get('warehouse_name') or '').lower()}")
+        self.names = SubstringIndex(texts)
+
+    def search(self, q, limit=20):
+        """Exact barcode match first, else locations whose name contains q (original order)"""
+        location = self.by_barcode.get(normalize(q))
+        if location is not None:
+            return [location]
+
+        needle = q.lower()
+        if not needle:
+            return self.locations[:limit]
+        return [self.locations[pos] for pos in self.names.search(needle, limit)]
+
+
+class ItemIndex:
+    """Exact barcode map, item_code substring index and item_name token/substring index"""
+
+    def __init__(self, items):
+        self.items = items
+        self.by_barcode = {}  # normalized custom_barcode -> item
+        self.tokens = {}  # item_name token -> ascending list of positions
+        for pos, item in enumerate(items):
+            barcode = normalize(item.get("custom_barcode"))
+            if barcode and barcode not in self.by_barcode:
+                self.by_barcode[barcode] = item
+            for token in set(tokenize(item.get("item_name"))):
+                self.tokens.setdefault(token, []).append(pos)
+        self.codes = SubstringIndex([(item.get("item_code") or "").lower() for item in items])
+        self.names = SubstringIndex([(item.get("item_name") or "").lower() for item in items])
+        self.sorted_tokens = sorted(self.tokens)
+
+    def search(self, q, limit=20):
+        """Same precedence as the ERPNext search: barcode, then item_code, then item_name"""
+        item = self.by_barcode.get(normalize(q))
+        if item is not None:
+            return [item]
+
+        needle = q.lower()
+        if not needle:
+            return []
+        positions = self.codes.search(needle, limit)
+        if not positions:
+            positions = self.search_name_tokens(needle, limit) or self.names.search(needle, limit)
+        return [self.items[pos] for pos in positions]
+
+    def search_name_tokens(self, needle, limit):
+        """Items whose name has a token starting with every query token"""
+        query_tokens = tokenize(needle)
+        if not query_tokens:
+            return []
+        matched = None
+        for query_token in query_tokens:
+            positions = set()
+            for token in self._tokens_with_prefix(query_token):
+                positions.update(self.tokens[token])
+            matched = positions if matched is None else matched & positions
+            if not matched:
+                return []
+        return sorted(matched)[:limit]
+
+    def _tokens_with_prefix(self, prefix):
+        # sorted_tokens lets a prefix range be found by bisection
+        for i in range(bisect_left(self.sorted_tokens, prefix), len(self.sorted_tokens)):
+            token = self.sorted_tokens[i]
+            if not token.startswith(prefix):
+                break
+            yield token
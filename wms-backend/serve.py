@@ -0,0 +1,98 @@
+"""
+Production server: uvicorn with one worker process per core, no reload
+Workers share the location list and item catalog through mmap'd snapshots
+(SHARED_SNAPSHOTS); `python main.py` stays the single-process dev server
+"""
+
+import math
+import os
+import sys
+
+import uvicorn
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+MAX_DEFAULT_WORKERS = 8  # each worker has its own ERPNext pool; set WEB_CONCURRENCY to go higher
+
+
+def cgroup_cpu_limit():
+    """CPU quota of this container (cgroup v2 cpu.max or v1 cfs quota), or None if unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        return quota / period if quota > 0 else None
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus():
+    try:
+        cpus = len(os.sched_getaffinity(0))  # CPUs this process may be scheduled on
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()  # affinity ignores the container's CPU quota
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return min(cpus, MAX_DEFAULT_WORKERS)
+
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", 8000))
+WORKERS = int(os.getenv("WEB_CONCURRENCY", available_cpus()))
+TIMEOUT_KEEP_ALIVE = int(os.getenv("TIMEOUT_KEEP_ALIVE", 75))  # seconds; keep scanner connections open between scans
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "*")  # trust X-Forwarded-* from the platform proxy
+ACCESS_LOG = os.getenv("ACCESS_LOG", "false").lower() == "true"  # the app already logs sampled requests
+
+
+def config_errors(workers):
+    """Settings whose state lives in one worker's memory and would be wrong with several"""
+    if workers <= 1:
+        return []
+    errors = []
+    if os.getenv("STOCK_PROJECTION_ENABLED", "false").lower() == "true":
+        errors.append("STOCK_PROJECTION_ENABLED: each worker would keep its own projection and only apply "
+                      "the entries posted through it (run it with WEB_CONCURRENCY=1)")
+    if float(os.getenv("BALANCE_CACHE_TTL", 0)) > 0 and os.getenv("CACHE_BACKEND", "memory") != "redis":
+        errors.append("BALANCE_CACHE_TTL > 0 needs CACHE_BACKEND=redis: a stock entry only invalidates the "
+                      "balances cached by the worker that posted it")
+    return errors
+
+
+def main():
+    errors = config_errors(WORKERS)
+    if errors:
+        for error in errors:
+            print(f"❌ {error}", file=sys.stderr)
+        sys.exit(f"Refusing to start {WORKERS} workers")
+    # Workers are spawned fresh and inherit this environment
+    os.environ["WEB_CONCURRENCY"] = str(WORKERS)  # lets each worker know it is one of several
+    os.environ.setdefault("SHARED_SNAPSHOTS", "true" if WORKERS > 1 else "false")
+    print(f"🚀 Starting {WORKERS} worker(s) on {HOST}:{PORT} (shared snapshots: {os.environ['SHARED_SNAPSHOTS']})")
+    uvicorn.run(
+        "main:app",
+        host=HOST,
+        port=PORT,
+        workers=WORKERS,
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+        timeout_keep_alive=TIMEOUT_KEEP_ALIVE,
+        timeout_graceful_shutdown=30,
+        access_log=ACCESS_LOG
+    )
+
+
+if __name__ == "__main__":
+    main()
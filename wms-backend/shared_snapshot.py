@@ -0,0 +1,352 @@
+"""
+Read-mostly datasets shared by worker processes through mmap'd snapshot files
+One worker (holding the leader lock) fetches from ERPNext and publishes; every
+worker searches the mapped file in place, so the data exists once per host
+"""
+
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from fast_json import EncodedBody, dumps
+from search_index import normalize, tokenize
+from versioning import row_digest
+
+MAGIC = b"WMSSNAP2"
+HEADER = struct.Struct("<8sI")  # magic, JSON header length
+
+
+def barcode_hash(barcode):
+    return int.from_bytes(hashlib.blake2b(barcode.encode(), digest_size=8).digest(), "little")
+
+
+def write_snapshot(path, rows, barcodes, texts, meta=None, gzip_level=None, keys=None):
+    """
+    Atomically write rows plus their search sections to path.
+    barcodes: normalized barcode per row (or None); texts: {name: lowered text per row}
+    gzip_level: also store the rows array gzipped, for serving the whole dataset compressed
+    keys: row key per row; stored with a digest per row for versions and deltas
+    Readers mapping the previous file keep it until they switch.
+    """
+    encoded = [dumps(row) for row in rows]
+    sections = {}
+
+    starts, offset = [], 1
+    for data in encoded:
+        starts.append(offset)
+        offset += len(data) + 1
+    sections["rows"] = b"[" + b",".join(encoded) + b"]"
+    sections["row_starts"] = struct.pack(f"<{len(starts)}I", *starts)
+    if gzip_level is not None:
+        sections["rows.gz"] = gzip.compress(sections["rows"], compresslevel=gzip_level, mtime=0)
+    if keys is not None:
+        sections["keys"] = dumps(keys)
+        sections["digests"] = struct.pack(f"<{len(encoded)}Q", *(row_digest(data) for data in encoded))
+
+    # First row wins for a duplicated barcode: sort by (hash, position)
+    pairs = sorted((barcode_hash(b), pos) for pos, b in enumerate(barcodes) if b)
+    sections["barcode_hashes"] = struct.pack(f"<{len(pairs)}Q", *(h for h, _ in pairs))
+    sections["barcode_rows"] = struct.pack(f"<{len(pairs)}I", *(pos for _, pos in pairs))
+
+    for name, values in texts.items():
+        # One line per row; a match is mapped back to its row by bisecting the line starts
+        lines = [value.replace("\n", " ").encode() for value in values]
+        line_starts, offset = [], 0
+        for line in lines:
+            line_starts.append(offset)
+            offset += len(line) + 1
+        sections[f"text:{name}"] = b"\n".join(lines) + b"\n"
+        sections[f"lines:{name}"] = struct.pack(f"<{len(line_starts)}I", *line_starts)
+
+    layout, offset = {}, 0
+    for name, data in sections.items():
+        layout[name] = [offset, len(data)]
+        offset += len(data) + (-len(data) % 8)  # 8-byte aligned for the typed views
+    header = json.dumps({"count": len(rows), "created": time.time(), "sections": layout,
+                         "meta": meta or {}}).encode()
+    prefix = HEADER.pack(MAGIC, len(header)) + header
+    prefix += b"\0" * (-len(prefix) % 8)
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(prefix)
+        for data in sections.values():
+            f.write(data)
+            f.write(b"\0" * (-len(data) % 8))
+    os.replace(tmp, path)
+
+
+class Snapshot:
+    """A mapped snapshot file; sections are memoryviews into the mapping (no copies)"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns)
+            self.size = stat.st_size
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a WMS snapshot")
+        header = json.loads(self.map[HEADER.size:HEADER.size + header_length])
+        base = HEADER.size + header_length
+        base += -base % 8
+        self.count = header["count"]
+        self.created = header["created"]
+        self.meta = header["meta"]
+        self.base = base
+        self.layout = {name: (base + offset, length) for name, (offset, length) in header["sections"].items()}
+        view = memoryview(self.map)
+        self.sections = {name: view[start:start + length] for name, (start, length) in self.layout.items()}
+        self.row_starts = self.sections["row_starts"].cast("I")
+        self.barcode_hashes = self.sections["barcode_hashes"].cast("Q")
+        self.barcode_rows = self.sections["barcode_rows"].cast("I")
+        self.lines = {name[6:]: view.cast("I") for name, view in self.sections.items() if name.startswith("lines:")}
+        # Response body for the whole dataset, sent from the mapping without a copy
+        self.rows_body = EncodedBody(self.sections["rows"], self.sections.get("rows.gz"))
+
+    def rows_json(self):
+        """The whole dataset as a JSON array (one memcpy, no decoding)"""
+        return self.sections["rows"].tobytes()
+
+    def row_json(self, pos):
+        start = self.row_starts[pos]
+        end = self.row_starts[pos + 1] - 1 if pos + 1 < self.count else len(self.sections["rows"]) - 1
+        return self.sections["rows"][start:end]
+
+    def row(self, pos):
+        return json.loads(self.row_json(pos).tobytes())
+
+    def rows(self, positions=None):
+        """Decoded rows at these positions (all rows if None)"""
+        if positions is None:
+            return json.loads(self.sections["rows"].tobytes())
+        return [self.row(pos) for pos in positions]
+
+    def json_array(self, positions=None):
+        """Response body for these rows (all rows if None), spliced from the stored JSON"""
+        if positions is None:
+            return self.sections["rows"]
+        return b"[" + b",".join(self.row_json(pos) for pos in positions) + b"]"
+
+    def keys_and_digests(self):
+        """Row keys and digests stored by the writer (for VersionedRows)"""
+        return json.loads(self.sections["keys"].tobytes()), self.sections["digests"].cast("Q").tolist()
+
+    def find_barcode(self, barcode, field):
+        """Row position whose normalized `field` equals barcode, or None"""
+        if not barcode:
+            return None
+        target = barcode_hash(barcode)
+        i = bisect_left(self.barcode_hashes, target)
+        while i < len(self.barcode_hashes) and self.barcode_hashes[i] == target:
+            pos = self.barcode_rows[i]
+            if normalize(self.row(pos).get(field)) == barcode:
+                return pos
+            i += 1
+        return None
+
+    def find_text(self, name, needle, limit=None):
+        """Ascending row positions whose `name` text contains needle (bytes), searched in the mapping"""
+        return list(islice(self.iter_text(name, needle), limit))
+
+    def iter_text(self, name, needle):
+        if b"\n" in needle:
+            return
+        start, length = self.layout[f"text:{name}"]
+        lines = self.lines[name]
+        end = start + length
+        offset = start
+        while True:
+            found = self.map.find(needle, offset, end)
+            if found < 0:
+                return
+            pos = bisect_right(lines, found - start) - 1
+            yield pos
+            # Continue after this row's line: one hit per row
+            offset = start + lines[pos + 1] if pos + 1 < self.count else end
+
+    def text_contains(self, name, pos, needle):
+        start, length = self.layout[f"text:{name}"]
+        lines = self.lines[name]
+        line_end = start + lines[pos + 1] if pos + 1 < self.count else start + length
+        return self.map.find(needle, start + lines[pos], line_end) >= 0
+
+
+class SharedIndex:
+    """Search results as decoded rows (search) or as a ready JSON body (search_json)"""
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def search(self, q, limit=20):
+        return [self.snapshot.row(pos) for pos in self.positions(q, limit)]
+
+    def search_json(self, q, limit=20):
+        return self.snapshot.json_array(self.positions(q, limit))
+
+
+class SharedLocationIndex(SharedIndex):
+    """LocationIndex semantics over a mapped snapshot"""
+
+    def positions(self, q, limit):
+        pos = self.snapshot.find_barcode(normalize(q), "custom_warehouse_barcode")
+        if pos is not None:
+            return [pos]
+        needle = q.lower()
+        if not needle:
+            return range(min(limit, self.snapshot.count))
+        return self.snapshot.find_text("names", needle.encode(), limit)
+
+
+class SharedItemIndex(SharedIndex):
+    """ItemIndex semantics over a mapped snapshot"""
+
+    def positions(self, q, limit):
+        pos = self.snapshot.find_barcode(normalize(q), "custom_barcode")
+        if pos is not None:
+            return [pos]
+        needle = q.lower()
+        if not needle:
+            return []
+        positions = self.snapshot.find_text("codes", needle.encode(), limit)
+        if not positions:
+            positions = self.search_name_tokens(needle, limit) or \
+                self.snapshot.find_text("names", needle.encode(), limit)
+        return positions
+
+    def search_name_tokens(self, needle, limit):
+        """Rows with a name token starting with every query token (token lines are ' tok tok ...')"""
+        query_tokens = tokenize(needle)
+        if not query_tokens:
+            return []
+        prefixes = [b" " + token.encode() for token in query_tokens]
+        matched = []
+        for pos in self.snapshot.iter_text("tokens", prefixes[0]):
+            if all(self.snapshot.text_contains("tokens", pos, prefix) for prefix in prefixes[1:]):
+                matched.append(pos)
+                if len(matched) >= limit:
+                    break
+        return matched
+
+
+def write_location_snapshot(path, locations, meta=None, gzip_level=None):
+    write_snapshot(
+        path, locations,
+        [normalize(location.get("custom_warehouse_barcode")) for location in locations],
+        {"names": [f"{(location.get('name') or '').lower()}\0{(location.get('warehouse_name') or '').lower()}"
+                   for location in locations]},
+        meta, gzip_level, keys=[location["name"] for location in locations]
+    )
+
+
+def write_item_snapshot(path, items, meta=None, gzip_level=None):
+    write_snapshot(
+        path, items,
+        [normalize(item.get("custom_barcode")) for item in items],
+        {
+            "codes": [(item.get("item_code") or "").lower() for item in items],
+            "names": [(item.get("item_name") or "").lower() for item in items],
+            "tokens": ["".join(" " + token for token in sorted(set(tokenize(item.get("item_name")))))
+                       for item in items]
+        },
+        meta, gzip_level, keys=[item["item_code"] for item in items]
+    )
+
+
+class SnapshotFile:
+    """Current mapping of a snapshot path, re-checked at most every check_interval seconds"""
+
+    def __init__(self, path, index_class, meta=None, max_age=None, check_interval=1.0):
+        self.path = path
+        self.index_class = index_class
+        self.meta = meta or {}  # a snapshot written for another source is ignored
+        self.max_age = max_age  # seconds; older snapshots are ignored (None = no limit)
+        self.check_interval = check_interval
+        self.index = None
+        self._next_check = 0.0
+        self.loads = 0
+
+    def current(self):
+        """Index over the newest valid snapshot, or None"""
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._next_check = now + self.check_interval
+            self._check()
+        index = self.index
+        if index is not None and self.max_age is not None and time.time() - index.snapshot.created > self.max_age:
+            return None
+        return index
+
+    def _check(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.index = None
+            return
+        if self.index is not None and self.index.snapshot.identity == (stat.st_ino, stat.st_mtime_ns):
+            return
+        try:
+            snapshot = Snapshot(self.path)
+        except ValueError:
+            # Another format (e.g. left in /dev/shm by an older release) until the leader rewrites it
+            self.index = None
+            return
+        if any(snapshot.meta.get(key) != value for key, value in self.meta.items()):
+            self.index = None
+            return
+        # The previous mapping is unmapped once no response still references it
+        self.index = self.index_class(snapshot)
+        self.loads += 1
+
+    def stats(self):
+        index = self.current()
+        if index is None:
+            return {"path": self.path, "loaded": False}
+        return {
+            "path": self.path,
+            "loaded": True,
+            "rows": index.snapshot.count,
+            "bytes": index.snapshot.size,
+            "age_seconds": round(time.time() - index.snapshot.created, 1),
+            "loads": self.loads
+        }
+
+
+class LeaderLock:
+    """Non-blocking exclusive flock: the holder publishes snapshots; released when its process exits"""
+
+    def __init__(self, path):
+        import fcntl  # POSIX only; shared snapshots are a Linux production feature
+
+        self.fcntl = fcntl
+        self.path = path
+        self.file = None
+
+    @property
+    def held(self):
+        return self.file is not None
+
+    def try_acquire(self):
+        if self.file is not None:
+            return True
+        f = open(self.path, "a")
+        try:
+            self.fcntl.flock(f.fileno(), self.fcntl.LOCK_EX | self.fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            return False
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is not None:
+            self.fcntl.flock(self.file.fileno(), self.fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
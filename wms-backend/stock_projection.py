@@ -0,0 +1,203 @@
+"""
+In-process stock projection
+Seeded from a bulk Bin snapshot, moved by the Stock Entries the WMS creates,
+periodically reconciled against ERPNext with drift reporting.
+WMS entries are drafts, which Bins ignore until they are submitted: the projection
+keeps their moves across reconciles until ERPNext counts them (or they are cancelled)
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+
+from bulk_fetch import PagedFetcher
+
+logger = logging.getLogger("wms.stock_projection")
+
+BIN_FIELDS = ["item_code", "warehouse", "actual_qty", "reserved_qty"]
+NAMES_PER_QUERY = 100  # draft names per docstatus lookup (keeps the URL short)
+
+
+class StockProjection:
+    def __init__(self, page_size=500, workers=4, reconcile_interval=900):
+        self.page_size = page_size
+        self.workers = workers
+        self.reconcile_interval = reconcile_interval
+        self.by_item = {}  # item_code -> {warehouse: [actual_qty, reserved_qty]}
+        self.by_warehouse = {}  # warehouse -> {item_code: same list object}
+        self.journal = None  # entries applied while a snapshot is being fetched
+        self.drafts = {}  # Stock Entry name -> item rows, applied but not yet in the Bins
+        self.ready = False
+        self.seeded_at = None
+        self.entries_applied = 0
+        self.last_drift = None
+        self.task = None
+
+    async def fetch_snapshot(self, client):
+        bins = await PagedFetcher(client.get, "Bin", BIN_FIELDS,
+                                  page_size=self.page_size, workers=self.workers).fetch_all()
+        return {(b["item_code"], b["warehouse"]): (float(b.get("actual_qty") or 0), float(b.get("reserved_qty") or 0))
+                for b in bins}
+
+    async def open_drafts(self, client, names):
+        """Those of these Stock Entries that are still drafts (docstatus 0)"""
+        open_names = set()
+        for start in range(0, len(names), NAMES_PER_QUERY):
+            rows = await PagedFetcher(client.get, "Stock Entry", ["name", "docstatus"],
+                                      filters=[["name", "in", names[start:start + NAMES_PER_QUERY]]],
+                                      page_size=self.page_size, workers=self.workers).fetch_all()
+            open_names.update(row["name"] for row in rows if int(row.get("docstatus") or 0) == 0)
+        return open_names
+
+    def _load(self, snapshot):
+        self.by_item, self.by_warehouse = {}, {}
+        for (item_code, warehouse), (actual, reserved) in snapshot.items():
+            self._slot(item_code, warehouse)[:] = [actual, reserved]
+
+    def _slot(self, item_code, warehouse):
+        slot = self.by_item.setdefault(item_code, {}).get(warehouse)
+        if slot is None:
+            slot = [0.0, 0.0]
+            self.by_item[item_code][warehouse] = slot
+            self.by_warehouse.setdefault(warehouse, {})[item_code] = slot
+        return slot
+
+    async def seed(self, client):
+        """Replace the projection with a fresh Bin snapshot"""
+        self.journal = []
+        try:
+            snapshot = await self.fetch_snapshot(client)
+            self._load(snapshot)
+            self._replay()
+        finally:
+            self.journal = None
+        self.ready = True
+        self.seeded_at = datetime.utcnow().isoformat() + "Z"
+        logger.info("Stock projection seeded", extra={"bins": len(snapshot)})
+
+    async def reconcile(self, client):
+        """
+        Compare with ERPNext, report drift, then adopt the ERPNext snapshot.
+        Drafts posted earlier that are still drafts are applied on top again; drafts
+        submitted (now in the Bins), cancelled or deleted are dropped. Draft status is
+        read before the Bins, so a draft submitted in between is kept and applied once
+        more (counted twice until the next reconcile drops it) rather than lost.
+        """
+        posted = dict(self.drafts)
+        self.journal = []
+        try:
+            open_names = await self.open_drafts(client, list(posted)) if posted else set()
+            snapshot = await self.fetch_snapshot(client)
+            pending = [items for name, items in posted.items() if name in open_names]
+            # Neither the open drafts nor entries applied during the fetch are in the Bins
+            drift = self._drift(snapshot, exclude=self._pairs(self.journal) | self._pairs(pending))
+            self._load(snapshot)
+            for items in pending:
+                self._apply(items)
+            self._replay()
+        finally:
+            self.journal = None
+        self.drafts = {name: items for name, items in self.drafts.items() if name in open_names or name not in posted}
+        self.seeded_at = datetime.utcnow().isoformat() + "Z"
+        self.last_drift = drift
+        if drift["drifted"]:
+            logger.warning("Stock projection drift", extra={"bins": drift["drifted"], "qty": drift["abs_qty_drift"]})
+        return drift
+
+    def _drift(self, snapshot, exclude):
+        keys = {(i, w) for i, whs in self.by_item.items() for w in whs} | set(snapshot)
+        rows = []
+        for key in keys - exclude:
+            projected = self.by_item.get(key[0], {}).get(key[1], [0.0, 0.0])[0]
+            actual = snapshot.get(key, (0.0, 0.0))[0]
+            if abs(projected - actual) > 1e-9:
+                rows.append({"item_code": key[0], "warehouse": key[1], "projected": projected,
+                             "erpnext": actual, "diff": projected - actual})
+        rows.sort(key=lambda r: abs(r["diff"]), reverse=True)
+        return {
+            "checked_at": datetime.utcnow().isoformat() + "Z",
+            "bins_compared": len(keys),
+            "drifted": len(rows),
+            "abs_qty_drift": round(sum(abs(r["diff"]) for r in rows), 6),
+            "top": rows[:20]
+        }
+
+    def apply(self, items, name=None):
+        """
+        Apply Stock Entry item rows: s_warehouse loses qty, t_warehouse gains it.
+        name: the draft's Stock Entry name, kept until a reconcile finds it submitted
+        """
+        if self.journal is not None:
+            self.journal.append(items)
+        if name:
+            self.drafts[name] = items
+        self._apply(items)
+        self.entries_applied += 1
+
+    def _apply(self, items):
+        for item in items:
+            qty = float(item.get("qty") or 0)
+            if item.get("s_warehouse"):
+                self._slot(item["item_code"], item["s_warehouse"])[0] -= qty
+            if item.get("t_warehouse"):
+                self._slot(item["item_code"], item["t_warehouse"])[0] += qty
+
+    def _replay(self):
+        for items in self.journal:
+            self._apply(items)
+
+    @staticmethod
+    def _pairs(entries):
+        return {(item["item_code"], item.get(side)) for items in entries for item in items
+                for side in ("s_warehouse", "t_warehouse") if item.get(side)}
+
+    @staticmethod
+    def _balance(slot):
+        actual, reserved = slot
+        return {"actual_qty": actual, "reserved_qty": reserved, "available_qty": actual - reserved}
+
+    def balance(self, item_code, warehouse):
+        slot = self.by_item.get(item_code, {}).get(warehouse)
+        return self._balance(slot or [0.0, 0.0])
+
+    def item_balances(self, item_code):
+        return {warehouse: self._balance(slot) for warehouse, slot in self.by_item.get(item_code, {}).items()}
+
+    def warehouse_balances(self, warehouse):
+        return {item_code: self._balance(slot) for item_code, slot in self.by_warehouse.get(warehouse, {}).items()}
+
+    async def run(self, client):
+        """Background loop: seed, then reconcile every reconcile_interval seconds"""
+        while True:
+            try:
+                if not self.ready:
+                    await self.seed(client)
+                else:
+                    await self.reconcile(client)
+            except Exception as e:
+                logger.warning("Stock projection refresh failed", extra={"error": str(e)})
+            await asyncio.sleep(self.reconcile_interval if self.ready else 30)
+
+    def start(self, client):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run(client))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self):
+        return {
+            "ready": self.ready,
+            "items": len(self.by_item),
+            "warehouses": len(self.by_warehouse),
+            "seeded_at": self.seeded_at,
+            "entries_applied": self.entries_applied,
+            "drafts_pending": len(self.drafts),
+            "last_drift": self.last_drift
+        }
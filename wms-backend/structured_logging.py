@@ -0,0 +1,133 @@
+"""
+Structured, non-blocking logging for the API server
+JSON lines with request IDs; records are handed to a background thread so stdout never blocks the event loop
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_sample_rate = 1.0
+
+
+def sampled():
+    """Whether to emit a per-request hot-path line: `if sampled(): logger.info(...)`.
+    Checked before the call so dropped lines cost no LogRecord."""
+    return _sample_rate >= 1.0 or random.random() < _sample_rate
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RESERVED:
+                entry[key] = value
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{record.levelname:<7} {record.getMessage()}"
+        if getattr(record, "request_id", None):
+            line = f"[{record.request_id}] {line}"
+        extra = {k: v for k, v in vars(record).items() if k not in _RESERVED}
+        if extra:
+            line += " " + " ".join(f"{k}={v}" for k, v in extra.items())
+        return line
+
+
+class ContextFilter(logging.Filter):
+    """Stamp the current request ID (set per request by the API middleware)"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Never wait on a full queue: count the record as dropped instead"""
+
+    def __init__(self, q, max_size):
+        super().__init__(q)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Keep the record's fields for the formatter; only resolve the message here
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.msg = f"{record.msg}\n{record.exc_text}"
+            record.exc_info = None
+            record.exc_text = None
+        return record
+
+    def enqueue(self, record):
+        # SimpleQueue is lock-free on put; the size check is approximate, which is fine for a cap
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+        else:
+            self.queue.put_nowait(record)
+
+
+_handler = None
+_listener = None
+
+
+def setup_logging(level="INFO", fmt="json", sample_rate=1.0, queue_size=10000, stream=None):
+    """Route the `wms` logger tree through a bounded queue to one stdout writer thread"""
+    global _handler, _listener, _sample_rate
+    if _listener is not None:
+        return
+    _sample_rate = sample_rate
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+    _handler = DroppingQueueHandler(queue.SimpleQueue(), queue_size)
+    _handler.addFilter(ContextFilter())
+    _listener = QueueListener(_handler.queue, output)
+    _listener.start()
+    atexit.register(shutdown_logging)
+
+    # Skip per-record stack walks and process/thread lookups we never print
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    root = logging.getLogger("wms")
+    root.setLevel(level.upper())
+    root.addHandler(_handler)
+    root.propagate = False
+
+
+def shutdown_logging():
+    """Flush queued records (listener thread drains the queue before stopping)"""
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()
+        logging.getLogger("wms").removeHandler(_handler)
+        _listener = None
+
+
+def stats():
+    return {"dropped": _handler.dropped if _handler else 0,
+            "queued": _handler.queue.qsize() if _handler else 0}
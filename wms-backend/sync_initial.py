@@ -1,18 +1,53 @@
 """
 Initial Sync Script: ERPNext -> Supabase
 Run this once to populate Supabase with all data from ERPNext
+
+Usage:
+    python sync_initial.py                  # full sync (records high-water marks)
+    python sync_initial.py --incremental    # only rows modified since the last run
+    python sync_initial.py --reconcile      # also delete rows removed from ERPNext
 """
 
+import argparse
+import asyncio
+import json
+import logging
 import os
 import sys
+import time
 import requests
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from datetime import datetime
+from bulk_fetch import PagedFetcher
+from digest_store import DigestStore
+from sync_pipeline import BatchUpserter
+from structured_logging import TextFormatter
 
 # Load environment variables
 load_dotenv()
 
+# Per-doctype `modified` high-water marks between runs
+SYNC_STATE_FILE = os.getenv("SYNC_STATE_FILE", ".sync_state.json")
+SYNC_PAGE_SIZE = int(os.getenv("SYNC_PAGE_SIZE", 500))
+SYNC_WORKERS = int(os.getenv("SYNC_WORKERS", 4))  # concurrent ERPNext page fetches
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 500))  # initial upsert batch size (adapts)
+SYNC_UPSERTS_IN_FLIGHT = int(os.getenv("SYNC_UPSERTS_IN_FLIGHT", 4))  # concurrent Supabase upserts
+SYNC_RECONCILE_INTERVAL_HOURS = float(os.getenv("SYNC_RECONCILE_INTERVAL_HOURS", 24))
+# Content hashes of the last upserted version of every row (skips unchanged rows)
+SYNC_DIGEST_DB = os.getenv("SYNC_DIGEST_DB", ".sync_digests.sqlite")
+
+ITEM_FIELDS = ["item_code", "item_name", "item_group", "stock_uom", "description", "custom_stock_location", "barcode"]
+WAREHOUSE_FIELDS = ["name", "warehouse_name", "parent_warehouse", "is_group", "custom_warehouse_barcode", "company"]
+BIN_FIELDS = ["item_code", "warehouse", "actual_qty", "reserved_qty"]
+
+# Supabase primary key columns per table
+TABLE_KEYS = {
+    "items": ["item_code"],
+    "warehouses": ["name"],
+    "stock_balance": ["item_code", "warehouse"],
+}
+
 # Initialize Supabase client
 supabase: Client = create_client(
     os.getenv("SUPABASE_URL"),
@@ -28,154 +63,265 @@ class ERPNextClient:
             "Content-Type": "application/json",
             "Accept": "application/json"
         }
+        # Keep-alive pool shared by the concurrent page fetches
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=SYNC_WORKERS))
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=SYNC_WORKERS))
     
     def get(self, endpoint, params=None):
         """Make GET request to ERPNext"""
         url = f"{self.base_url}{endpoint}"
-        print(f"   GET {url}")
+        print(f"   GET {url} ({params.get('filters', 'no filters') if params else 'no filters'})")
         try:
-            response = requests.get(url, headers=self.headers, params=params, timeout=30)
+            response = self.session.get(url, headers=self.headers, params=params, timeout=30)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
             raise Exception(f"ERPNext API error: {e}")
+    
+    async def aget(self, endpoint, params=None):
+        """get() on a worker thread, for PagedFetcher"""
+        return await asyncio.to_thread(self.get, endpoint, params)
+    
+    def fetcher(self, doctype, fields, filters=None, after=None):
+        """Concurrent keyset-paged fetch of a doctype (see bulk_fetch.PagedFetcher)"""
+        return PagedFetcher(self.aget, doctype, fields, filters=filters, page_size=SYNC_PAGE_SIZE,
+                            workers=SYNC_WORKERS, after=after)
+    
+    def get_all(self, doctype, fields, filters=None):
+        """Fetch every matching row"""
+        return asyncio.run(self.fetcher(doctype, fields, filters).fetch_all())
 
 erpnext = ERPNextClient()
 
-def sync_items():
-    """Sync all items from ERPNext to Supabase"""
+digests = DigestStore(SYNC_DIGEST_DB)
+
+def supabase_upsert(table, rows):
+    supabase.table(table).upsert(rows).execute()
+
+def load_state():
+    """Load high-water marks from the last run"""
+    if os.path.exists(SYNC_STATE_FILE):
+        with open(SYNC_STATE_FILE) as f:
+            return json.load(f)
+    return {}
+
+def save_state(state):
+    with open(SYNC_STATE_FILE, "w") as f:
+        json.dump(state, f, indent=2)
+
+def sync_doctype(doctype, fields, table, transform, state, incremental, filters=None, force=False):
+    """
+    Stream a doctype from ERPNext into a Supabase table: pages feed a
+    BatchUpserter as they arrive, so memory stays constant. Rows whose
+    content hash matches the last upsert are skipped (unless force).
+    After a failure the next run resumes after the last fully upserted row (by name).
+    Returns the number of rows upserted.
+    """
+    keys = TABLE_KEYS[table]
+    doc_state = state.setdefault(doctype, {})
+    filters = list(filters or [])
+    high_water = doc_state.get("modified")
+    if incremental and high_water:
+        # >= so rows sharing the high-water timestamp are never skipped
+        filters.append(["modified", ">=", high_water])
+    
+    resume = doc_state.get("resume")
+    after, newest = None, high_water
+    # Checkpoints before keyset paging named a page number; those runs start over
+    if resume and resume.get("incremental") == incremental and "after" in resume:
+        after, newest = resume["after"], resume.get("high_water")
+        print(f"   ↩️  Resuming {doctype} after {after}")
+    
+    def checkpoint(marker):
+        # Every row up to the end of this page is upserted; names, unlike page offsets,
+        # stay valid when rows are inserted or deleted before the next run
+        last_name, page_newest = marker
+        doc_state["resume"] = {"after": last_name, "incremental": incremental, "high_water": page_newest}
+        save_state(state)
+    
+    async def run():
+        nonlocal newest
+        upserter = BatchUpserter(supabase_upsert, table, batch_size=SYNC_BATCH_SIZE,
+                                 in_flight=SYNC_UPSERTS_IN_FLIGHT, on_commit=checkpoint,
+                                 on_batch=lambda batch: digests.record(table, batch, keys), key_fields=keys)
+        try:
+            async for last_name, rows in erpnext.fetcher(doctype, fields + ["modified"], filters, after).pages():
+                newest = max([r["modified"] for r in rows if r.get("modified")] + ([newest] if newest else []), default=None)
+                transformed = [transform(r) for r in rows]
+                changed = transformed if force else digests.changed(table, transformed, keys)
+                await upserter.add(changed, marker=(last_name, newest))
+        except Exception:
+            await upserter.abort()  # keep whatever already landed checkpointed
+            raise
+        stats = await upserter.close()
+        print(f"   ⚡ {stats['rows']} rows in {stats['seconds']}s ({stats['rows_per_sec']} rows/s, "
+              f"{stats['batches']} batches, {stats['retried']} retries, final batch size {stats['batch_size']})")
+        print(f"   ⏭️  Skipped {digests.skipped.get(table, 0)} unchanged {table} row(s)")
+        return stats["rows"]
+    
+    synced = asyncio.run(run())
+    
+    # Whole doctype done: advance the high-water mark and clear the checkpoint
+    doc_state.pop("resume", None)
+    if newest:
+        doc_state["modified"] = newest
+    save_state(state)
+    return synced
+
+def transform_item(item):
+    return {
+        "item_code": item["item_code"],
+        "item_name": item.get("item_name", item["item_code"]),
+        "barcode": item.get("barcode"),
+        "stock_uom": item.get("stock_uom"),
+        "custom_stock_location": item.get("custom_stock_location"),
+        "item_group": item.get("item_group"),
+        "description": item.get("description"),
+        "last_synced": datetime.utcnow().isoformat()
+    }
+
+def transform_warehouse(wh):
+    return {
+        "name": wh["name"],
+        "warehouse_name": wh.get("warehouse_name", wh["name"]),
+        "parent_warehouse": wh.get("parent_warehouse"),
+        "is_group": wh.get("is_group", 0) == 1,
+        "custom_warehouse_barcode": wh.get("custom_warehouse_barcode"),
+        "company": wh.get("company"),
+        "last_synced": datetime.utcnow().isoformat()
+    }
+
+def transform_stock(stock):
+    actual_qty = float(stock.get("actual_qty", 0))
+    reserved_qty = float(stock.get("reserved_qty", 0))
+    return {
+        "item_code": stock["item_code"],
+        "warehouse": stock["warehouse"],
+        "actual_qty": actual_qty,
+        "reserved_qty": reserved_qty,
+        "available_qty": actual_qty - reserved_qty,
+        "last_updated": datetime.utcnow().isoformat()
+    }
+
+def sync_items(state, incremental=False, force=False):
+    """Sync items from ERPNext to Supabase"""
     print("🔄 Syncing items from ERPNext...")
     
     try:
-        # Fetch all items from ERPNext
-        response = erpnext.get("/api/resource/Item", params={
-            "fields": '["item_code","item_name","item_group","stock_uom","description","custom_stock_location","barcode"]',
-            "limit_page_length": 5000
-        })
-        
-        items = response.get("data", [])
-        print(f"   Found {len(items)} items in ERPNext")
-        
-        if not items:
-            print("   ⚠️  No items found!")
-            return
-        
-        # Transform for Supabase
-        supabase_items = []
-        for item in items:
-            supabase_items.append({
-                "item_code": item["item_code"],
-                "item_name": item.get("item_name", item["item_code"]),
-                "barcode": item.get("barcode"),
-                "stock_uom": item.get("stock_uom"),
-                "custom_stock_location": item.get("custom_stock_location"),
-                "item_group": item.get("item_group"),
-                "description": item.get("description"),
-                "last_synced": datetime.utcnow().isoformat()
-            })
-        
-        # Upsert to Supabase (insert or update)
-        result = supabase.table('items').upsert(supabase_items).execute()
-        print(f"   ✅ Synced {len(result.data)} items to Supabase")
+        synced = sync_doctype("Item", ITEM_FIELDS, "items", transform_item, state, incremental, force=force)
+        print(f"   ✅ Synced {synced} changed items to Supabase")
         
     except Exception as e:
         print(f"   ❌ Error syncing items: {e}")
 
-def sync_warehouses():
-    """Sync all warehouses from ERPNext to Supabase"""
+def sync_warehouses(state, incremental=False, force=False):
+    """Sync warehouses from ERPNext to Supabase"""
     print("🔄 Syncing warehouses from ERPNext...")
     
     try:
-        # Fetch all warehouses from ERPNext
-        response = erpnext.get("/api/resource/Warehouse", params={
-            "fields": '["name","warehouse_name","parent_warehouse","is_group","custom_warehouse_barcode","company"]',
-            "limit_page_length": 5000
-        })
-        
-        warehouses = response.get("data", [])
-        print(f"   Found {len(warehouses)} warehouses in ERPNext")
-        
-        if not warehouses:
-            print("   ⚠️  No warehouses found!")
-            return
-        
-        # Transform for Supabase
-        supabase_warehouses = []
-        for wh in warehouses:
-            supabase_warehouses.append({
-                "name": wh["name"],
-                "warehouse_name": wh.get("warehouse_name", wh["name"]),
-                "parent_warehouse": wh.get("parent_warehouse"),
-                "is_group": wh.get("is_group", 0) == 1,
-                "custom_warehouse_barcode": wh.get("custom_warehouse_barcode"),
-                "company": wh.get("company"),
-                "last_synced": datetime.utcnow().isoformat()
-            })
-        
-        # Upsert to Supabase
-        result = supabase.table('warehouses').upsert(supabase_warehouses).execute()
-        print(f"   ✅ Synced {len(result.data)} warehouses to Supabase")
+        synced = sync_doctype("Warehouse", WAREHOUSE_FIELDS, "warehouses", transform_warehouse, state, incremental, force=force)
+        print(f"   ✅ Synced {synced} changed warehouses to Supabase")
         
     except Exception as e:
         print(f"   ❌ Error syncing warehouses: {e}")
 
-def sync_stock_balance():
+def sync_stock_balance(state, incremental=False, force=False):
     """Sync stock balance from ERPNext to Supabase"""
     print("🔄 Syncing stock balance from ERPNext...")
     
     try:
-        # Fetch all stock levels from ERPNext
-        response = erpnext.get("/api/resource/Bin", params={
-            "fields": '["item_code","warehouse","actual_qty","reserved_qty"]',
-            "filters": '[["actual_qty",">",0]]',  # Only non-zero stock
-            "limit_page_length": 5000
-        })
-        
-        stock_data = response.get("data", [])
-        print(f"   Found {len(stock_data)} stock records in ERPNext")
-        
-        if not stock_data:
-            print("   ⚠️  No stock data found!")
-            return
-        
-        # Transform for Supabase
-        supabase_stock = []
-        for stock in stock_data:
-            actual_qty = float(stock.get("actual_qty", 0))
-            reserved_qty = float(stock.get("reserved_qty", 0))
-            
-            supabase_stock.append({
-                "item_code": stock["item_code"],
-                "warehouse": stock["warehouse"],
-                "actual_qty": actual_qty,
-                "reserved_qty": reserved_qty,
-                "available_qty": actual_qty - reserved_qty,
-                "last_updated": datetime.utcnow().isoformat()
-            })
-        
-        # Upsert to Supabase
-        result = supabase.table('stock_balance').upsert(supabase_stock).execute()
-        print(f"   ✅ Synced {len(result.data)} stock records to Supabase")
+        # Full sync only needs non-zero stock; deltas must include bins that dropped to zero
+        filters = None if incremental else [["actual_qty", ">", 0]]
+        synced = sync_doctype("Bin", BIN_FIELDS, "stock_balance", transform_stock, state, incremental, filters, force)
+        print(f"   ✅ Synced {synced} changed stock records to Supabase")
         
     except Exception as e:
         print(f"   ❌ Error syncing stock: {e}")
 
+# Tombstone reconciliation: (doctype, ERPNext key fields, Supabase table, key columns)
+# Children first so foreign keys never block a delete
+RECONCILE_TABLES = [
+    ("Bin", ["item_code", "warehouse"], "stock_balance", ["item_code", "warehouse"]),
+    ("Item", ["item_code"], "items", ["item_code"]),
+    ("Warehouse", ["name"], "warehouses", ["name"]),
+]
+
+def fetch_supabase_keys(table, columns, page_size=1000):
+    """All primary keys currently in a Supabase table"""
+    keys = set()
+    start = 0
+    while True:
+        rows = supabase.table(table).select(",".join(columns)).range(start, start + page_size - 1).execute().data
+        keys.update(tuple(r[c] for c in columns) for r in rows)
+        if len(rows) < page_size:
+            return keys
+        start += page_size
+
+def reconcile_deletions(state):
+    """Delete Supabase rows whose ERPNext document no longer exists"""
+    print("🧹 Reconciling deletions (tombstones)...")
+    
+    for doctype, fields, table, columns in RECONCILE_TABLES:
+        try:
+            erp_keys = {tuple(r[f] for f in fields) for r in erpnext.get_all(doctype, fields)}
+            if not erp_keys:
+                print(f"   ⚠️  ERPNext returned no {doctype} rows - skipping deletes for safety")
+                continue
+            stale = fetch_supabase_keys(table, columns) - erp_keys
+            if len(columns) == 1:
+                stale_values = [k[0] for k in stale]
+                for i in range(0, len(stale_values), 100):
+                    supabase.table(table).delete().in_(columns[0], stale_values[i:i+100]).execute()
+            else:
+                for key in stale:
+                    query = supabase.table(table).delete()
+                    for column, value in zip(columns, key):
+                        query = query.eq(column, value)
+                    query.execute()
+            digests.forget(table, stale)  # a re-created row must sync again
+            print(f"   ✅ {table}: removed {len(stale)} deleted row(s)")
+        except Exception as e:
+            print(f"   ❌ Error reconciling {table}: {e}")
+    
+    state["last_reconcile"] = time.time()
+    save_state(state)
+
 def main():
+    parser = argparse.ArgumentParser(description="Sync ERPNext -> Supabase")
+    parser.add_argument("--incremental", action="store_true", help="only sync rows modified since the last run")
+    parser.add_argument("--reconcile", action="store_true", help="delete Supabase rows removed from ERPNext")
+    parser.add_argument("--force", action="store_true", help="upsert every row, even if its content hash is unchanged")
+    args = parser.parse_args()
+    
+    # Page fetch retries and failed rows are logged on "wms.*"; show them with the rest of the output
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(TextFormatter())
+    logging.getLogger("wms").addHandler(console)
+    
+    state = load_state()
+    mode = "INCREMENTAL" if args.incremental else "INITIAL"
+    
     print("\n" + "="*60)
-    print("🚀 INITIAL SYNC: ERPNext → Supabase")
+    print(f"🚀 {mode} SYNC: ERPNext → Supabase")
     print("="*60 + "\n")
     
     # Step 1: Sync items (must be first for foreign keys)
-    sync_items()
+    sync_items(state, args.incremental, args.force)
     
     # Step 2: Sync warehouses (must be second for foreign keys)
-    sync_warehouses()
+    sync_warehouses(state, args.incremental, args.force)
     
     # Step 3: Sync stock balance (depends on items & warehouses)
-    sync_stock_balance()
+    sync_stock_balance(state, args.incremental, args.force)
+    
+    # Step 4: Periodically remove rows deleted in ERPNext (deltas never see deletions)
+    reconcile_due = time.time() - state.get("last_reconcile", 0) >= SYNC_RECONCILE_INTERVAL_HOURS * 3600
+    if args.reconcile or (args.incremental and reconcile_due):
+        reconcile_deletions(state)
     
     print("\n" + "="*60)
-    print("✅ INITIAL SYNC COMPLETE!")
+    print(f"✅ {mode} SYNC COMPLETE!")
     print("="*60 + "\n")
     
     # Print summary
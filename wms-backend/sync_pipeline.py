@@ -0,0 +1,165 @@
+"""
+Sync pipeline stage: streaming, adaptively-batched upserts
+Rows go in as they are fetched; batches are upserted concurrently with retries
+"""
+
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger("wms.sync_pipeline")
+
+
+class UpsertError(Exception):
+    pass
+
+
+class BatchUpserter:
+    """
+    Buffer streamed rows into batches and upsert them with bounded concurrency.
+
+    `upsert(table, rows)` is a blocking callable (e.g. a Supabase upsert); it runs
+    on worker threads. Batch size adapts to latency: it grows while batches finish
+    under `target_seconds` and halves when they are slow or fail. A failed batch is
+    retried on its own with backoff, then split in half to isolate bad rows.
+
+    `add(rows, marker)` tags a point in the stream (e.g. a page number);
+    `on_commit(marker)` fires once every row up to that point is upserted, so
+    callers can checkpoint even though batches complete out of order.
+    `on_batch(rows)` fires for every batch that landed. A row that still fails
+    once isolated is logged with its `key_fields` values.
+    """
+
+    def __init__(self, upsert, table, batch_size=500, min_batch=50, max_batch=5000,
+                 in_flight=4, retries=3, backoff=0.5, target_seconds=1.0, on_commit=None, on_batch=None,
+                 key_fields=()):
+        self.upsert = upsert
+        self.table = table
+        self.key_fields = key_fields
+        self.batch_size = batch_size
+        self.min_batch = min_batch
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self.target_seconds = target_seconds
+        self.on_commit = on_commit
+        self.on_batch = on_batch
+        self._slots = asyncio.Semaphore(in_flight)
+        self._tasks = set()
+        self._buffer = []
+        self._offset = 0  # rows handed to batches so far
+        self._committed = 0  # every row before this offset is upserted
+        self._done = {}  # completed batch start -> end, waiting for the prefix to reach it
+        self._markers = []  # (end_offset, marker) in stream order
+        self._started = None
+        self.rows = 0
+        self.batches = 0
+        self.retried = 0
+        self.failed_rows = 0
+
+    async def add(self, rows, marker=None):
+        """Queue rows; full batches are sent as soon as a slot frees up"""
+        if self._started is None:
+            self._started = time.perf_counter()
+        self._buffer.extend(rows)
+        if marker is not None:
+            self._markers.append((self._offset + len(self._buffer), marker))
+        while len(self._buffer) >= self.batch_size:
+            await self._send(self.batch_size)
+        self._advance()
+
+    async def close(self):
+        """Flush the remainder, wait for every batch; raise if any rows failed"""
+        if self._buffer:
+            await self._send(len(self._buffer))
+        if self._tasks:
+            await asyncio.gather(*self._tasks)
+        self._advance()
+        if self.failed_rows:
+            raise UpsertError(f"{self.failed_rows} {self.table} row(s) failed to upsert")
+        return self.stats()
+
+    async def abort(self):
+        """Drop unsent rows but let in-flight batches finish (and checkpoint)"""
+        self._buffer = []
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._advance()
+
+    async def _send(self, size):
+        batch, self._buffer = self._buffer[:size], self._buffer[size:]
+        start, self._offset = self._offset, self._offset + len(batch)
+        await self._slots.acquire()
+        task = asyncio.ensure_future(self._run(start, batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, start, batch):
+        try:
+            if await self._upsert_with_retries(batch):
+                self._done[start] = start + len(batch)
+                self._advance()
+        finally:
+            self._slots.release()
+
+    async def _upsert_with_retries(self, batch):
+        """Retry this batch alone; on repeated failure bisect it. Returns True if all rows landed."""
+        for attempt in range(self.retries + 1):
+            began = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.upsert, self.table, batch)
+            except Exception as e:
+                self._shrink()
+                if attempt == self.retries:
+                    if len(batch) == 1:
+                        logger.error("Row failed to upsert", extra={
+                            "table": self.table, "key": {field: batch[0].get(field) for field in self.key_fields},
+                            "retries": self.retries, "error": str(e)
+                        })
+                        self.failed_rows += 1
+                        return False
+                    half = len(batch) // 2
+                    left = await self._upsert_with_retries(batch[:half])
+                    right = await self._upsert_with_retries(batch[half:])
+                    return left and right
+                self.retried += 1
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+            self._tune(time.perf_counter() - began)
+            self.rows += len(batch)
+            self.batches += 1
+            if self.on_batch:
+                self.on_batch(batch)
+            return True
+
+    def _tune(self, seconds):
+        if seconds < self.target_seconds:
+            self.batch_size = min(self.max_batch, int(self.batch_size * 1.5))
+        elif seconds > self.target_seconds * 2:
+            self._shrink()
+
+    def _shrink(self):
+        self.batch_size = max(self.min_batch, self.batch_size // 2)
+
+    def _advance(self):
+        """Move the committed prefix forward and fire on_commit for covered markers"""
+        while self._committed in self._done:
+            self._committed = self._done.pop(self._committed)
+        marker = None
+        while self._markers and self._markers[0][0] <= self._committed:
+            marker = self._markers.pop(0)[1]
+        if marker is not None and self.on_commit:
+            self.on_commit(marker)
+
+    def stats(self):
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        return {
+            "table": self.table,
+            "rows": self.rows,
+            "batches": self.batches,
+            "retried": self.retried,
+            "failed_rows": self.failed_rows,
+            "batch_size": self.batch_size,
+            "seconds": round(elapsed, 2),
+            "rows_per_sec": round(self.rows / elapsed, 1) if elapsed else 0.0
+        }
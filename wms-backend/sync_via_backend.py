@@ -3,12 +3,17 @@ Smart Sync Service: Uses FastAPI Backend → Supabase
 This bypasses ERPNext API permission issues by using your working backend
 """
 
+import asyncio
+import logging
 import os
+import sys
 import requests
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from datetime import datetime
 import time
+from sync_pipeline import BatchUpserter
+from structured_logging import TextFormatter
 
 load_dotenv('.env')
 
@@ -21,13 +26,34 @@ supabase: Client = create_client(
 # Backend API URL (your FastAPI backend that already works!)
 BACKEND_URL = "http://localhost:8000"
 
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", 500))  # initial upsert batch size (adapts)
+SYNC_UPSERTS_IN_FLIGHT = int(os.getenv("SYNC_UPSERTS_IN_FLIGHT", 4))  # concurrent Supabase upserts
+LOCATIONS_ETAG_FILE = os.getenv("LOCATIONS_ETAG_FILE", ".locations.etag")  # version of the last synced locations list
+
+def supabase_upsert(table, rows):
+    supabase.table(table).upsert(rows).execute()
+
+async def upsert_all(table, rows, key_fields):
+    """Stream rows through the shared batching stage"""
+    upserter = BatchUpserter(supabase_upsert, table, batch_size=SYNC_BATCH_SIZE, in_flight=SYNC_UPSERTS_IN_FLIGHT,
+                             key_fields=key_fields)
+    await upserter.add(rows)
+    return await upserter.close()
+
 def sync_warehouses():
     """Sync warehouses via backend API"""
     print("🔄 Syncing warehouses via FastAPI backend...")
     
     try:
-        # Use your existing /api/locations endpoint
-        response = requests.get(f"{BACKEND_URL}/api/locations", timeout=30)
+        # Use your existing /api/locations endpoint; unchanged since the last sync -> 304, no download
+        headers = {}
+        if os.path.exists(LOCATIONS_ETAG_FILE):
+            with open(LOCATIONS_ETAG_FILE) as f:
+                headers["If-None-Match"] = f.read().strip()
+        response = requests.get(f"{BACKEND_URL}/api/locations", headers=headers, timeout=30)
+        if response.status_code == 304:
+            print("   ✅ Warehouses unchanged since the last sync")
+            return
         response.raise_for_status()
         warehouses = response.json()
         
@@ -50,14 +76,16 @@ def sync_warehouses():
                 "last_synced": datetime.utcnow().isoformat()
             })
         
-        # Batch upsert (chunks of 500)
-        batch_size = 500
-        for i in range(0, len(supabase_warehouses), batch_size):
-            batch = supabase_warehouses[i:i+batch_size]
-            supabase.table('warehouses').upsert(batch).execute()
-            print(f"   ✅ Synced batch {i//batch_size + 1} ({len(batch)} warehouses)")
+        # Adaptive, concurrent batch upserts (failed batches retried on their own)
+        stats = asyncio.run(upsert_all('warehouses', supabase_warehouses, ["name"]))
+        
+        print(f"   ✅ Total: {stats['rows']} warehouses synced to Supabase "
+              f"({stats['rows_per_sec']} rows/s, {stats['batches']} batches, {stats['retried']} retries)")
         
-        print(f"   ✅ Total: {len(supabase_warehouses)} warehouses synced to Supabase")
+        # Only remember the version once every row made it (otherwise the next run retries)
+        if response.headers.get("ETag") and not stats["failed_rows"]:
+            with open(LOCATIONS_ETAG_FILE, "w") as f:
+                f.write(response.headers["ETag"])
         
     except Exception as e:
         print(f"   ❌ Error syncing warehouses: {e}")
@@ -115,6 +143,11 @@ def test_backend_connection():
         return False
 
 def main():
+    # Rows that fail to upsert are logged on "wms.sync_pipeline"; show them with the rest of the output
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(TextFormatter())
+    logging.getLogger("wms").addHandler(console)
+    
     print("\n" + "="*60)
     print("🚀 SMART SYNC: FastAPI Backend → Supabase")
     print("="*60 + "\n")
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))  # fake_postgrest, fake_erpnext
+
+
+@pytest.fixture(scope="session")
+def wms(tmp_path_factory):
+    """The API module, configured for tests: no ERPNext traffic at startup, local stores under tmp_path"""
+    workdir = tmp_path_factory.mktemp("wms")
+    os.environ.update({
+        "ERPNEXT_URL": "http://erpnext", "CACHE_WARM_ON_STARTUP": "false", "ITEM_CATALOG_ENABLED": "false",
+        "IDEMPOTENCY_DB": str(workdir / "idempotency.sqlite"), "OUTBOX_DB": str(workdir / "outbox.sqlite")
+    })
+    import main
+    return main
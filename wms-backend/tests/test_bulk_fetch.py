@@ -0,0 +1,69 @@
+"""PagedFetcher against the fake ERPNext app, through httpx's ASGI transport"""
+
+import asyncio
+import bisect
+
+import httpx
+
+from bulk_fetch import PagedFetcher
+from fake_erpnext import build_catalog, create_app
+
+FIELDS = ["item_code", "warehouse", "actual_qty"]
+
+
+def bin_row(name):
+    return {"name": name, "item_code": name, "warehouse": "WH", "actual_qty": 1.0}
+
+
+async def fetch(app, after=None, between_pages=None, **options):
+    """Rows PagedFetcher streams from app; between_pages(rows read so far) runs after each page"""
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://erpnext") as client:
+        async def get(endpoint, params=None):
+            response = await client.get(endpoint, params=params)
+            response.raise_for_status()
+            return response.json()
+
+        fetcher = PagedFetcher(get, "Bin", FIELDS, page_size=50, after=after, **options)
+        rows = []
+        async for _, page in fetcher.pages():
+            rows.extend(page)
+            if between_pages:
+                between_pages(len(rows))
+        return rows, fetcher
+
+
+def bins_app(count):
+    app = create_app(latency_ms=0, catalog=build_catalog(num_items=count, num_locations=10, seed_csv=None))
+    return app, app.state.catalog["Bin"]
+
+
+def test_every_row_once_in_name_order():
+    app, bins = bins_app(1234)
+    rows, fetcher = asyncio.run(fetch(app, workers=4))
+    assert [r["item_code"] for r in rows] == [b["item_code"] for b in bins]
+    assert "name" not in rows[0]  # read for paging, not asked for
+    assert fetcher.last_name == bins[-1]["name"]
+
+
+def test_inserts_and_deletes_while_paging_shift_nothing():
+    app, bins = bins_app(1000)
+    before = {b["item_code"] for b in bins}
+    deleted = set()
+
+    def churn(read):
+        # Rows appear and disappear ahead of and behind the reader, as on a busy ERPNext
+        for name in (f"BIN-{read:06d}a", f"BIN-{read * 2:06d}b"):
+            bisect.insort(bins, bin_row(name), key=lambda b: b["name"])
+        victim = bins.pop(len(bins) // 2)
+        deleted.add(victim["item_code"])
+
+    rows, _ = asyncio.run(fetch(app, between_pages=churn, workers=4))
+    codes = [r["item_code"] for r in rows]
+    assert len(codes) == len(set(codes))
+    assert before - deleted <= set(codes)  # every row that was there throughout is read
+
+
+def test_resume_after_a_name():
+    app, bins = bins_app(300)
+    rows, _ = asyncio.run(fetch(app, after=bins[119]["name"], workers=3))
+    assert [r["item_code"] for r in rows] == [b["item_code"] for b in bins[120:]]
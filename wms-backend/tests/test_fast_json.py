@@ -0,0 +1,54 @@
+import gc
+import weakref
+
+from fast_json import BodyCache, accepts_gzip
+
+
+class Index:
+    def __init__(self, rows):
+        self.rows = rows
+
+
+def test_body_is_reused_while_the_source_is_the_same():
+    bodies = BodyCache()
+    index = Index([1, 2])
+    first = bodies.get("k", index, lambda: index.rows)
+    assert bodies.get("k", index, lambda: index.rows) is first
+    assert bodies.get("k", Index([1, 2]), lambda: [3]).body == b"[3]"
+    assert bodies.stats()["encodes"] == 2
+
+
+def test_replaced_source_is_collected_and_its_body_dropped():
+    bodies = BodyCache()
+    index = Index([1])
+    bodies.get("k", index, lambda: index.rows)
+    ref = weakref.ref(index)
+    del index
+    gc.collect()
+    assert ref() is None
+    bodies.put("other", None, bodies.encode([]))
+    assert "k" not in bodies.entries
+
+
+def test_content_version_stands_in_for_the_source():
+    bodies = BodyCache()
+    first = bodies.get("k", "v1", lambda: [1])
+    assert bodies.get("k", "v" + "1", lambda: [2]) is first
+    assert bodies.get("k", "v2", lambda: [2]).body == b"[2]"
+
+
+def test_plain_lists_are_not_stored():
+    bodies = BodyCache()
+    rows = [1, 2]
+    assert bodies.get("k", rows).body == b"[1,2]"
+    assert "k" not in bodies.entries
+
+
+def test_accepts_gzip():
+    assert accepts_gzip("gzip, deflate")
+    assert accepts_gzip("br;q=1.0, gzip;q=0.5")
+    assert accepts_gzip("*")
+    assert not accepts_gzip("gzip;q=0")
+    assert not accepts_gzip("gzip;q=0, *")
+    assert accepts_gzip("gzip;q=abc")
+    assert not accepts_gzip(None)
@@ -0,0 +1,70 @@
+import time
+
+import pytest
+
+from idempotency_store import IdempotencyConflict, IdempotencyStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return IdempotencyStore(str(tmp_path / "idempotency.sqlite"), ttl=60, lease=60)
+
+
+def test_completed_key_replays_its_response(store):
+    assert store.get("k", "a") is None
+    assert store.claim("k", "a") == "new"
+    store.complete("k", {"name": "STE-1"})
+    assert store.get("k", "a") == {"name": "STE-1"}
+    assert store.claim("k", "a") is False
+    assert store.stats()["replayed"] == 1
+
+
+def test_held_key_is_not_claimed_twice(store):
+    assert store.claim("k", "a") == "new"
+    assert store.claim("k", "a") is False
+    assert store.get("k", "a") is None  # still being created: the caller answers 409
+
+
+@pytest.mark.parametrize("complete", [False, True])
+def test_different_payload_conflicts(store, complete):
+    store.claim("k", "a")
+    if complete:
+        store.complete("k", {"name": "STE-1"})
+    with pytest.raises(IdempotencyConflict):
+        store.get("k", "b")
+
+
+def test_release_frees_the_key(store):
+    store.claim("k", "a")
+    store.release("k")
+    assert store.get("k", "b") is None
+    assert store.claim("k", "b") == "new"
+
+
+def test_unsure_release_asks_the_next_claim_to_check(store):
+    store.claim("k", "a")
+    store.release("k", unsure=True)
+    assert store.get("k", "a") is None
+    with pytest.raises(IdempotencyConflict):
+        store.claim("k", "b")
+    assert store.claim("k", "a") == "retry"
+    assert store.claim("k", "a") is False  # held again
+
+
+def test_expired_claim_is_retried_with_a_check(tmp_path):
+    store = IdempotencyStore(str(tmp_path / "idempotency.sqlite"), ttl=60, lease=0.01)
+    store.claim("k", "a")
+    time.sleep(0.02)  # the worker holding it crashed
+    assert store.claim("k", "a") == "retry"
+    store.complete("k", {"name": "STE-1"})
+    assert store.get("k", "a") == {"name": "STE-1"}
+
+
+def test_purge_drops_expired_done_keys(tmp_path):
+    store = IdempotencyStore(str(tmp_path / "idempotency.sqlite"), ttl=0.01, lease=60)
+    store.claim("k", "a")
+    store.complete("k", {"name": "STE-1"})
+    time.sleep(0.02)
+    assert store.get("k", "a") is None
+    assert store.purge() == 1
+    assert store.claim("k", "b") == "new"
@@ -0,0 +1,93 @@
+import asyncio
+import time
+
+import pytest
+
+from idempotency_store import IdempotencyConflict
+from outbox import Outbox
+
+
+class Transient(Exception):
+    pass
+
+
+class Rejected(Exception):
+    pass
+
+
+def run_outbox(path, entries, fail, workers=3):
+    """
+    Queue entries ((partition, n) pairs), drain them with a send that raises fail(n, attempt)
+    when it returns an exception, and return (outbox, order of successful sends)
+    """
+    sent = []
+    attempts = {}
+
+    async def send(entry, outbox_id):
+        n = entry["n"]
+        attempts[n] = attempts.get(n, 0) + 1
+        await asyncio.sleep(0.001 * (n % 3))  # partitions finish out of step
+        error = fail(n, attempts[n])
+        if error is not None:
+            raise error
+        sent.append((entry["partition"], n))
+        return {"name": f"STE-{n}"}
+
+    async def run():
+        outbox = Outbox(path, send, permanent=lambda e: isinstance(e, Rejected), workers=workers,
+                        backoff=0.001, poll_interval=0.01)
+        for partition, n in entries:
+            outbox.enqueue({"partition": partition, "n": n}, partition)
+        outbox.start()
+        for _ in range(500):
+            stats = outbox.stats()
+            if stats["queued"] == stats["sending"] == 0:
+                break
+            await asyncio.sleep(0.01)
+        await outbox.stop()
+        return outbox
+
+    return asyncio.run(run()), sent
+
+
+def test_partitions_drain_in_order_across_retries(tmp_path):
+    entries = [("A" if n % 2 == 0 else "B", n) for n in range(12)]
+    # Every third entry fails twice before it goes through
+    outbox, sent = run_outbox(str(tmp_path / "outbox.sqlite"), entries,
+                              lambda n, attempt: Transient() if n % 3 == 0 and attempt <= 2 else None)
+
+    assert [n for p, n in sent if p == "A"] == [0, 2, 4, 6, 8, 10]
+    assert [n for p, n in sent if p == "B"] == [1, 3, 5, 7, 9, 11]
+    stats = outbox.stats()
+    assert stats["done"] == 12 and stats["failed"] == 0
+    assert stats["retried"] == 2 * 4
+
+
+def test_permanent_failure_does_not_block_its_partition(tmp_path):
+    entries = [("A", 1), ("A", 2), ("A", 3)]
+    outbox, sent = run_outbox(str(tmp_path / "outbox.sqlite"), entries,
+                              lambda n, attempt: Rejected("bad item") if n == 2 else None)
+
+    assert sent == [("A", 1), ("A", 3)]
+    assert outbox.get(2)["status"] == "failed"
+    assert outbox.get(2)["error"] == "bad item"
+    assert outbox.get(3)["name"] == "STE-3"
+
+
+def test_claim_of_a_crashed_worker_expires(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"), send=None, lease=0.01)
+    outbox.enqueue({"n": 1}, "A")
+    outbox.enqueue({"n": 2}, "A")
+    assert outbox.claim()[0] == 1
+    assert outbox.claim() is None  # 1 is being sent; 2 waits behind it
+    time.sleep(0.02)
+    outbox_id, entry, attempts = outbox.claim()
+    assert (outbox_id, attempts) == (1, 2)
+
+
+def test_idempotency_key_dedupes_and_checks_the_payload(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite"), send=None)
+    assert outbox.enqueue({"n": 1}, "A", "key-1", "digest-a") == (1, True)
+    assert outbox.enqueue({"n": 1}, "A", "key-1", "digest-a") == (1, False)
+    with pytest.raises(IdempotencyConflict):
+        outbox.enqueue({"n": 2}, "A", "key-1", "digest-b")
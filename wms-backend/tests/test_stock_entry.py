@@ -0,0 +1,162 @@
+"""Stock entries through the API, against a mocked ERPNext"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+
+class FakeERPNext:
+    """Stock Entry create, list and get; `fail(doc)` returns an httpx.Response or exception to answer a POST with"""
+
+    def __init__(self):
+        self.created = []
+        self.posts = 0
+        self.fail = lambda doc: None
+
+    def __call__(self, request):
+        if request.method == "GET":
+            name = request.url.path.partition("/api/resource/Stock Entry/")[2]
+            if name:
+                return httpx.Response(200, json={"data": next(d for d in self.created if d["name"] == name)})
+            field, _, pattern = json.loads(request.url.params["filters"])[0]
+            needle = pattern.strip("%")
+            return httpx.Response(200, json={"data": [{"name": d["name"]} for d in self.created
+                                                      if needle in d[field]][:1]})
+        doc = json.loads(request.content)
+        self.posts += 1
+        failure = self.fail(doc)
+        if isinstance(failure, httpx.Response):
+            return failure
+        doc["name"] = f"STE-{len(self.created) + 1}"
+        self.created.append(doc)  # a timeout below still leaves the draft behind, as on a slow ERPNext
+        if failure is not None:
+            raise failure
+        return httpx.Response(200, json={"data": doc})
+
+
+@pytest.fixture
+def erpnext(wms, monkeypatch):
+    fake = FakeERPNext()
+    monkeypatch.setattr(wms.erpnext, "_client", httpx.AsyncClient(transport=httpx.MockTransport(fake)))
+    return fake
+
+
+@pytest.fixture
+def post(wms):
+    """post((path, body), ...) runs the requests in order against the app and returns the responses"""
+    def post(*calls):
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=wms.app), base_url="http://wms") as client:
+                return [await client.post(path, json=body) for path, body in calls]
+        return asyncio.run(run())
+    return post
+
+
+def entry(key=None, item="RM-1", qty=1, warehouse="DOCK-1"):
+    return {"purpose": "Material Receipt", "to_warehouse": warehouse, "idempotency_key": key,
+            "items": [{"item_code": item, "qty": qty}]}
+
+
+def bulk(items, prefix=None):
+    return {"entries": [entry(f"{prefix}-{i}" if prefix else None, item=item) for i, item in enumerate(items)]}
+
+
+def test_bulk_merges_compatible_entries(erpnext, post):
+    (response,) = post(("/api/stock-entry/bulk", bulk(["RM-1", "RM-2", "RM-3"])))
+    results = response.json()["results"]
+    assert [r["status"] for r in results] == ["created"] * 3
+    assert {r["name"] for r in results} == {"STE-1"}
+    assert len(erpnext.created[0]["items"]) == 3
+
+
+def test_bulk_splits_a_rejected_group(erpnext, post):
+    erpnext.fail = lambda doc: (httpx.Response(417, json={"message": "Could not find Item: BAD"})
+                                if any(i["item_code"] == "BAD" for i in doc["items"]) else None)
+    (response,) = post(("/api/stock-entry/bulk", bulk(["RM-1", "BAD", "RM-2"])))
+    assert [r["status"] for r in response.json()["results"]] == ["created", "failed", "created"]
+    assert erpnext.posts == 4  # the merged document, then each entry alone
+
+
+def test_bulk_fails_the_group_on_a_transient_error(erpnext, post):
+    erpnext.fail = lambda doc: httpx.Response(503, text="busy")
+    (response,) = post(("/api/stock-entry/bulk", bulk(["RM-1", "RM-2", "RM-3"], prefix="busy")))
+    assert [r["status"] for r in response.json()["results"]] == ["failed"] * 3
+    assert erpnext.posts == 1
+
+    erpnext.fail = lambda doc: None
+    (retry,) = post(("/api/stock-entry/bulk", bulk(["RM-1", "RM-2", "RM-3"], prefix="busy")))
+    assert [r["status"] for r in retry.json()["results"]] == ["created"] * 3
+
+
+def test_replay_returns_the_stored_draft(erpnext, post):
+    first, replay = post(("/api/stock-entry", entry("replay-1")), ("/api/stock-entry", entry("replay-1")))
+    assert first.status_code == replay.status_code == 200
+    assert replay.json() == first.json()
+    assert erpnext.posts == 1
+
+
+def test_key_reused_for_another_payload_is_rejected(erpnext, post):
+    _, other = post(("/api/stock-entry", entry("reuse-1")), ("/api/stock-entry", entry("reuse-1", qty=2)))
+    assert other.status_code == 422
+
+
+def test_held_key_answers_409_or_422_for_another_payload(wms, erpnext, post):
+    wms.idempotency.claim("held-1", wms.entry_digest(wms.StockEntryCreate(**entry("held-1"))))
+    same, other = post(("/api/stock-entry", entry("held-1")), ("/api/stock-entry", entry("held-1", qty=2)))
+    assert same.status_code == 409
+    assert other.status_code == 422
+    assert erpnext.posts == 0
+
+
+def test_timed_out_draft_is_found_instead_of_posted_again(erpnext, post):
+    erpnext.fail = lambda doc: httpx.ReadTimeout("slow")
+    (failed,) = post(("/api/stock-entry", entry("slow-1")))
+    assert failed.status_code == 500
+    erpnext.fail = lambda doc: None
+    retry, replay = post(("/api/stock-entry", entry("slow-1")), ("/api/stock-entry", entry("slow-1")))
+    assert retry.status_code == 200
+    assert retry.json() == erpnext.created[0]  # the whole document, as a create returns it
+    assert replay.json() == retry.json()
+    assert erpnext.posts == 1
+
+
+def test_found_draft_answers_like_a_create(erpnext, post):
+    (created,) = post(("/api/stock-entry", entry("fresh-1")))
+    erpnext.fail = lambda doc: httpx.ReadTimeout("slow")
+    post(("/api/stock-entry", entry("slow-2")))
+    erpnext.fail = lambda doc: None
+    (found,) = post(("/api/stock-entry", entry("slow-2")))
+    assert found.json().keys() == created.json().keys()
+    assert found.json()["items"] == created.json()["items"]
+
+
+def test_bulk_stores_the_whole_document_of_a_found_draft(wms, erpnext, post):
+    erpnext.fail = lambda doc: httpx.ReadTimeout("slow")
+    post(("/api/stock-entry/bulk", bulk(["RM-1"], prefix="slow-bulk")))
+    erpnext.fail = lambda doc: None
+    (found,) = post(("/api/stock-entry/bulk", bulk(["RM-1"], prefix="slow-bulk")))
+    assert found.json()["results"][0]["status"] == "replayed"
+    (replay,) = post(("/api/stock-entry", entry("slow-bulk-0")))
+    assert replay.json() == erpnext.created[0]
+    assert erpnext.posts == 1
+
+
+def test_bulk_replays_completed_keys(erpnext, post):
+    first, again = post(("/api/stock-entry/bulk", bulk(["RM-1", "RM-2"], prefix="bulk-replay")),
+                        ("/api/stock-entry/bulk", bulk(["RM-1", "RM-2"], prefix="bulk-replay")))
+    assert [r["status"] for r in again.json()["results"]] == ["replayed"] * 2
+    assert erpnext.posts == 1
+
+
+def test_queue_acknowledges_once_per_key_and_checks_the_payload(wms, erpnext, post, monkeypatch):
+    monkeypatch.setattr(wms, "OUTBOX_ENABLED", True)
+    first, again, other = post(("/api/stock-entry/queue", entry("queued-1")),
+                               ("/api/stock-entry/queue", entry("queued-1")),
+                               ("/api/stock-entry/queue", entry("queued-1", qty=2)))
+    assert first.status_code == again.status_code == 202
+    assert first.json()["duplicate"] is False
+    assert again.json()["duplicate"] is True
+    assert again.json()["id"] == first.json()["id"]
+    assert other.status_code == 422
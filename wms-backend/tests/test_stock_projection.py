@@ -0,0 +1,63 @@
+"""Stock projection reconciles against a scripted ERPNext client"""
+
+import asyncio
+import json
+
+from stock_projection import StockProjection
+
+MOVE = [{"item_code": "ITEM-1", "s_warehouse": "A", "t_warehouse": "B", "qty": 5}]
+
+
+class FakeClient:
+    """Bin and Stock Entry lists; `on_bins()` runs after a Bin page is read"""
+
+    def __init__(self):
+        self.bins = {("ITEM-1", "A"): 10.0, ("ITEM-1", "B"): 0.0}
+        self.docstatus = {}
+        self.on_bins = lambda: None
+
+    def submit(self, name, items):
+        self.docstatus[name] = 1
+        for item in items:
+            self.bins[(item["item_code"], item["s_warehouse"])] -= item["qty"]
+            self.bins[(item["item_code"], item["t_warehouse"])] += item["qty"]
+
+    async def get(self, endpoint, params=None):
+        filters = json.loads(params.get("filters", "[]"))
+        if endpoint.endswith("/Bin"):
+            rows = [{"name": f"{i}-{w}", "item_code": i, "warehouse": w, "actual_qty": q, "reserved_qty": 0}
+                    for (i, w), q in sorted(self.bins.items())]
+            self.on_bins()
+            return {"data": [r for r in rows if not filters or r["name"] > filters[0][2]]}
+        names = next(f[2] for f in filters if f[1] == "in")
+        return {"data": [{"name": n, "docstatus": self.docstatus[n]} for n in sorted(names) if n in self.docstatus]}
+
+
+def test_draft_submitted_during_a_reconcile_is_not_lost():
+    client, projection = FakeClient(), StockProjection()
+    asyncio.run(projection.seed(client))
+    projection.apply(MOVE, "STE-1")
+    client.docstatus["STE-1"] = 0
+
+    # Submitted right after the Bin snapshot was read: the snapshot does not count it yet
+    client.on_bins = lambda: (client.submit("STE-1", MOVE), setattr(client, "on_bins", lambda: None))
+    drift = asyncio.run(projection.reconcile(client))
+    assert drift["drifted"] == 0
+    assert projection.balance("ITEM-1", "B")["actual_qty"] == 5.0
+    assert "STE-1" in projection.drafts
+
+    # The next reconcile finds it submitted and in the Bins
+    drift = asyncio.run(projection.reconcile(client))
+    assert drift["drifted"] == 0
+    assert projection.balance("ITEM-1", "A")["actual_qty"] == 5.0
+    assert projection.drafts == {}
+
+
+def test_cancelled_draft_is_dropped():
+    client, projection = FakeClient(), StockProjection()
+    asyncio.run(projection.seed(client))
+    projection.apply(MOVE, "STE-1")
+    client.docstatus["STE-1"] = 2
+    asyncio.run(projection.reconcile(client))
+    assert projection.balance("ITEM-1", "B")["actual_qty"] == 0.0
+    assert projection.drafts == {}
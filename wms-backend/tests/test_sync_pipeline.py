@@ -0,0 +1,88 @@
+"""BatchUpserter against the fake PostgREST app, through httpx's ASGI transport"""
+
+import asyncio
+import logging
+import random
+
+import httpx
+
+from fake_postgrest import create_app
+from sync_pipeline import BatchUpserter, UpsertError
+
+PAGE_SIZE = 100
+
+
+def make_rows(n, bad=()):
+    """stock_balance rows; indexes in `bad` lack their item_code (the fake rejects their batch)"""
+    return [{"item_code": None if i in bad else f"RM-{i:06d}", "warehouse": f"WH-{i % 7}", "actual_qty": float(i)}
+            for i in range(n)]
+
+
+async def sync(rows, failure_rate=0.0, **options):
+    """
+    Stream rows a page at a time (marker = page number).
+    Returns (stored rows, upserter, commits, UpsertError or None); each commit is
+    (page, whether every row up to that page had landed when it fired)
+    """
+    app = create_app(latency_ms=0, row_cost_us=0, failure_rate=failure_rate)
+    loop = asyncio.get_running_loop()
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://postgrest")
+
+    def upsert(table, batch):
+        # BatchUpserter runs upsert on a worker thread; the request itself runs on the test's loop
+        response = asyncio.run_coroutine_threadsafe(client.post(f"/rest/v1/{table}", json=batch), loop).result()
+        response.raise_for_status()
+
+    commits = []
+
+    def on_commit(page):
+        stored = app.state.tables.get("stock_balance", {})
+        landed = all((row["item_code"], row["warehouse"]) in stored for row in rows[:(page + 1) * PAGE_SIZE])
+        commits.append((page, landed))
+
+    upserter = BatchUpserter(upsert, "stock_balance", batch_size=64, min_batch=1, in_flight=4, backoff=0,
+                             on_commit=on_commit, **options)
+    error = None
+    try:
+        for page in range(len(rows) // PAGE_SIZE):
+            await upserter.add(rows[page * PAGE_SIZE:(page + 1) * PAGE_SIZE], marker=page)
+        await upserter.close()
+    except UpsertError as e:
+        error = e
+    finally:
+        await client.aclose()
+    return app.state.tables.get("stock_balance", {}), upserter, commits, error
+
+
+def test_every_row_lands_despite_failures():
+    random.seed(9)  # the fake's injected 503s
+    rows = make_rows(3000)
+    stored, upserter, commits, error = asyncio.run(sync(rows, failure_rate=0.3, retries=6))
+
+    assert error is None
+    assert len(stored) == len(rows)
+    stats = upserter.stats()
+    assert stats["rows"] == len(rows)
+    assert stats["failed_rows"] == 0
+    assert stats["retried"] > 0
+    pages = [page for page, _ in commits]
+    assert pages == sorted(set(pages))
+    assert pages[-1] == len(rows) // PAGE_SIZE - 1
+    # Batches finish out of order, but a page commits only once every row before it landed
+    assert all(landed for _, landed in commits)
+
+
+def test_bad_rows_are_isolated_and_reported(caplog):
+    bad = {450, 1234}
+    rows = make_rows(2000, bad=bad)
+    with caplog.at_level(logging.ERROR, logger="wms.sync_pipeline"):
+        stored, upserter, commits, error = asyncio.run(sync(rows, retries=1, key_fields=["item_code", "warehouse"]))
+
+    assert upserter.stats()["failed_rows"] == len(bad)
+    assert "2 stock_balance row(s) failed" in str(error)
+    assert sorted((r.table, r.key["warehouse"]) for r in caplog.records) == \
+        [("stock_balance", "WH-2"), ("stock_balance", "WH-2")]  # 450 % 7, 1234 % 7
+    assert len(stored) == len(rows) - len(bad)  # bisection lands every other row of the rejected batches
+    assert commits and all(landed for _, landed in commits)
+    last_page = commits[-1][0]
+    assert (last_page + 1) * PAGE_SIZE <= min(bad)  # never checkpoints past a failed row
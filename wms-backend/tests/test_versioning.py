@@ -0,0 +1,107 @@
+import asyncio
+import threading
+
+import pytest
+
+from versioning import RowsVersion, VersionedRows, etag, etag_matches, keyed_digests
+
+
+def rows(*specs):
+    return [{"name": name, "qty": qty} for name, qty in specs]
+
+
+def test_version_depends_on_content_not_order():
+    a = VersionedRows()
+    b = VersionedRows()
+    first = rows(("A", 1), ("B", 2))
+    second = list(reversed(rows(("A", 1), ("B", 2))))
+    assert a.observe(first, lambda: keyed_digests(first, "name")).version == \
+        b.observe(second, lambda: keyed_digests(second, "name")).version
+
+
+def test_same_source_is_not_rehashed():
+    versions = VersionedRows()
+    source = rows(("A", 1))
+    versions.observe(source, lambda: keyed_digests(source, "name"))
+    versions.observe(source, lambda: pytest.fail("hashed again"))
+    assert versions.stats()["computed"] == 1
+
+
+def test_changes_since_a_version():
+    versions = VersionedRows()
+    old = rows(("A", 1), ("B", 2), ("C", 3))
+    v1 = versions.observe(old, lambda: keyed_digests(old, "name")).version
+    new = rows(("A", 1), ("C", 4), ("D", 5))
+    v2 = versions.observe(new, lambda: keyed_digests(new, "name")).version
+
+    assert v1 != v2
+    upserted, removed = versions.changes(v1)
+    assert [new[pos]["name"] for pos in upserted] == ["C", "D"]
+    assert removed == ["B"]
+    assert versions.changes(v2) == ([], [])
+    assert versions.changes("unknown") is None
+
+
+def test_changes_against_a_captured_version():
+    versions = VersionedRows()
+    old = rows(("A", 1))
+    v1 = versions.observe(old, lambda: keyed_digests(old, "name")).version
+    mid = rows(("A", 2))
+    captured = versions.observe(mid, lambda: keyed_digests(mid, "name"))
+    new = rows(("A", 3), ("B", 1))
+    versions.observe(new, lambda: keyed_digests(new, "name"))
+
+    # A request that observed `mid` keeps answering for it after a newer source arrived
+    assert versions.changes(v1, captured) == ([0], [])
+
+
+def test_older_source_is_not_adopted_after_a_newer_one():
+    versions = VersionedRows()
+    old, new = rows(("A", 1)), rows(("A", 2))
+    old_ticket, new_ticket = versions.begin(), versions.begin()
+    new_version = versions.adopt(new, RowsVersion.of(lambda: keyed_digests(new, "name")), new_ticket)
+    old_version = versions.adopt(old, RowsVersion.of(lambda: keyed_digests(old, "name")), old_ticket)
+
+    assert versions.current is new_version
+    assert old_version.version != new_version.version  # the late request still answers for its own rows
+    assert versions.stats()["superseded"] == 1
+
+
+def test_slow_thread_build_does_not_move_the_version_back(wms):
+    versions = VersionedRows()
+    old, new = rows(("A", 1)), rows(("A", 2))
+    release = threading.Event()
+
+    def slow_old_digests():
+        release.wait(5)
+        return keyed_digests(old, "name")
+
+    async def run():
+        older = asyncio.ensure_future(wms.observe(versions, old, slow_old_digests))
+        await asyncio.sleep(0.01)  # the old list's build is running in its thread
+        newer = await wms.observe(versions, new, lambda: keyed_digests(new, "name"))
+        release.set()
+        return await older, newer
+
+    older, newer = asyncio.run(run())
+    assert versions.current is newer
+    assert older.version != newer.version
+
+
+def test_old_versions_are_forgotten():
+    versions = VersionedRows(max_versions=2)
+    seen = []
+    for qty in range(3):
+        source = rows(("A", qty))
+        seen.append(versions.observe(source, lambda: keyed_digests(source, "name")).version)
+    assert versions.changes(seen[0]) is None
+    assert versions.changes(seen[1]) == ([0], [])
+
+
+def test_etag_matching():
+    assert etag("abc") == 'W/"abc"'
+    assert etag_matches('W/"abc"', "abc")
+    assert etag_matches('"x", "abc"', "abc")
+    assert etag_matches("*", "abc")
+    assert not etag_matches('W/"abd"', "abc")
+    assert not etag_matches(None, "abc")
@@ -0,0 +1,151 @@
+"""
+Content versions and deltas for the list endpoints
+A version is a hash of every row's encoded JSON, so workers holding the same data
+agree on it; recent versions keep a digest per row so clients can ask what changed
+"""
+
+import hashlib
+from collections import OrderedDict
+
+from fast_json import dumps
+
+
+def row_digest(encoded):
+    """64-bit digest of a row's encoded JSON"""
+    return int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "little")
+
+
+def keyed_digests(rows, key_field):
+    """(keys, digests) of an in-memory row list"""
+    return [row[key_field] for row in rows], [row_digest(dumps(row)) for row in rows]
+
+
+def version_of(keys, digests):
+    h = hashlib.blake2b(digest_size=8)
+    for key, digest in sorted(zip(keys, digests)):
+        h.update(key.encode())
+        h.update(b"\0")
+        h.update(digest.to_bytes(8, "little"))
+    return h.hexdigest()
+
+
+def etag(version):
+    # Weak: the same version is sent gzipped or not
+    return f'W/"{version}"'
+
+
+def etag_matches(if_none_match, version):
+    """True if an If-None-Match header names this version (or is *)"""
+    if not if_none_match or version is None:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/").strip('"') == version:
+            return True
+    return False
+
+
+def delta_json(version, full, upserted_json, removed):
+    """Delta body; upserted_json is the already-encoded array of added/changed rows"""
+    return (b'{"version":' + dumps(version) + b',"full":' + (b"true" if full else b"false") +
+            b',"upserted":' + bytes(upserted_json) + b',"removed":' + dumps(removed) + b"}")
+
+
+def diff(old, current):
+    """(ascending positions of added/changed rows, removed keys) from old ({key: digest}) to a RowsVersion"""
+    upserted = sorted(current.positions[key] for key, digest in current.digests.items() if old.get(key) != digest)
+    removed = [key for key in old if key not in current.digests]
+    return upserted, removed
+
+
+class RowsVersion:
+    """One version of a dataset: digest and row position per key. Never changed once built."""
+
+    __slots__ = ("version", "digests", "positions")
+
+    def __init__(self, version, digests, positions):
+        self.version = version
+        self.digests = digests  # key -> digest
+        self.positions = positions  # key -> row position in its source
+
+    @classmethod
+    def of(cls, keys_and_digests):
+        """Version of keys_and_digests(); touches no shared state, so it can run in a worker thread"""
+        keys, digests = keys_and_digests()
+        return cls(version_of(keys, digests), dict(zip(keys, digests)), {key: pos for pos, key in enumerate(keys)})
+
+    def entries(self):
+        """(key, position, digest) of every row, in row order"""
+        return [(key, pos, self.digests[key]) for key, pos in self.positions.items()]
+
+
+class VersionedRows:
+    """
+    Version of the current source (a cached list, an index or a snapshot) of one
+    dataset, plus the row digests of recent versions for `since` deltas.
+    Sources versioned elsewhere take a begin() ticket first; adopt() ignores a
+    source whose ticket is older than the current one, so versions never go back.
+    """
+
+    def __init__(self, max_versions=8):
+        self.max_versions = max_versions
+        self.source = None
+        self.current = None  # RowsVersion of source
+        self.history = OrderedDict()  # version -> {key: digest}, oldest first
+        self.computed = 0
+        self.tickets = 0  # handed out by begin()
+        self.adopted = 0  # ticket of the current source
+        self.superseded = 0
+
+    @property
+    def version(self):
+        return self.current.version if self.current is not None else None
+
+    def observe(self, source, keys_and_digests):
+        """RowsVersion of source; keys_and_digests() is only called for a new source"""
+        if source is self.source:
+            return self.current
+        return self.adopt(source, RowsVersion.of(keys_and_digests))
+
+    def begin(self):
+        """Ticket for a source about to be versioned elsewhere (e.g. in a thread), in the order sources arrive"""
+        self.tickets += 1
+        return self.tickets
+
+    def adopt(self, source, current, ticket=None):
+        """
+        Make source, whose RowsVersion was built elsewhere, the current one. With the
+        begin() ticket taken before the build, a build that finishes after a newer
+        source was adopted is not adopted; its RowsVersion is still returned.
+        """
+        if ticket is None:
+            ticket = self.begin()
+        if source is self.source:
+            self.adopted = max(self.adopted, ticket)
+            return current
+        if ticket < self.adopted:
+            self.superseded += 1
+            return current
+        self.adopted = ticket
+        self.history[current.version] = current.digests
+        self.history.move_to_end(current.version)
+        while len(self.history) > self.max_versions:
+            self.history.popitem(last=False)
+        self.source, self.current = source, current
+        self.computed += 1
+        return current
+
+    def changes(self, since, current=None):
+        """(ascending positions of added/changed rows, removed keys) since a version, or None if unknown"""
+        old = self.history.get(since)
+        if old is None:
+            return None
+        return diff(old, current or self.current)
+
+    def entries(self):
+        """(key, position, digest) of every row of the current version, in row order"""
+        return self.current.entries()
+
+    def stats(self):
+        return {"version": self.version, "versions_kept": len(self.history), "computed": self.computed,
+                "superseded": self.superseded}